@@ -0,0 +1,295 @@
+import math
+import threading
+from datetime import date, datetime
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él /api/analitica responde 503
+    np = None
+
+GRANULARIDADES = ('dia', 'semana', 'mes')
+KM_POR_GRADO = 111.32
+MAX_CELDAS_BINCOUNT = 20_000_000
+
+# Cabeceras cantonales de Manabí (nombre, lat, lng). Cada árbol se asigna a la cabecera más
+# cercana: es una aproximación a los límites cantonales reales, suficiente para el dashboard.
+CANTONES = [
+    ("24 de Mayo", -1.2680, -80.4180),
+    ("Bolívar", -0.8466, -80.1622),
+    ("Chone", -0.6982, -80.0936),
+    ("El Carmen", -0.2707, -79.4649),
+    ("Flavio Alfaro", -0.4028, -79.9056),
+    ("Jama", -0.2003, -80.2640),
+    ("Jaramijó", -0.9480, -80.6350),
+    ("Jipijapa", -1.3486, -80.5786),
+    ("Junín", -0.9290, -80.2064),
+    ("Manta", -0.9677, -80.7089),
+    ("Montecristi", -1.0458, -80.6589),
+    ("Olmedo", -1.3960, -80.2110),
+    ("Paján", -1.5536, -80.4258),
+    ("Pedernales", 0.0708, -80.0537),
+    ("Pichincha", -1.0460, -79.8210),
+    ("Portoviejo", -1.0546, -80.4545),
+    ("Puerto López", -1.5567, -80.8119),
+    ("Rocafuerte", -0.9226, -80.4495),
+    ("San Vicente", -0.5910, -80.4080),
+    ("Santa Ana", -1.2070, -80.3710),
+    ("Sucre", -0.6009, -80.4239),
+    ("Tosagua", -0.7866, -80.2340),
+]
+
+
+def disponible():
+    return np is not None
+
+
+def parse_fecha(valor, campo):
+    """'AAAA-MM-DD' -> date; None si no viene"""
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"'{campo}' debe tener el formato AAAA-MM-DD")
+
+
+def _dias(fechas):
+    """Fechas ISO -> días desde 1970-01-01 (int32); -1 si la fecha no se puede interpretar"""
+    prefijos = [f[:10] if isinstance(f, str) else '' for f in fechas]
+    try:
+        fechas = np.array(prefijos, dtype='datetime64[D]')
+    except ValueError:
+        fechas = np.full(len(prefijos), np.datetime64('NaT'), dtype='datetime64[D]')
+        for i, prefijo in enumerate(prefijos):
+            try:
+                fechas[i] = np.datetime64(prefijo, 'D')
+            except ValueError:
+                pass
+    return np.where(np.isnat(fechas), -1, fechas.astype(np.int64)).astype(np.int32)
+
+
+def _canton_mas_cercano(lat, lng):
+    """Índice en CANTONES de la cabecera más cercana a cada punto (distancia equirectangular)"""
+    mejor = np.full(len(lat), np.inf)
+    indice = np.zeros(len(lat), dtype=np.int8)
+    coseno = np.cos(np.radians(lat))
+    for i, (_, c_lat, c_lng) in enumerate(CANTONES):
+        distancia = (lat - c_lat) ** 2 + ((lng - c_lng) * coseno) ** 2
+        menor = distancia < mejor
+        mejor[menor] = distancia[menor]
+        indice[menor] = i
+    return indice
+
+
+class AnaliticaArboles:
+    """Árboles en columnas NumPy para estadísticas vectorizadas con filtros por fecha.
+
+    Las especies y usuarios se guardan como códigos enteros y el cantón se calcula al insertar.
+    `cargar` reconstruye las columnas; `add` agrega al final (con crecimiento amortizado) y
+    `remove` marca la fila como inactiva; las filas inactivas se compactan cuando son muchas.
+    """
+
+    def __init__(self, capacidad_inicial=1024):
+        self._lock = threading.Lock()
+        self._reiniciar(capacidad_inicial)
+
+    def _reiniciar(self, capacidad):
+        self._n = 0
+        self._inactivas = 0
+        self._dia = np.full(capacidad, -1, dtype=np.int32)
+        self._lat = np.zeros(capacidad, dtype=np.float64)
+        self._lng = np.zeros(capacidad, dtype=np.float64)
+        self._especie = np.full(capacidad, -1, dtype=np.int32)
+        self._usuario = np.full(capacidad, -1, dtype=np.int32)
+        self._canton = np.zeros(capacidad, dtype=np.int8)
+        self._activo = np.zeros(capacidad, dtype=bool)
+        self._fila_por_id = {}
+        self._especies, self._codigo_especie = [], {}
+        self._usuarios, self._codigo_usuario = [], {}
+
+    @staticmethod
+    def _codigo(valor, lista, codigos):
+        if not valor or not str(valor).strip():
+            return -1
+        valor = str(valor).strip()
+        codigo = codigos.get(valor)
+        if codigo is None:
+            codigo = codigos[valor] = len(lista)
+            lista.append(valor)
+        return codigo
+
+    def cargar(self, arboles):
+        with self._lock:
+            self._reiniciar(max(1024, len(arboles)))
+            self._agregar(arboles)
+
+    def add(self, arbol):
+        with self._lock:
+            self._agregar([arbol])
+
+    def remove(self, arbol):
+        with self._lock:
+            fila = self._fila_por_id.pop(arbol.get("id"), None)
+            if fila is None:
+                return
+            self._activo[fila] = False
+            self._inactivas += 1
+            if self._inactivas > 1024 and self._inactivas > self._n // 2:
+                self._compactar()
+
+    def _agregar(self, arboles):
+        arboles = [a for a in arboles if a.get("latitud") is not None and a.get("longitud") is not None]
+        if not arboles:
+            return
+        inicio, fin = self._n, self._n + len(arboles)
+        if fin > len(self._activo):
+            self._redimensionar(max(fin, 2 * len(self._activo)))
+
+        lat = np.array([float(a["latitud"]) for a in arboles])
+        lng = np.array([float(a["longitud"]) for a in arboles])
+        self._dia[inicio:fin] = _dias([a.get("fecha_siembra") for a in arboles])
+        self._lat[inicio:fin] = lat
+        self._lng[inicio:fin] = lng
+        self._canton[inicio:fin] = _canton_mas_cercano(lat, lng)
+        self._especie[inicio:fin] = [self._codigo(a.get("especie"), self._especies, self._codigo_especie) for a in arboles]
+        self._usuario[inicio:fin] = [self._codigo(a.get("user_email"), self._usuarios, self._codigo_usuario) for a in arboles]
+        self._activo[inicio:fin] = True
+        for desplazamiento, arbol in enumerate(arboles):
+            self._fila_por_id[arbol.get("id")] = inicio + desplazamiento
+        self._n = fin
+
+    def _redimensionar(self, capacidad):
+        for nombre in ('_dia', '_lat', '_lng', '_especie', '_usuario', '_canton', '_activo'):
+            actual = getattr(self, nombre)
+            nuevo = np.zeros(capacidad, dtype=actual.dtype)
+            nuevo[:self._n] = actual[:self._n]
+            setattr(self, nombre, nuevo)
+
+    def _compactar(self):
+        vivas = np.flatnonzero(self._activo[:self._n])
+        nueva_fila = np.full(self._n, -1, dtype=np.int64)
+        nueva_fila[vivas] = np.arange(len(vivas))
+        for nombre in ('_dia', '_lat', '_lng', '_especie', '_usuario', '_canton', '_activo'):
+            columna = getattr(self, nombre)
+            columna[:len(vivas)] = columna[vivas]
+        self._activo[len(vivas):self._n] = False
+        self._fila_por_id = {arbol_id: int(nueva_fila[fila]) for arbol_id, fila in self._fila_por_id.items()}
+        self._n = len(vivas)
+        self._inactivas = 0
+
+    # --- Consultas ---
+    def _mascara(self, desde=None, hasta=None):
+        mascara = self._activo[:self._n].copy()
+        if desde is not None:
+            mascara &= self._dia[:self._n] >= (desde - date(1970, 1, 1)).days
+        if hasta is not None:
+            mascara &= (self._dia[:self._n] <= (hasta - date(1970, 1, 1)).days) & (self._dia[:self._n] >= 0)
+        return mascara
+
+    def _serie(self, mascara, granularidad):
+        dias = self._dia[:self._n][mascara]
+        dias = dias[dias >= 0]
+        if len(dias) == 0:
+            return {}
+        if granularidad == 'dia':
+            periodos = dias.astype(np.int64)
+        elif granularidad == 'semana':
+            # 1970-01-01 fue jueves: la semana ISO 0 empieza el lunes 1969-12-29 (día -3)
+            periodos = (dias.astype(np.int64) + 3) // 7
+        else:
+            periodos = dias.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+        primero = periodos.min()
+        conteos = np.bincount(periodos - primero)
+        etiquetas = np.arange(primero, primero + len(conteos))
+        if granularidad == 'dia':
+            etiquetas = etiquetas.astype('datetime64[D]').astype(str)
+        elif granularidad == 'semana':
+            etiquetas = (etiquetas * 7 - 3).astype('datetime64[D]').astype(str)
+        else:
+            etiquetas = etiquetas.astype('datetime64[M]').astype(str)
+        return dict(zip(etiquetas.tolist(), conteos.tolist()))
+
+    def _por_canton(self, mascara):
+        conteos = np.bincount(self._canton[:self._n][mascara], minlength=len(CANTONES))
+        total = int(conteos.sum())
+        return [
+            {"canton": CANTONES[i][0], "arboles": int(conteos[i]),
+             "porcentaje": round(100 * float(conteos[i]) / total, 2) if total else 0.0}
+            for i in np.argsort(-conteos, kind='stable') if conteos[i] > 0
+        ]
+
+    def _por_celda(self, mascara, celda, top):
+        lat, lng = self._lat[:self._n][mascara], self._lng[:self._n][mascara]
+        if len(lat) == 0:
+            return []
+        filas = np.floor(lat / celda).astype(np.int64)
+        columnas = np.floor(lng / celda).astype(np.int64)
+        # Una sola clave entera por celda: contar claves 1D es mucho más rápido que unique sobre pares
+        fila_min, columna_min = filas.min(), columnas.min()
+        ancho = int(columnas.max() - columna_min) + 1
+        claves = (filas - fila_min) * ancho + (columnas - columna_min)
+        if int(claves.max()) < MAX_CELDAS_BINCOUNT:
+            conteos = np.bincount(claves)
+            ocupadas = np.flatnonzero(conteos)
+            conteos = conteos[ocupadas]
+        else:  # puntos muy dispersos: bincount reservaría demasiada memoria
+            ocupadas, conteos = np.unique(claves, return_counts=True)
+        orden = np.argsort(-conteos, kind='stable')[:top]
+        resultado = []
+        for clave, conteo in zip(ocupadas[orden].tolist(), conteos[orden].tolist()):
+            centro_lat = (clave // ancho + fila_min + 0.5) * celda
+            centro_lng = (clave % ancho + columna_min + 0.5) * celda
+            area_km2 = (celda * KM_POR_GRADO) ** 2 * math.cos(math.radians(centro_lat))
+            resultado.append({
+                "latitud": round(float(centro_lat), 6), "longitud": round(float(centro_lng), 6),
+                "arboles": conteo, "densidad_km2": round(conteo / area_km2, 2)
+            })
+        return resultado
+
+    def _por_usuario(self, mascara, top):
+        codigos = self._usuario[:self._n][mascara]
+        codigos = codigos[codigos >= 0]
+        if len(codigos) == 0:
+            return {"usuarios_activos": 0, "top": []}
+        conteos = np.bincount(codigos)
+        orden = np.argsort(-conteos, kind='stable')[:top]
+        return {
+            "usuarios_activos": int(np.count_nonzero(conteos)),
+            "top": [{"user_email": self._usuarios[i], "arboles": int(conteos[i])} for i in orden if conteos[i] > 0]
+        }
+
+    def _diversidad(self, mascara, top):
+        codigos = self._especie[:self._n][mascara]
+        codigos = codigos[codigos >= 0]
+        conteos = np.bincount(codigos) if len(codigos) else np.zeros(0, dtype=np.int64)
+        conteos_vivos = conteos[conteos > 0]
+        riqueza = len(conteos_vivos)
+        if riqueza == 0:
+            return {"riqueza": 0, "shannon": 0.0, "simpson": 0.0, "equitatividad": 0.0, "especies": {}}
+        p = conteos_vivos / conteos_vivos.sum()
+        shannon = float(-(p * np.log(p)).sum()) + 0.0  # con una sola especie la suma da -0.0
+        orden = np.argsort(-conteos, kind='stable')[:top]
+        return {
+            "riqueza": riqueza,
+            "shannon": round(shannon, 4),
+            "simpson": round(float(1 - (p ** 2).sum()), 4),
+            "equitatividad": round(shannon / math.log(riqueza), 4) if riqueza > 1 else 0.0,
+            "especies": {self._especies[i]: int(conteos[i]) for i in orden if conteos[i] > 0}
+        }
+
+    def resumen(self, desde=None, hasta=None, granularidad='mes', celda=0.05, top=10):
+        """Serie temporal, densidad por cantón y por celda, totales por usuario y diversidad,
+        sobre los árboles sembrados entre `desde` y `hasta` (fechas inclusive)"""
+        if granularidad not in GRANULARIDADES:
+            raise ValueError(f"'granularidad' debe ser una de: {', '.join(GRANULARIDADES)}")
+        with self._lock:
+            mascara = self._mascara(desde, hasta)
+            return {
+                "total": int(mascara.sum()),
+                "serie": self._serie(mascara, granularidad),
+                "cantones": self._por_canton(mascara),
+                "celdas": self._por_celda(mascara, celda, top),
+                "usuarios": self._por_usuario(mascara, top),
+                "diversidad": self._diversidad(mascara, top),
+            }
@@ -1,45 +1,247 @@
 import os
+import atexit
+import base64
+import hashlib
+import itertools
+import json
 import logging
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify
-from supabase import create_client, Client
+import mimetypes
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from flask import Flask, Response, g, render_template, request, jsonify, send_from_directory, url_for
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
 import uuid
+from spatial_index import GridIndex, decimate_by_zoom
+from clusters import TileClusterIndex
+from stats import EstadisticasArboles
+import analytics
+import assets
+import cooperativo
+from cache import SingleFlight, create_cache
+from compression import compress_variants, negotiate_encoding
+import image_pipeline
+from jobs import JobQueue
+from supabase_io import latencias
+from repositories import COLUMNAS_ARBOL, crear_repositorios
+from auth import NoAutorizado, SinPermiso, TokenVerifier, es_admin, token_de_header
+from log_pipeline import LoggingPipeline
+from rate_limit import create_rate_limiter, parse_limite
+from event_stream import EventBroker, EventJournal, LimiteConexiones
+from metrics import (BUCKETS_BYTES, MetricsRegistry, RepositorioMedido, SamplingProfiler,
+                     iniciar_medicion, terminar_medicion)
 
 load_dotenv()
 
-log_dir = 'logs'
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, 'app.log')),
-        logging.StreamHandler()
-    ]
+# Los registros se encolan en el hilo del request y un hilo aparte los escribe (JSON lines con rotación)
+log_dir = os.environ.get('LOG_DIR', 'logs')
+logging_pipeline = LoggingPipeline(
+    os.path.join(log_dir, 'app.log'),
+    nivel=os.environ.get('LOG_LEVEL', 'INFO'),
+    max_bytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    rotacion=os.environ.get('LOG_ROTATE_WHEN', 'midnight'),
+    respaldos=int(os.environ.get('LOG_BACKUP_COUNT', 14)),
+    consola=os.environ.get('LOG_CONSOLE', 'True').lower() in ['true', '1', 't'],
+    tasa_info=float(os.environ.get('LOG_INFO_SAMPLE_RATE', 0.1)),  # fracción de INFO repetidos que se escribe
+    rafaga_info=int(os.environ.get('LOG_INFO_BURST', 20)),  # INFO por línea de código y minuto que siempre pasan
+    # Solo se muestrean estos loggers; logins, siembras y borrados se auditan siempre completos
+    loggers_muestreados=[n for n in os.environ.get('LOG_SAMPLED_LOGGERS', f'{__name__}.lecturas').split(',') if n],
+    archivo_nivel=os.environ.get('LOG_LEVEL_FILE', os.path.join(log_dir, 'level'))  # nivel editable en caliente
 )
+logging_pipeline.instalar()
+atexit.register(logging_pipeline.stop)
 logger = logging.getLogger(__name__)
+logger_lecturas = logger.getChild('lecturas')  # rutas de lectura: alto volumen, muestreado
 
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
+DATA_BACKEND = os.environ.get('DATA_BACKEND', 'supabase').lower()
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
 
-if not url or not key:
-    logger.critical("SUPABASE_URL y SUPABASE_KEY deben estar configuradas")
-    raise ValueError("Variables de entorno faltantes")
+if DATA_BACKEND == 'supabase':
+    url: str = os.environ.get("SUPABASE_URL")
+    key: str = os.environ.get("SUPABASE_KEY")
 
-try:
-    supabase: Client = create_client(url, key)
-    logger.info("Conexión con Supabase establecida.")
-except Exception as e:
-    logger.critical(f"Error al conectar con Supabase: {e}")
-    raise
+    if not url or not key:
+        logger.critical("SUPABASE_URL y SUPABASE_KEY deben estar configuradas")
+        raise ValueError("Variables de entorno faltantes")
+
+    try:
+        # La service key (solo en el servidor) permite cambiar contraseñas por id de usuario
+        repos = crear_repositorios('supabase', url=url, key=key)
+        logger.info("Conexión con Supabase establecida.")
+    except Exception as e:
+        logger.critical(f"Error al conectar con Supabase: {e}")
+        raise
+else:
+    local_jwt_secret = os.environ.get('LOCAL_JWT_SECRET')
+    if not local_jwt_secret:
+        logger.warning("LOCAL_JWT_SECRET no configurada: se usa una clave aleatoria (las sesiones no sobreviven reinicios)")
+        local_jwt_secret = uuid.uuid4().hex + uuid.uuid4().hex
+    repos = crear_repositorios(
+        DATA_BACKEND,
+        db_path=os.environ.get('LOCAL_DB', os.path.join(DATA_DIR, 'reforesta.sqlite3')),
+        storage_dir=os.environ.get('LOCAL_STORAGE_DIR', os.path.join(DATA_DIR, 'storage')),
+        jwt_secret=local_jwt_secret
+    )
+    logger.info(f"Usando backend de datos local en {DATA_DIR}.")
+
+# --- Autenticación: access tokens verificados localmente, con sus claims cacheados ---
+AUTH_MODE = os.environ.get('AUTH_MODE', 'optional').lower()  # rutas de escritura: off | optional | required
+# Rutas de administración: además del rol 'admin' en app_metadata, estos emails (separados por coma)
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+if repos.backend == 'supabase':
+    verificador = TokenVerifier(
+        secret=os.environ.get('SUPABASE_JWT_SECRET'),  # HS256 (JWT secret del proyecto)
+        jwks_url=f"{url.rstrip('/')}/auth/v1/.well-known/jwks.json"  # claves asimétricas
+        if os.environ.get('SUPABASE_JWKS', 'True').lower() in ['true', '1', 't'] else None,
+        cache_max_entries=int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 10000)),
+        cache_ttl=int(os.environ.get('AUTH_CACHE_TTL', 300)),
+        respaldo=repos.auth.get_user  # tokens que no se pueden verificar localmente
+    )
+else:
+    verificador = TokenVerifier(
+        secret=local_jwt_secret,
+        cache_max_entries=int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 10000)),
+        cache_ttl=int(os.environ.get('AUTH_CACHE_TTL', 300))
+    )
+
+# --- Métricas del proceso (expuestas en /metrics) y profiler por muestreo ---
+metricas = MetricsRegistry()
+duracion_requests = metricas.histogram('http_request_duration_seconds', 'Duración de los requests por ruta', ('ruta', 'metodo'))
+duracion_backend = metricas.histogram('http_request_backend_seconds', 'Tiempo de cada request dentro del backend de datos', ('ruta', 'backend'))
+duracion_python = metricas.histogram('http_request_python_seconds', 'Tiempo de cada request fuera del backend de datos', ('ruta',))
+requests_totales = metricas.counter('http_requests_total', 'Requests atendidos por ruta, método y status', ('ruta', 'metodo', 'status'))
+tamano_solicitudes = metricas.histogram('http_request_size_bytes', 'Tamaño del cuerpo recibido', ('ruta',), buckets=BUCKETS_BYTES)
+tamano_respuestas = metricas.histogram('http_response_size_bytes', 'Tamaño del cuerpo enviado (sin respuestas en streaming)', ('ruta',), buckets=BUCKETS_BYTES)
+errores_manejados = metricas.counter('app_errors_total', 'Errores capturados por handle_errors', ('funcion', 'tipo'))
+operaciones_backend = metricas.histogram('backend_operation_duration_seconds', 'Duración de cada operación de repositorio', ('backend', 'operacion'))
+
+repos.arboles = RepositorioMedido(repos.arboles, 'arboles', operaciones_backend, repos.backend)
+repos.fotos = RepositorioMedido(repos.fotos, 'fotos', operaciones_backend, repos.backend)
+repos.auth = RepositorioMedido(repos.auth, 'auth', operaciones_backend, repos.backend)
+
+profiler = SamplingProfiler(
+    tasa=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),  # fracción de requests a perfilar; 0 = desactivado
+    directorio=os.environ.get('PROFILE_DIR', os.path.join(DATA_DIR, 'profiles')),
+    max_archivos=int(os.environ.get('PROFILE_MAX_FILES', 200))
+)
 
 app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB para fotos
+PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))  # proxies de confianza delante del app (gunicorn.conf.py: 1)
+if PROXY_FIX_X_FOR:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_X_FOR, x_proto=PROXY_FIX_X_FOR)
+FOTO_TIMEOUT = int(os.environ.get('FOTO_TIMEOUT', 30))  # segundos máximos de espera por un cupo de procesamiento
+
+# --- Assets versionados (python assets.py) servidos como inmutables, y página principal pre-renderizada ---
+ASSETS_MAX_AGE = int(os.environ.get('ASSETS_MAX_AGE', 365 * 24 * 3600))
+manifest_assets = assets.AssetManifest().cargar(
+    compilar=os.environ.get('ASSETS_BUILD_ON_START', 'True').lower() in ['true', '1', 't'])
+_paginas_principales = {}  # script_root -> entrada pre-renderizada de index.html
+
+# --- Árboles en memoria: índice espacial, clusters y estadísticas ---
+indice_arboles = GridIndex(
+    cell_size=float(os.environ.get('SPATIAL_INDEX_CELL_SIZE', 0.01)),
+    fine_cell_size=float(os.environ.get('SPATIAL_INDEX_FINE_CELL_SIZE', 0.0005))  # ~55 m, búsqueda de vecinos; 0 = sin grilla fina
+)
+clusters_arboles = TileClusterIndex(max_zoom=int(os.environ.get('CLUSTER_MAX_ZOOM', 18)))
+estadisticas = EstadisticasArboles()
+analitica = analytics.AnaliticaArboles() if analytics.disponible() else None  # columnas NumPy para /api/analitica
+INDICE_TTL = int(os.environ.get('SPATIAL_INDEX_TTL', 300))  # segundos entre recargas completas
+_indice_lock = threading.Lock()  # escrituras incrementales y reemplazo de las estructuras
+_recarga_lock = threading.Lock()  # una sola reconstrucción a la vez
+_cambios_durante_recarga = None  # escrituras a repetir sobre las estructuras en construcción
+_apagando = threading.Event()  # el worker está drenando: /ready responde 503
+
+# --- Detección de siembras duplicadas: misma especie, a pocos metros y en poco tiempo ---
+DUPLICADOS_RADIO_M = float(os.environ.get('DUPLICADOS_RADIO_M', 5))  # 0 = no se verifica
+DUPLICADOS_VENTANA = int(os.environ.get('DUPLICADOS_VENTANA', 24 * 3600))  # segundos entre siembras; 0 = sin límite
+DUPLICADOS_MISMA_ESPECIE = os.environ.get('DUPLICADOS_MISMA_ESPECIE', 'True').lower() in ['true', '1', 't']
+DUPLICADOS_REPORTE = os.environ.get('DUPLICADOS_REPORTE', os.path.join(DATA_DIR, 'duplicados.json'))
+DUPLICADOS_RADIO_MAX_M = float(os.environ.get('DUPLICADOS_RADIO_MAX_M', 50))  # radio máximo de /api/jobs/deduplicar
+_siembra_locks = [threading.Lock() for _ in range(256)]
+
+# --- Cache de respuestas GET, invalidada en cada escritura de árboles ---
+response_cache = create_cache(
+    backend=os.environ.get('CACHE_BACKEND', 'memory'),
+    max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 256)),
+    ttl=int(os.environ.get('CACHE_TTL', 30)),
+    directory=os.environ.get('CACHE_DIR', os.path.join(DATA_DIR, 'cache')),
+    namespace='responses'
+)
+solicitudes_en_vuelo = SingleFlight(timeout=int(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 30)))
+_contador_versiones = itertools.count(1)
+version_datos = 0  # cambia cada vez que cambian los árboles en memoria
+
+# --- Rate limiting por IP y ruta para rutas caras (auth y estadísticas) ---
+rate_limiter = create_rate_limiter(
+    backend=os.environ.get('RATE_LIMIT_BACKEND', 'memory'),  # 'file' comparte los límites entre procesos
+    db_path=os.environ.get('RATE_LIMIT_DB', os.path.join(DATA_DIR, 'ratelimit.sqlite3')),
+    habilitado=os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() in ['true', '1', 't']
+)
+RATE_LIMITS = {  # 'peticiones/segundos': ráfaga permitida y tiempo en que se repone
+    'auth': os.environ.get('RATE_LIMIT_AUTH', '10/60'),
+    'recuperacion': os.environ.get('RATE_LIMIT_RECUPERACION', '3/300'),
+    'estadisticas': os.environ.get('RATE_LIMIT_ESTADISTICAS', '60/60'),
+    'recalcular': os.environ.get('RATE_LIMIT_RECALCULAR', '2/60'),
+    'mantenimiento': os.environ.get('RATE_LIMIT_MANTENIMIENTO', '2/300'),
+}
+requests_limitados = metricas.counter('rate_limited_total', 'Requests rechazados con 429 por el rate limiter', ('limite',))
+
+# --- Lotes de siembra: respuestas guardadas por Idempotency-Key para reintentos seguros ---
+LOTE_MAX_ITEMS = int(os.environ.get('LOTE_MAX_ITEMS', 1000))
+LOTE_CHUNK_SIZE = int(os.environ.get('LOTE_CHUNK_SIZE', 200))
+idempotency_store = create_cache(
+    backend=os.environ.get('CACHE_BACKEND', 'memory'),
+    max_entries=int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 1000)),
+    ttl=int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600)),
+    directory=os.environ.get('CACHE_DIR', os.path.join(DATA_DIR, 'cache')),
+    namespace='idempotency'
+)
+_lotes_en_curso = set()
+_lotes_lock = threading.Lock()
+
+# --- Cola de trabajos en segundo plano (operaciones de storage fuera del request) ---
+SPOOL_DIR = os.path.join(DATA_DIR, 'spool')
+os.makedirs(SPOOL_DIR, exist_ok=True)
+job_queue = JobQueue(
+    os.environ.get('JOBS_DB', os.path.join(DATA_DIR, 'jobs.sqlite3')),
+    workers=int(os.environ.get('JOBS_WORKERS', 2)),
+    max_intentos=int(os.environ.get('JOBS_MAX_INTENTOS', 6))
+)
+RECONCILIAR_FOTOS_INTERVALO = int(os.environ.get('RECONCILIAR_FOTOS_INTERVALO', 0))  # segundos; 0 = desactivado
+RECONCILIAR_FOTOS_GRACIA = int(os.environ.get('RECONCILIAR_FOTOS_GRACIA', 3600))  # antigüedad mínima de un huérfano
+
+# --- Eventos en tiempo real (SSE): diffs de árboles para los mapas conectados ---
+eventos = EventBroker(
+    EventJournal(os.environ.get('EVENTOS_DB', os.path.join(DATA_DIR, 'eventos.sqlite3'))),
+    buffer=int(os.environ.get('EVENTOS_BUFFER', 1000)),  # eventos recientes en memoria por proceso
+    retencion=int(os.environ.get('EVENTOS_RETENCION', 10000)),  # eventos recuperables con Last-Event-ID
+    poll_interval=float(os.environ.get('EVENTOS_POLL', 1.0)),  # segundos; demora máxima entre workers
+    heartbeat=int(os.environ.get('EVENTOS_HEARTBEAT', 15)),
+    max_conexiones=int(os.environ.get('EVENTOS_MAX_CONEXIONES', 1000)),
+    duracion_max=int(os.environ.get('EVENTOS_DURACION_MAX', 1800))  # el cliente reconecta al cumplirse
+)
+# La fila completa: los otros workers la usan para actualizar sus datos en memoria
+CAMPOS_EVENTO = tuple(c.strip() for c in COLUMNAS_ARBOL.split(","))
+
+def _ratio_aciertos(cache):
+    consultas = cache.hits + cache.misses
+    return cache.hits / consultas if consultas else 0.0
+
+_caches = {'responses': response_cache, 'idempotency': idempotency_store, 'auth': verificador.cache}
+metricas.gauge('cache_hits', 'Aciertos del cache en este proceso', lambda: {(n,): c.hits for n, c in _caches.items()}, ('cache',))
+metricas.gauge('cache_misses', 'Fallos del cache en este proceso', lambda: {(n,): c.misses for n, c in _caches.items()}, ('cache',))
+metricas.gauge('cache_hit_ratio', 'Proporción de aciertos del cache', lambda: {(n,): _ratio_aciertos(c) for n, c in _caches.items()}, ('cache',))
+metricas.gauge('arboles_en_memoria', 'Árboles cargados en el índice espacial', lambda: {(): len(indice_arboles)})
+metricas.gauge('requests_coalescidos', 'Requests servidos con el resultado de otro request idéntico en curso', lambda: {(): solicitudes_en_vuelo.compartidas})
+metricas.gauge('logs_descartados', 'Registros INFO descartados por el muestreo', lambda: {(): logging_pipeline.muestreo.descartados})
+metricas.gauge('sse_conexiones', 'Clientes conectados al stream de eventos', lambda: {(): eventos.conexiones})
+metricas.gauge('eventos_publicados', 'Eventos publicados por este proceso', lambda: {(): eventos.publicados})
+metricas.gauge('jobs', 'Trabajos en la cola por estado', lambda: {(estado,): n for estado, n in job_queue.stats().items()}, ('estado',))
 
 # --- Decoradores y Validaciones ---
 def handle_errors(f):
@@ -47,14 +249,166 @@ def handle_errors(f):
     def decorated_function(*args, **kwargs):
         try:
             return f(*args, **kwargs)
+        except NoAutorizado as e:
+            errores_manejados.inc(f.__name__, 'auth')
+            logger.warning(f"No autorizado en {f.__name__}: {str(e)}")
+            return jsonify({"error": str(e)}), 401, {'WWW-Authenticate': 'Bearer'}
+        except SinPermiso as e:
+            errores_manejados.inc(f.__name__, 'permiso')
+            logger.warning(f"Sin permiso en {f.__name__}: {str(e)}")
+            return jsonify({"error": str(e)}), 403
         except ValueError as e:
+            errores_manejados.inc(f.__name__, 'validacion')
             logger.warning(f"Error de validación en {f.__name__}: {str(e)}")
             return jsonify({"error": str(e)}), 400
         except Exception as e:
+            errores_manejados.inc(f.__name__, 'interno')
             logger.error(f"Error inesperado en {f.__name__}: {str(e)}", exc_info=True)
             return jsonify({"error": "Error interno del servidor"}), 500
     return decorated_function
 
+def requiere_auth(obligatorio=False, admin=False):
+    """Valida el bearer token y deja sus claims en g.usuario (None si no hay usuario).
+
+    Salvo `obligatorio`, sigue AUTH_MODE: 'required' exige un token válido, 'optional' usa el
+    que venga y atiende como anónimo si está vencido o es inválido, y 'off' no valida nada.
+    `admin` exige además un administrador (ver es_admin y ADMIN_EMAILS).
+    Va debajo de @handle_errors, que responde 401 o 403.
+    """
+    def decorador(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            modo = 'required' if obligatorio or admin else AUTH_MODE
+            token = token_de_header(request.headers.get('Authorization'))
+            g.usuario = None
+            if modo == 'required':
+                g.usuario = verificador.verificar(token)
+            elif modo == 'optional' and token:
+                try:
+                    g.usuario = verificador.verificar(token)
+                except NoAutorizado as e:
+                    logger.info(f"Token descartado en {request.endpoint}, se atiende como anónimo: {e}")
+            if admin and not es_admin(g.usuario, ADMIN_EMAILS):
+                raise SinPermiso("Esta operación requiere un administrador.")
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorador
+
+def cache_response(f):
+    """Sirve la respuesta desde response_cache si existe; solo guarda respuestas 200.
+
+    Cada entrada lleva su ETag y sus variantes comprimidas, calculadas una sola vez por versión.
+    Los misses concurrentes de la misma URL se agrupan: solo uno ejecuta la consulta.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.full_path
+        entrada = response_cache.get(key)
+        if entrada is not None:
+            return respuesta_condicional(entrada)
+
+        version = version_datos
+
+        def generar():
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return None, response
+
+            body = response.get_data()
+            entrada = {
+                "body": body,
+                "status": response.status_code,
+                "mimetype": response.mimetype,
+                "headers": [(k, v) for k, v in response.headers.items() if k not in ('Content-Type', 'Content-Length')],
+                "etag": hashlib.sha256(body).hexdigest()[:32],
+                "variantes": compress_variants(body)
+            }
+            # Si hubo una escritura mientras se generaba, la respuesta puede estar desactualizada
+            if version == version_datos:
+                response_cache.set(key, entrada)
+            return entrada, None
+
+        # La versión va en la clave: un request posterior a una escritura no espera una consulta anterior
+        (entrada, response), compartido = solicitudes_en_vuelo.hacer((key, version), generar)
+        if entrada is not None:
+            return respuesta_condicional(entrada)
+        if compartido:  # streaming o error: no se puede compartir, se genera por separado
+            return f(*args, **kwargs)
+        return response
+    return decorated_function
+
+def limitar(nombre, limite):
+    """Token bucket por cliente y por ruta: responde 429 con Retry-After al agotarse.
+
+    El cliente es el usuario autenticado si lo hay (detrás de NAT muchos comparten IP) y si no la
+    IP, que detrás de un proxy solo es la real con PROXY_FIX_X_FOR. `limite` es
+    'peticiones/segundos' (ver RATE_LIMITS); `nombre` agrupa las métricas. Va debajo de
+    @handle_errors y, si la ruta tiene usuario, de @requiere_auth.
+    """
+    capacidad, periodo = parse_limite(limite)
+
+    def decorador(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            usuario = g.get('usuario')
+            cliente = f"usuario:{usuario['sub']}" if usuario and usuario.get('sub') else f"ip:{request.remote_addr}"
+            decision = rate_limiter.consumir(f"{request.endpoint}:{cliente}", capacidad, periodo)
+            if not decision.permitido:
+                espera = rate_limiter.segundos_de_espera(decision)
+                requests_limitados.inc(nombre)
+                logger.warning(f"Rate limit excedido en {request.endpoint} por {cliente}")
+                return jsonify({"error": f"Demasiadas solicitudes. Intenta de nuevo en {espera} s."}), 429, {
+                    'Retry-After': str(espera), 'X-RateLimit-Limit': str(capacidad), 'X-RateLimit-Remaining': '0'}
+            response = app.make_response(f(*args, **kwargs))
+            response.headers['X-RateLimit-Limit'] = str(capacidad)
+            response.headers['X-RateLimit-Remaining'] = str(decision.restantes)
+            return response
+        return decorated_function
+    return decorador
+
+@app.template_global()
+def asset_url(nombre):
+    """URL de un asset: versionada e inmutable si su build está vigente; si no (o en debug), la de static/"""
+    archivo = None if app.debug else manifest_assets.resolver(nombre)
+    if archivo:
+        return url_for('asset_versionado', filename=archivo)
+    return url_for('static', filename=nombre)
+
+def pagina_principal():
+    """index.html renderizado una vez por proceso, con su ETag y sus variantes comprimidas"""
+    entrada = _paginas_principales.get(request.script_root)
+    if entrada is None or app.debug:
+        body = render_template("index.html").encode('utf-8')
+        entrada = {
+            "body": body,
+            "status": 200,
+            "mimetype": "text/html",
+            "headers": [],
+            "etag": hashlib.sha256(body).hexdigest()[:32],
+            "variantes": compress_variants(body)
+        }
+        _paginas_principales[request.script_root] = entrada
+    return entrada
+
+def respuesta_condicional(entrada):
+    """Responde 304 si el cliente ya tiene esta versión; si no, el cuerpo en la mejor codificación aceptada"""
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), entrada["variantes"])
+    etag = f"{entrada['etag']}-{encoding}" if encoding else entrada["etag"]
+
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        body = entrada["variantes"][encoding] if encoding else entrada["body"]
+        response = app.response_class(body, status=entrada["status"], mimetype=entrada["mimetype"],
+                                      headers=entrada["headers"])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 def validate_coordinates(lat, lng):
     try:
         lat_f, lng_f = float(lat), float(lng)
@@ -91,21 +445,545 @@ def validate_email(email):
         raise ValueError("Email debe tener entre 5 y 100 caracteres")
     return email
 
+def parse_bbox(raw):
+    """Convierte 'minLng,minLat,maxLng,maxLat' en una tupla de floats validada"""
+    partes = raw.split(',') if isinstance(raw, str) else []
+    if len(partes) != 4:
+        raise ValueError("bbox debe tener el formato minLng,minLat,maxLng,maxLat")
+    min_lat, min_lng = validate_coordinates(partes[1], partes[0])
+    max_lat, max_lng = validate_coordinates(partes[3], partes[2])
+    if min_lat > max_lat or min_lng > max_lng:
+        raise ValueError("bbox inválido: los mínimos deben ser menores que los máximos")
+    return min_lng, min_lat, max_lng, max_lat
+
+def encode_cursor(arbol):
+    """Cursor opaco con la posición (fecha_siembra, id) del último árbol de una página"""
+    raw = json.dumps([arbol.get("fecha_siembra"), arbol["id"]]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """(fecha, id) de un cursor; la fecha se devuelve normalizada porque termina en un filtro de PostgREST"""
+    try:
+        fecha, arbol_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(fecha.replace('Z', '+00:00')).isoformat(), int(arbol_id)
+    except (ValueError, TypeError, AttributeError, UnicodeError):
+        raise ValueError("Cursor inválido")
+
+def parse_zoom(raw):
+    try:
+        zoom = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError("zoom debe ser un número entero")
+    if not (0 <= zoom <= 22):
+        raise ValueError("zoom fuera de rango (0-22)")
+    return zoom
+
+def construir_arbol(datos):
+    """Valida los datos de un árbol nuevo y arma la fila a insertar"""
+    especie = sanitize_string(datos.get("especie"), field_name="especie")
+    latitud, longitud = validate_coordinates(datos.get("latitud"), datos.get("longitud"))
+
+    return {
+        "especie": especie,
+        "latitud": round(latitud, 6),
+        "longitud": round(longitud, 6),
+        "fecha_siembra": datetime.utcnow().isoformat() + "+00:00",
+        "user_email": g.usuario.get("email") if g.get('usuario') else datos.get("user_email", "usuario@ejemplo.com"),
+        "foto_url": datos.get("foto_url")
+    }
+
+def _timestamp(fecha):
+    try:
+        return datetime.fromisoformat(str(fecha).replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def buscar_duplicados(arbol, indice=None, radio_m=None, ventana=None):
+    """Árboles del índice que parecen el mismo que `arbol`, del más cercano al más lejano.
+
+    Cuenta como duplicado un árbol a `radio_m` metros o menos, de la misma especie (salvo
+    DUPLICADOS_MISMA_ESPECIE=false) y plantado a menos de `ventana` segundos (0 = sin límite).
+    """
+    radio_m = DUPLICADOS_RADIO_M if radio_m is None else radio_m
+    ventana = DUPLICADOS_VENTANA if ventana is None else ventana
+    if radio_m <= 0:
+        return []
+    indice = indice_arboles if indice is None else indice
+    especie = (arbol.get("especie") or "").strip().lower()
+    momento = _timestamp(arbol.get("fecha_siembra"))
+
+    def filtro(existente):
+        if existente["id"] == arbol.get("id"):
+            return False
+        if DUPLICADOS_MISMA_ESPECIE and (existente.get("especie") or "").strip().lower() != especie:
+            return False
+        if ventana and momento is not None:
+            otro = _timestamp(existente.get("fecha_siembra"))
+            return otro is not None and abs(momento - otro) <= ventana
+        return True
+
+    return [{"id": existente["id"], "especie": existente.get("especie"),
+             "fecha_siembra": existente.get("fecha_siembra"), "distancia_m": round(distancia, 2)}
+            for distancia, existente in indice.cercanos(float(arbol["latitud"]), float(arbol["longitud"]), radio_m, filtro)]
+
+def locks_de_siembra(arbol):
+    """Locks de la celda del índice donde cae el árbol y de sus vecinas, en orden fijo.
+
+    Dos siembras a menos de una celda (~1 km, mucho más que DUPLICADOS_RADIO_M) comparten al
+    menos un lock aunque caigan a distintos lados de un borde, así que se verifican de a una.
+    """
+    celdas = indice_arboles.celda_y_vecinas(arbol["latitud"], arbol["longitud"])
+    return [_siembra_locks[i] for i in sorted({hash(celda) % len(_siembra_locks) for celda in celdas})]
+
+# --- Índice de Árboles en Memoria ---
+def asegurar_arboles_en_memoria(forzar=False, incluir_estadisticas=False):
+    """Devuelve el índice vigente; si su contenido superó INDICE_TTL lo recarga en segundo plano.
+
+    Solo la primera carga (o `forzar`) espera a la reconstrucción: una recarga por TTL sigue
+    sirviendo los datos actuales hasta que las estructuras nuevas están listas.
+    """
+    cargado_en = indice_arboles.cargado_en
+    if forzar or cargado_en is None:
+        with _recarga_lock:
+            if forzar or indice_arboles.cargado_en is None:
+                reconstruir_datos_en_memoria(incluir_estadisticas)
+    elif time.monotonic() - cargado_en > INDICE_TTL:
+        cargar_en_segundo_plano()
+    return indice_arboles
+
+def reconstruir_datos_en_memoria(incluir_estadisticas=False):
+    """Arma índice, clusters y analítica nuevos desde el backend y los reemplaza de una vez.
+
+    Los contadores de `estadisticas` se mantienen por incrementos y solo se rehacen en la primera
+    carga o con `incluir_estadisticas` (recálculo a pedido). Se llama con _recarga_lock tomado.
+
+    Las escrituras que llegan mientras se lee el backend se aplican a las estructuras vigentes
+    y se anotan para repetirlas sobre las nuevas antes del reemplazo, así que ninguna se pierde
+    aunque la lectura ya la incluya.
+    """
+    global indice_arboles, clusters_arboles, estadisticas, analitica, _cambios_durante_recarga
+    with _indice_lock:
+        _cambios_durante_recarga = []
+    try:
+        inicio = time.perf_counter()
+        arboles = repos.arboles.todos()
+        # Con workers gevent el armado (solo CPU) corre en un hilo nativo para no frenar a los demás clientes
+        indice, clusters, nuevas_estadisticas, nueva_analitica = cooperativo.en_hilo_nativo(
+            construir_datos_en_memoria, arboles, incluir_estadisticas or indice_arboles.cargado_en is None)
+
+        with _indice_lock:
+            for accion, arbol in _cambios_durante_recarga:
+                aplicar_cambio(accion, arbol, indice, clusters, nuevas_estadisticas, nueva_analitica)
+            indice_arboles, clusters_arboles, analitica = indice, clusters, nueva_analitica
+            if nuevas_estadisticas is not None:
+                estadisticas = nuevas_estadisticas
+    finally:
+        with _indice_lock:
+            _cambios_durante_recarga = None
+    invalidar_cache()
+    logger.info(f"Datos en memoria cargados con {len(indice)} árboles en {time.perf_counter() - inicio:.2f}s")
+
+def construir_datos_en_memoria(arboles, incluir_estadisticas):
+    """(índice, clusters, estadísticas o None, analítica o None) nuevos a partir de la lista de árboles"""
+    indice = GridIndex(cell_size=indice_arboles.cell_size, fine_cell_size=indice_arboles.fine_cell_size)
+    indice.cargar(arboles)
+    clusters = TileClusterIndex(max_zoom=clusters_arboles.max_zoom)
+    clusters.cargar(arboles)
+    nuevas_estadisticas = None
+    if incluir_estadisticas:
+        nuevas_estadisticas = EstadisticasArboles()
+        nuevas_estadisticas.cargar(arboles)
+    nueva_analitica = None
+    if analitica is not None:
+        nueva_analitica = analytics.AnaliticaArboles()
+        nueva_analitica.cargar(arboles)
+    return indice, clusters, nuevas_estadisticas, nueva_analitica
+
+def cargar_en_segundo_plano():
+    """Lanza la recarga de los datos en memoria sin bloquear (una sola a la vez)"""
+    if not _recarga_lock.acquire(blocking=False):
+        return
+
+    def cargar():
+        try:
+            cargado_en = indice_arboles.cargado_en
+            if cargado_en is None or time.monotonic() - cargado_en > INDICE_TTL:
+                reconstruir_datos_en_memoria()
+        except Exception as e:
+            logger.error(f"Error al cargar los datos en memoria: {e}")
+        finally:
+            _recarga_lock.release()
+
+    threading.Thread(target=cargar, name="carga-datos", daemon=True).start()
+
+def invalidar_cache():
+    global version_datos
+    version_datos = next(_contador_versiones)
+    response_cache.clear()
+
+def aplicar_cambio(accion, arbol, indice, clusters, stats, columnas):
+    """Aplica una escritura a un juego de estructuras en memoria; repetirla no cambia el resultado"""
+    if accion == 'delete':
+        anterior = indice.remove(arbol["id"])
+    else:
+        anterior = indice.upsert(arbol)
+
+    if anterior is not None:
+        clusters.remove(anterior)
+        if stats is not None:
+            stats.remove(anterior)
+        if columnas is not None:
+            columnas.remove(anterior)
+    if accion != 'delete':
+        clusters.add(arbol)
+        if stats is not None:
+            stats.add(arbol)
+        if columnas is not None:
+            columnas.add(arbol)
+
+def registrar_cambio_arbol(accion, arbol, notificar=True):
+    """Propaga una escritura exitosa ('insert', 'update' o 'delete') a los datos en memoria.
+
+    Con `notificar` también la publica a los clientes conectados; los lotes la desactivan y
+    publican un solo evento por bloque con notificar_cambios.
+    """
+    with _indice_lock:
+        if indice_arboles.cargado_en is not None:
+            aplicar_cambio(accion, arbol, indice_arboles, clusters_arboles, estadisticas, analitica)
+        if _cambios_durante_recarga is not None:
+            _cambios_durante_recarga.append((accion, arbol))
+
+    invalidar_cache()
+    if notificar:
+        notificar_cambios(accion, [arbol])
+
+def notificar_cambios(accion, arboles):
+    """Publica un diff compacto a los clientes SSE; un fallo aquí no deshace la escritura"""
+    if accion == 'delete':
+        datos = {"accion": accion, "ids": [arbol["id"] for arbol in arboles]}
+    else:
+        datos = {"accion": accion, "arboles": [{c: arbol.get(c) for c in CAMPOS_EVENTO} for arbol in arboles]}
+    try:
+        eventos.publicar('arboles', datos)
+    except Exception as e:
+        logger.warning(f"No se pudo publicar el evento '{accion}' de {len(arboles)} árboles: {e}")
+
+def aplicar_cambios_de_otro_proceso(tipo, datos):
+    """Aplica a los datos en memoria de este worker las escrituras atendidas por otro"""
+    if tipo != 'arboles':
+        return
+    if datos["accion"] == 'delete':
+        for arbol_id in datos["ids"]:
+            registrar_cambio_arbol('delete', {"id": arbol_id}, notificar=False)
+    else:
+        for arbol in datos["arboles"]:
+            registrar_cambio_arbol(datos["accion"], arbol, notificar=False)
+
+eventos.escuchar(aplicar_cambios_de_otro_proceso)
+
+def pagina_arboles(limit, cursor=None):
+    """Página de árboles ordenada por (fecha_siembra, id) descendente, a partir de un cursor.
+
+    Devuelve (filas, siguiente_cursor); el cursor es None cuando no quedan más filas.
+    """
+    filas = repos.arboles.pagina(limit, decode_cursor(cursor) if cursor else None)
+    siguiente = encode_cursor(filas[-1]) if len(filas) == limit else None
+    return filas, siguiente
+
+def stream_arboles_ndjson(page_size, cursor=None):
+    """Genera todos los árboles desde el cursor, una línea JSON por árbol, de a una página por vez"""
+    total = 0
+    while True:
+        filas, cursor = pagina_arboles(page_size, cursor)
+        for arbol in filas:
+            yield json.dumps(arbol, ensure_ascii=False) + "\n"
+        total += len(filas)
+        if cursor is None:
+            logger_lecturas.info(f"Streaming NDJSON completado: {total} árboles")
+            return
+
+def filename_de_foto_url(foto_url):
+    """Extrae el nombre del archivo en el bucket 'arboles-fotos' a partir de su URL pública"""
+    if not foto_url or "/arboles-fotos/" not in foto_url:
+        return None
+    return foto_url.split("/arboles-fotos/")[-1].split("?")[0] or None
+
+def encolar_eliminacion_foto(foto_url):
+    """Encola el borrado de la foto (y su miniatura) de un árbol eliminado"""
+    if not foto_url:
+        return
+    filename = filename_de_foto_url(foto_url)
+    if not filename:
+        logger.warning(f"No se pudo extraer filename válido de la URL: {foto_url}")
+        return
+    try:
+        job_queue.enqueue('eliminar_fotos', {"archivos": [filename, image_pipeline.nombre_miniatura(filename)]})
+        logger.info(f"Eliminación de foto arboles-fotos/{filename} encolada.")
+    except Exception as e:
+        logger.warning(f"No se pudo encolar la eliminación de {foto_url} (la reconciliación la limpiará): {e}")
+
+# --- Trabajos en Segundo Plano ---
+def job_eliminar_fotos(payload):
+    repos.fotos.eliminar(payload["archivos"])
+    logger.info(f"Fotos eliminadas del storage: {payload['archivos']}")
+
+def job_subir_foto(payload):
+    spool_path = payload["spool_path"]
+    with open(spool_path, 'rb') as fh:
+        contenido = fh.read()
+    repos.fotos.subir(payload["path"], contenido, payload["content_type"], upsert=True)
+    os.remove(spool_path)
+    logger.info(f"Foto {payload['path']} subida desde la cola")
+
+def job_reconciliar_fotos(payload):
+    """Elimina del bucket las fotos (y miniaturas) que ya no referencia ningún árbol"""
+    referenciadas = set()
+    for arbol in repos.arboles.todos():
+        filename = filename_de_foto_url(arbol.get("foto_url"))
+        if filename:
+            referenciadas.add(filename)
+            referenciadas.add(image_pipeline.nombre_miniatura(filename))
+
+    limite = time.time() - RECONCILIAR_FOTOS_GRACIA
+    huerfanas = []
+    for archivo in repos.fotos.listar():
+        nombre = archivo.get("name")
+        if not nombre or nombre in referenciadas:
+            continue
+        creado = archivo.get("created_at")
+        if creado:
+            creado = datetime.fromisoformat(creado.replace('Z', '+00:00'))
+            if creado.tzinfo is None:  # el storage informa UTC aunque no lo indique
+                creado = creado.replace(tzinfo=timezone.utc)
+        # Las fotos recién subidas todavía no tienen árbol: se respetan durante el período de gracia
+        if creado and creado.timestamp() > limite:
+            continue
+        huerfanas.append(nombre)
+
+    for inicio in range(0, len(huerfanas), 100):
+        repos.fotos.eliminar(huerfanas[inicio:inicio + 100])
+    logger.info(f"Reconciliación de fotos: {len(huerfanas)} huérfanas eliminadas")
+
+    if payload.get("periodico") and RECONCILIAR_FOTOS_INTERVALO > 0:
+        job_queue.enqueue('reconciliar_fotos', {"periodico": True}, retraso=RECONCILIAR_FOTOS_INTERVALO)
+
+def job_deduplicar_arboles(payload):
+    """Busca árboles duplicados en todo el registro y guarda el resultado en DUPLICADOS_REPORTE.
+
+    Recorre los árboles en orden de siembra comparando cada uno solo con los ya conservados,
+    así que de cada grupo queda el primero plantado. No borra nada: las siembras confirmadas con
+    forzar=true también aparecen, así que el reporte se revisa y se eliminan solo los ids elegidos
+    (ver eliminar_duplicados_revisados). Con `eliminar` el payload trae esos ids.
+    """
+    if payload.get("eliminar"):
+        eliminar_duplicados_revisados(payload["ids"], payload["reporte"])
+        return
+
+    radio_m = float(payload.get("radio_m", DUPLICADOS_RADIO_M))
+    ventana = int(payload.get("ventana", DUPLICADOS_VENTANA))
+    inicio = time.perf_counter()
+
+    arboles = sorted(asegurar_arboles_en_memoria().todos(), key=lambda a: (a.get("fecha_siembra") or "", a["id"]))
+    duplicados = cooperativo.en_hilo_nativo(detectar_duplicados, arboles, radio_m, ventana)
+
+    reporte = {
+        "generado_en": datetime.now(timezone.utc).isoformat(),
+        "radio_m": radio_m,
+        "ventana": ventana,
+        "revisados": len(arboles),
+        "duplicados": duplicados,
+        "eliminados": [],
+        "segundos": round(time.perf_counter() - inicio, 2)
+    }
+    guardar_reporte_duplicados(reporte)
+    logger.info(f"Deduplicación: {len(duplicados)} duplicados en {len(arboles)} árboles ({reporte['segundos']}s)")
+
+def eliminar_duplicados_revisados(ids, generado_en):
+    """Borra los `ids` del reporte `generado_en` cuyo árbol conservado sigue existiendo"""
+    reporte = leer_reporte_duplicados()
+    if reporte is None or reporte["generado_en"] != generado_en:
+        logger.warning(f"El reporte de duplicados {generado_en} ya no es el vigente: no se elimina nada")
+        return
+    pedidos = set(ids)
+    indice = asegurar_arboles_en_memoria()
+    eliminados = []
+    for duplicado in reporte["duplicados"]:
+        if duplicado["id"] not in pedidos or duplicado["id"] in reporte["eliminados"]:
+            continue
+        if indice.obtener(duplicado["duplicado_de"]) is None:
+            logger.info(f"Duplicado {duplicado['id']} conservado: el árbol {duplicado['duplicado_de']} ya no existe")
+            continue
+        eliminado = repos.arboles.eliminar(duplicado["id"])
+        if eliminado is None:
+            continue
+        registrar_cambio_arbol('delete', {"id": duplicado["id"]}, notificar=False)
+        encolar_eliminacion_foto(eliminado.get("foto_url"))
+        eliminados.append({"id": duplicado["id"]})
+    if eliminados:
+        notificar_cambios('delete', eliminados)
+    reporte["eliminados"] = reporte["eliminados"] + [e["id"] for e in eliminados]
+    guardar_reporte_duplicados(reporte)
+    logger.info(f"Deduplicación: {len(eliminados)} de {len(pedidos)} duplicados revisados eliminados")
+
+def leer_reporte_duplicados():
+    try:
+        with open(DUPLICADOS_REPORTE, encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+def guardar_reporte_duplicados(reporte):
+    os.makedirs(os.path.dirname(DUPLICADOS_REPORTE) or '.', exist_ok=True)
+    temporal = f"{DUPLICADOS_REPORTE}.{os.getpid()}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as fh:
+        json.dump(reporte, fh, ensure_ascii=False)
+    os.replace(temporal, DUPLICADOS_REPORTE)
+
+def detectar_duplicados(arboles, radio_m, ventana):
+    """Duplicados de una lista ordenada por siembra, cada uno con el árbol conservado del que es copia"""
+    conservados = GridIndex(cell_size=indice_arboles.cell_size, fine_cell_size=indice_arboles.fine_cell_size)
+    duplicados = []
+    for arbol in arboles:
+        encontrados = buscar_duplicados(arbol, conservados, radio_m, ventana)
+        if encontrados:
+            duplicados.append({"id": arbol["id"], "especie": arbol.get("especie"), "fecha_siembra": arbol.get("fecha_siembra"),
+                               "duplicado_de": encontrados[0]["id"], "distancia_m": encontrados[0]["distancia_m"]})
+        else:
+            conservados.upsert(arbol)
+    return duplicados
+
+job_queue.register('eliminar_fotos', job_eliminar_fotos)
+job_queue.register('deduplicar_arboles', job_deduplicar_arboles)
+job_queue.register('subir_foto', job_subir_foto)
+job_queue.register('reconciliar_fotos', job_reconciliar_fotos)
+
+@app.before_request
+def iniciar_workers():
+    logging_pipeline.start()
+    job_queue.start()
+    eventos.start()
+
+@app.before_request
+def iniciar_metricas():
+    g.inicio_request = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    iniciar_medicion()
+    profiler.iniciar()
+
+@app.after_request
+def registrar_metricas(response):
+    ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+    duracion = time.perf_counter() - g.get('inicio_request', time.perf_counter())
+    backend = terminar_medicion()
+
+    duracion_requests.observe(duracion, ruta, request.method)
+    duracion_backend.observe(backend, ruta, repos.backend)
+    duracion_python.observe(max(0.0, duracion - backend), ruta)
+    requests_totales.inc(ruta, request.method, str(response.status_code))
+    if request.content_length:
+        tamano_solicitudes.observe(request.content_length, ruta)
+    if not response.is_streamed and response.content_length is not None:
+        tamano_respuestas.observe(response.content_length, ruta)
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def terminar_profiler(error=None):
+    ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+    path = profiler.terminar(f"{request.method} {ruta}")
+    if path:
+        logger.info(f"Perfil de {request.method} {ruta} guardado en {path}")
+
+# --- Arranque y apagado bajo un servidor de producción (ver wsgi.py y gunicorn.conf.py) ---
+def precargar(datos=True):
+    """Pre-renderiza la página principal y carga los datos en memoria antes del fork de los workers.
+
+    Con gunicorn --preload se ejecuta una vez en el proceso maestro y los workers heredan
+    todo sin repetir la carga. Si el backend no responde se sigue: cada worker cargará
+    los datos en su primer request.
+    """
+    with app.test_request_context('/'):
+        pagina_principal()
+    if datos:
+        try:
+            asegurar_arboles_en_memoria()
+        except Exception as e:
+            logger.error(f"No se pudieron precargar los datos en memoria: {e}")
+
+def programar_tareas_periodicas():
+    """Encola los trabajos periódicos (idempotente: basta con que un worker lo logre)"""
+    if RECONCILIAR_FOTOS_INTERVALO > 0:
+        job_queue.enqueue_unico('reconciliar_fotos', {"periodico": True}, retraso=RECONCILIAR_FOTOS_INTERVALO)
+
+def preparar_apagado():
+    """Al recibir la señal de parada: /ready pasa a 503 y se cierran los streams de eventos"""
+    _apagando.set()
+    eventos.stop()
+
 # --- Rutas Principales ---
 @app.route("/")
 def home():
-    return render_template("index.html")
+    return respuesta_condicional(pagina_principal())
+
+@app.route("/assets/<path:filename>")
+def asset_versionado(filename):
+    """Assets versionados por contenido: inmutables, servidos en su variante precomprimida si se acepta"""
+    disponibles = {encoding for encoding, sufijo in assets.CODIFICACIONES.items()
+                   if os.path.isfile(os.path.join(assets.DESTINO, filename + sufijo))}
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), disponibles)
+    archivo = filename + assets.CODIFICACIONES[encoding] if encoding else filename
+
+    response = send_from_directory(assets.DESTINO, archivo, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=ASSETS_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={ASSETS_MAX_AGE}, immutable'
+    return response
+
+@app.route("/media/arboles-fotos/<path:filename>")
+def media_local(filename):
+    """Sirve las fotos del backend local (con Supabase las sirve el CDN del bucket)"""
+    if repos.backend != 'local':
+        return jsonify({"error": "Recurso no encontrado"}), 404
+    return send_from_directory(repos.fotos.directorio, filename, max_age=31536000)
 
 @app.route("/health")
 @handle_errors
 def health_check():
     return jsonify({"status": "ok", "timestamp": datetime.utcnow().isoformat()}), 200
 
+@app.route("/ready")
+@handle_errors
+def readiness_check():
+    """Listo para recibir tráfico: datos en memoria, backend y colas accesibles, y sin drenar"""
+    checks = {"datos_en_memoria": indice_arboles.cargado_en is not None}
+    if not checks["datos_en_memoria"]:
+        cargar_en_segundo_plano()
+    try:
+        repos.arboles.pagina(1)
+        checks["backend"] = True
+    except Exception as e:
+        logger.warning(f"Readiness: el backend de datos no responde: {e}")
+        checks["backend"] = False
+    try:
+        job_queue.stats()
+        eventos.journal.limites()
+        checks["colas"] = True
+    except Exception as e:
+        logger.warning(f"Readiness: las colas locales no responden: {e}")
+        checks["colas"] = False
+    checks["apagando"] = _apagando.is_set()
+
+    listo = checks["datos_en_memoria"] and checks["backend"] and checks["colas"] and not checks["apagando"]
+    return jsonify({"status": "ready" if listo else "not_ready", "checks": checks}), 200 if listo else 503
+
 # --- CRUD COMPLETO DE ÁRBOLES ---
 @app.route("/api/obtener_arboles", methods=['GET'])
 @handle_errors
+@cache_response
 def obtener_arboles():
-    logger.info("Obteniendo árboles...")
+    logger.debug("Obteniendo árboles...")
     try:
         limit = int(request.args.get('limit', 1000))
         offset = int(request.args.get('offset', 0))
@@ -114,50 +992,192 @@ def obtener_arboles():
     except ValueError:
         raise ValueError("Límites deben ser números válidos")
 
-    response = supabase.table("arboles_sembrados") \
-        .select("id, especie, latitud, longitud, fecha_siembra, foto_url, user_email") \
-        .limit(limit).offset(offset).order('fecha_siembra', desc=True).execute()
+    if 'bbox' in request.args:
+        min_lng, min_lat, max_lng, max_lat = parse_bbox(request.args['bbox'])
+        zoom = parse_zoom(request.args['zoom']) if 'zoom' in request.args else None
+
+        indice = asegurar_arboles_en_memoria()
+        if zoom is None:
+            arboles = indice.query(min_lng, min_lat, max_lng, max_lat, limit=limit)
+        else:
+            arboles = decimate_by_zoom(indice.query(min_lng, min_lat, max_lng, max_lat), zoom)[:limit]
+
+        logger_lecturas.info(f"Obtenidos {len(arboles)} árboles en bbox (zoom={zoom})")
+        return jsonify(arboles), 200
+
+    # Modo streaming: exporta desde el cursor usando `limit` como tamaño de página
+    if request.args.get('formato') == 'ndjson':
+        if request.args.get('cursor'):
+            decode_cursor(request.args['cursor'])
+        return Response(stream_arboles_ndjson(limit, request.args.get('cursor') or None),
+                        mimetype='application/x-ndjson')
+
+    # Paginación por cursor (keyset): ?cursor= vacío pide la primera página
+    if 'cursor' in request.args:
+        arboles, siguiente = pagina_arboles(limit, request.args['cursor'] or None)
+        logger_lecturas.info(f"Obtenidos {len(arboles)} árboles por cursor")
+        response = jsonify(arboles)
+        if siguiente:
+            response.headers['X-Next-Cursor'] = siguiente
+        return response, 200
 
-    logger.info(f"Obtenidos {len(response.data)} árboles")
-    return jsonify(response.data), 200
+    arboles = repos.arboles.listar(limit, offset)
+
+    logger_lecturas.info(f"Obtenidos {len(arboles)} árboles")
+    return jsonify(arboles), 200
+
+@app.route("/api/clusters_arboles", methods=['GET'])
+@handle_errors
+@cache_response
+def clusters_arboles_en_vista():
+    if 'bbox' not in request.args or 'zoom' not in request.args:
+        raise ValueError("Se requieren los parámetros bbox y zoom")
+    min_lng, min_lat, max_lng, max_lat = parse_bbox(request.args['bbox'])
+    zoom = parse_zoom(request.args['zoom'])
+
+    asegurar_arboles_en_memoria()
+    clusters = clusters_arboles.query(min_lng, min_lat, max_lng, max_lat, zoom)
+
+    logger_lecturas.info(f"Obtenidos {len(clusters)} clusters (zoom={zoom})")
+    return jsonify(clusters), 200
 
 @app.route("/api/plantar_arbol", methods=['POST'])
 @handle_errors
+@requiere_auth()
 def plantar_arbol():
     datos = request.json
     if not datos:
         raise ValueError("Sin datos")
 
-    especie = sanitize_string(datos.get("especie"), field_name="especie")
-    latitud, longitud = validate_coordinates(datos.get("latitud"), datos.get("longitud"))
+    nuevo_arbol = construir_arbol(datos)
+    forzar = datos.get("forzar") is True
+
+    logger.info(f"Plantando árbol: {nuevo_arbol['especie']}")
+    verificar = not forzar and DUPLICADOS_RADIO_M > 0
+    if verificar:
+        asegurar_arboles_en_memoria()  # la primera carga no se hace con los locks tomados
+    with ExitStack() as locks:
+        for lock in locks_de_siembra(nuevo_arbol):
+            locks.enter_context(lock)
+        if verificar:
+            duplicados = buscar_duplicados(nuevo_arbol)
+            if duplicados:
+                logger.info(f"Siembra rechazada: posible duplicado del árbol {duplicados[0]['id']} "
+                            f"a {duplicados[0]['distancia_m']} m")
+                return jsonify({"error": "Ya hay un árbol de esta especie registrado a pocos metros. "
+                                         "Envía forzar=true si es un árbol distinto.",
+                                "duplicados": duplicados}), 409
 
-    user_email = datos.get("user_email", "usuario@ejemplo.com")
-    foto_url = datos.get("foto_url")
-
-    nuevo_arbol = {
-        "especie": especie,
-        "latitud": round(latitud, 6),
-        "longitud": round(longitud, 6),
-        "fecha_siembra": datetime.utcnow().isoformat() + "+00:00",
-        "user_email": user_email,
-        "foto_url": foto_url
-    }
+        try:
+            arbol = repos.arboles.insertar([nuevo_arbol])[0]
+        except Exception as e:
+            logger.error(f"Error al insertar árbol: {e}")
+            raise
 
-    logger.info(f"Plantando árbol: {especie}")
-    response = supabase.table("arboles_sembrados").insert(nuevo_arbol).execute()
+        registrar_cambio_arbol('insert', arbol)
+    logger.info(f"Árbol plantado ID: {arbol.get('id')}")
+    return jsonify(arbol), 201
 
-    if hasattr(response, 'error') and response.error:
-         logger.error(f"Error al insertar árbol en Supabase: {response.error.message}")
-         raise Exception(f"Error de base de datos: {response.error.message}")
-    if not response.data:
-         logger.error("No se recibió data después de insertar el árbol.")
-         raise Exception("No se pudo insertar el árbol, respuesta vacía.")
+@app.route("/api/plantar_arboles_lote", methods=['POST'])
+@handle_errors
+@requiere_auth()
+def plantar_arboles_lote():
+    datos = request.json
+    if not datos or not isinstance(datos.get("arboles"), list) or not datos["arboles"]:
+        raise ValueError("Se requiere una lista 'arboles' no vacía")
+    items = datos["arboles"]
+    if len(items) > LOTE_MAX_ITEMS:
+        raise ValueError(f"Máximo {LOTE_MAX_ITEMS} árboles por lote")
+
+    idempotency_key = request.headers.get('Idempotency-Key')
+    ya_insertados = {}  # de un intento anterior con fallas del backend: no se vuelven a insertar
+    if idempotency_key:
+        idempotency_key = sanitize_string(idempotency_key, min_length=8, max_length=128, field_name="Idempotency-Key")
+        previo = idempotency_store.get(f"lote:{idempotency_key}")
+        if isinstance(previo, dict):
+            ya_insertados = previo["insertados"]
+            logger.info(f"Lote {idempotency_key}: reintentando {len(items) - len(ya_insertados)} árboles no insertados")
+        elif previo is not None:
+            logger.info(f"Lote {idempotency_key} ya procesado, devolviendo resultado guardado")
+            body, status = previo
+            return app.response_class(body, status=status, mimetype='application/json',
+                                      headers={'Idempotent-Replayed': 'true'})
+        with _lotes_lock:
+            if idempotency_key in _lotes_en_curso:
+                return jsonify({"error": "Este lote ya se está procesando"}), 409
+            _lotes_en_curso.add(idempotency_key)
 
-    logger.info(f"Árbol plantado ID: {response.data[0].get('id')}")
-    return jsonify(response.data[0]), 201
+    try:
+        resultados = [None] * len(items)
+        validos = []
+        verificar_duplicados = DUPLICADOS_RADIO_M > 0 and datos.get("forzar") is not True
+        if verificar_duplicados:
+            asegurar_arboles_en_memoria()
+            # Los árboles aceptados del propio lote, con id negativo: -(indice + 1)
+            del_lote = GridIndex(cell_size=indice_arboles.cell_size, fine_cell_size=indice_arboles.fine_cell_size)
+        for indice, item in enumerate(items):
+            if indice in ya_insertados:
+                resultados[indice] = ya_insertados[indice]
+                continue
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Cada árbol debe ser un objeto")
+                arbol = construir_arbol(item)
+                if verificar_duplicados:
+                    duplicados = buscar_duplicados(arbol) or [
+                        {"indice": -d["id"] - 1, "distancia_m": d["distancia_m"]} for d in buscar_duplicados(arbol, del_lote)]
+                    if duplicados:
+                        resultados[indice] = {"indice": indice, "ok": False, "error": "Posible duplicado de un árbol a pocos metros",
+                                              "duplicados": duplicados}
+                        continue
+                    del_lote.upsert(dict(arbol, id=-(indice + 1)))
+                validos.append((indice, arbol))
+            except ValueError as e:
+                resultados[indice] = {"indice": indice, "ok": False, "error": str(e)}
+
+        logger.info(f"Lote recibido: {len(validos)} válidos de {len(items)}")
+        for inicio in range(0, len(validos), LOTE_CHUNK_SIZE):
+            chunk = validos[inicio:inicio + LOTE_CHUNK_SIZE]
+            try:
+                insertados_chunk = repos.arboles.insertar([arbol for _, arbol in chunk])
+            except Exception as e:
+                logger.error(f"Error al insertar bloque de {len(chunk)} árboles: {e}")
+                for indice, _ in chunk:
+                    resultados[indice] = {"indice": indice, "ok": False, "error": "Error de base de datos al insertar",
+                                          "reintentable": True}
+                continue
+
+            for (indice, _), insertado in zip(chunk, insertados_chunk):
+                registrar_cambio_arbol('insert', insertado, notificar=False)
+                resultados[indice] = {"indice": indice, "ok": True, "arbol": insertado}
+            notificar_cambios('insert', insertados_chunk)
+
+        insertados = sum(1 for r in resultados if r["ok"])
+        fallidos = len(resultados) - insertados
+        fallas_backend = sum(1 for r in resultados if r.get("reintentable"))
+        # Sin nada insertado, las fallas del backend pesan más que las de validación: se puede reintentar
+        status = 201 if fallidos == 0 else 207 if insertados else 503 if fallas_backend else 400
+        body = json.dumps({"insertados": insertados, "fallidos": fallidos, "resultados": resultados},
+                          ensure_ascii=False).encode('utf-8')
+
+        if idempotency_key:
+            if fallas_backend:
+                # No se guarda la respuesta: un reintento con la misma clave inserta solo lo que faltó
+                idempotency_store.set(f"lote:{idempotency_key}", {
+                    "insertados": {r["indice"]: r for r in resultados if r["ok"]}})
+            else:
+                idempotency_store.set(f"lote:{idempotency_key}", (body, status))
+        logger.info(f"Lote procesado: {insertados} insertados, {fallidos} fallidos")
+        return app.response_class(body, status=status, mimetype='application/json',
+                                  headers={'Retry-After': '5'} if status == 503 else None)
+    finally:
+        if idempotency_key:
+            with _lotes_lock:
+                _lotes_en_curso.discard(idempotency_key)
 
 @app.route("/api/editar_arbol/<int:arbol_id>", methods=['PUT'])
 @handle_errors
+@requiere_auth()
 def editar_arbol(arbol_id):
     datos = request.json
     if not datos:
@@ -172,74 +1192,67 @@ def editar_arbol(arbol_id):
     if not updates:
         raise ValueError("No hay cambios para aplicar")
 
-    logger.info(f"Editando árbol ID {arbol_id}: {updates}")
-    response = supabase.table("arboles_sembrados") \
-        .update(updates).eq("id", arbol_id).execute()
-
-    if hasattr(response, 'error') and response.error:
-         logger.error(f"Error al actualizar árbol {arbol_id} en Supabase: {response.error.message}")
-         raise Exception(f"Error de base de datos: {response.error.message}")
-    if not response.data:
+    logger.info(f"Editando árbol ID {arbol_id}: campos {sorted(updates)}")
+    try:
+        arbol = repos.arboles.actualizar(arbol_id, updates)
+    except Exception as e:
+        logger.error(f"Error al actualizar árbol {arbol_id}: {e}")
+        raise
+    if arbol is None:
          logger.warning(f"No se actualizó data para el árbol {arbol_id}, ¿existe?")
          raise ValueError(f"No se pudo actualizar el árbol con ID {arbol_id} (puede que no exista)")
 
+    registrar_cambio_arbol('update', arbol)
     logger.info(f"Árbol {arbol_id} actualizado")
-    return jsonify(response.data[0]), 200
+    return jsonify(arbol), 200
 
 @app.route("/api/eliminar_arbol/<int:arbol_id>", methods=['DELETE'])
 @handle_errors
+@requiere_auth()
 def eliminar_arbol(arbol_id):
     logger.info(f"Intentando eliminar árbol ID {arbol_id}")
 
     try:
-        tree_response = supabase.table("arboles_sembrados") \
-            .select("foto_url").eq("id", arbol_id).maybe_single().execute()
-
-        foto_url_a_eliminar = None
-        if tree_response.data and tree_response.data.get("foto_url"):
-            foto_url_a_eliminar = tree_response.data["foto_url"]
-
-    except Exception as e:
-        logger.error(f"Error al obtener foto_url para árbol {arbol_id}: {e}")
-
-    try:
-        delete_response = supabase.table("arboles_sembrados") \
-            .delete().eq("id", arbol_id).execute()
-
-        if hasattr(delete_response, 'error') and delete_response.error:
-            logger.error(f"Error al eliminar árbol {arbol_id} de Supabase DB: {delete_response.error.message}")
-            raise Exception(f"Error de base de datos al eliminar: {delete_response.error.message}")
-        if not delete_response.data:
+        eliminado = repos.arboles.eliminar(arbol_id)
+        if eliminado is None:
             logger.warning(f"No se eliminó data para el árbol {arbol_id}, ¿existía?")
             raise ValueError(f"No se encontró el árbol con ID {arbol_id} para eliminar")
 
+        registrar_cambio_arbol('delete', {"id": arbol_id})
         logger.info(f"Registro de árbol {arbol_id} eliminado de la base de datos.")
 
     except Exception as e:
          logger.error(f"Error crítico al eliminar registro de árbol {arbol_id}: {e}", exc_info=True)
          return jsonify({"error": f"Error al eliminar el registro del árbol: {e}"}), 500
 
-    if foto_url_a_eliminar:
-        try:
-            if "/arboles-fotos/" in foto_url_a_eliminar:
-                path_parts = foto_url_a_eliminar.split("/arboles-fotos/")
-                if len(path_parts) > 1:
-                    filename = path_parts[-1].split("?")[0]
-                    if filename:
-                         logger.info(f"Intentando eliminar foto del storage: arboles-fotos/{filename}")
-                         storage_response = supabase.storage.from_("arboles-fotos").remove([filename])
-                         logger.info(f"Solicitud de eliminación de foto {filename} enviada al storage.")
-                    else:
-                         logger.warning(f"No se pudo extraer filename válido de la URL: {foto_url_a_eliminar}")
-
-        except Exception as e:
-            logger.warning(f"No se pudo eliminar la foto {foto_url_a_eliminar} del storage (el registro del árbol ya fue eliminado): {e}")
+    encolar_eliminacion_foto(eliminado.get("foto_url"))
 
     return jsonify({"message": f"Árbol {arbol_id} eliminado exitosamente (y foto asociada, si existía, marcada para eliminar)", "id": arbol_id}), 200
 
+@app.route("/api/eventos/arboles", methods=['GET'])
+@handle_errors
+def eventos_arboles():
+    """Stream SSE con los cambios de árboles: eventos 'arboles' con diffs y 'reset' si hay que recargar"""
+    ultimo = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    try:
+        ultimo_id = int(ultimo) if ultimo else None
+    except ValueError:
+        raise ValueError("Last-Event-ID debe ser un número entero")
+
+    try:
+        stream = eventos.suscribir(ultimo_id)
+    except LimiteConexiones as e:
+        logger.warning(str(e))
+        return jsonify({"error": "Demasiadas conexiones en tiempo real. Intenta de nuevo más tarde."}), 503, {
+            'Retry-After': str(eventos.heartbeat)}
+
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # --- SUBIDA DE FOTOS ---
 @app.route("/api/upload_foto", methods=['POST'])
 @handle_errors
+@requiere_auth()
 def upload_foto():
     if 'foto' not in request.files:
         raise ValueError("No se envió ninguna foto")
@@ -253,33 +1266,51 @@ def upload_foto():
     if file_ext not in allowed_extensions:
         raise ValueError(f"Formato no permitido. Use: {', '.join(allowed_extensions)}")
 
+    file_content = file.read()
+    content_type = f"image/{file_ext}" if file_ext != 'jpg' else 'image/jpeg'
+    thumbnail_content = None
+
+    if image_pipeline.disponible():
+        inicio = time.perf_counter()
+        tamano_original = len(file_content)
+        try:
+            file_content, thumbnail_content, file_ext, content_type = \
+                image_pipeline.procesar_foto(file_content, timeout=FOTO_TIMEOUT)
+        except TimeoutError:
+            logger.warning(f"Sin cupo para procesar la foto tras {FOTO_TIMEOUT}s")
+            return jsonify({"error": "El servidor está procesando muchas fotos. Intenta de nuevo en unos segundos."}), 503, {
+                'Retry-After': '10'}
+        logger.info(f"Foto procesada: {tamano_original} -> {len(file_content)} bytes "
+                    f"(miniatura {len(thumbnail_content)} bytes) en {time.perf_counter() - inicio:.2f}s")
+    else:
+        logger.warning("Pillow no está instalado: la foto se sube sin procesar")
+
     unique_filename = f"{uuid.uuid4()}.{file_ext}"
     logger.info(f"Subiendo foto: {unique_filename}")
 
     try:
-        file_content = file.read()
-        content_type = f"image/{file_ext}" if file_ext != 'jpg' else 'image/jpeg'
-
-        response = supabase.storage.from_("arboles-fotos").upload(
-            path=unique_filename,
-            file=file_content,
-            file_options={
-                "content-type": content_type,
-                "cache-control": "3600",
-                "upsert": "false"
-            }
-        )
-
-        public_url = supabase.storage.from_("arboles-fotos").get_public_url(unique_filename)
+        repos.fotos.subir(unique_filename, file_content, content_type)
+        public_url = repos.fotos.url_publica(unique_filename)
+
+        thumbnail_url = None
+        if thumbnail_content is not None:
+            # La miniatura no es necesaria para responder: se guarda en el spool y la sube la cola
+            thumbnail_filename = image_pipeline.nombre_miniatura(unique_filename)
+            spool_path = os.path.join(SPOOL_DIR, thumbnail_filename)
+            with open(spool_path, 'wb') as fh:
+                fh.write(thumbnail_content)
+            job_queue.enqueue('subir_foto', {"path": thumbnail_filename, "spool_path": spool_path, "content_type": content_type})
+            thumbnail_url = repos.fotos.url_publica(thumbnail_filename)
 
         logger.info(f"Foto subida exitosamente: {public_url}")
         return jsonify({
             "foto_url": public_url,
+            "thumbnail_url": thumbnail_url,
             "filename": unique_filename
         }), 201
 
     except Exception as e:
-        logger.error(f"Error al subir foto a Supabase Storage: {str(e)}", exc_info=True)
+        logger.error(f"Error al subir foto al storage: {str(e)}", exc_info=True)
         error_message = f"Error interno al subir la foto: {str(e)}"
         if "policy" in str(e).lower():
             error_message = "Error de permisos al subir la foto. Verifica las políticas RLS del bucket."
@@ -291,60 +1322,149 @@ def upload_foto():
 # --- ESTADÍSTICAS ---
 @app.route("/api/predecir_horas", methods=['GET'])
 @handle_errors
+@limitar('estadisticas', RATE_LIMITS['estadisticas'])
+@cache_response
 def predecir_horas():
-    response = supabase.table("arboles_sembrados").select("id", count='exact').execute()
-    conteo = response.count if hasattr(response, 'count') and response.count is not None else 0
+    asegurar_arboles_en_memoria()
     return jsonify({
-        "arboles_totales": conteo,
-        "horas_estimadas": round(conteo * 1.5, 1)
+        "arboles_totales": estadisticas.total,
+        "horas_estimadas": estadisticas.horas_estimadas()
     }), 200
 
 @app.route("/api/estadisticas_graficos", methods=['GET'])
 @handle_errors
+@limitar('estadisticas', RATE_LIMITS['estadisticas'])
+@cache_response
 def estadisticas_graficos():
-    logger.info("Generando datos para gráficos...")
-    response = supabase.table("arboles_sembrados") \
-        .select("especie, fecha_siembra").execute()
-
-    if not response.data:
-        return jsonify({"arboles_por_mes": {}, "top_especies": {}}), 200
+    logger.debug("Generando datos para gráficos...")
+    asegurar_arboles_en_memoria()
+    return jsonify(estadisticas.resumen()), 200
 
-    arboles = response.data
-    from collections import defaultdict
-
-    arboles_por_mes = defaultdict(int)
-    for arbol in arboles:
-        try:
-            fecha_str = arbol['fecha_siembra']
-            if fecha_str:
-                 if fecha_str.endswith('Z'):
-                      fecha_str = fecha_str[:-1] + '+00:00'
-                 fecha = datetime.fromisoformat(fecha_str)
-                 mes_año = fecha.strftime('%Y-%m')
-                 arboles_por_mes[mes_año] += 1
-        except (ValueError, TypeError, KeyError) as e:
-             logger.warning(f"Error al procesar fecha '{arbol.get('fecha_siembra')}': {e}")
-             continue
-
-    especies_count = defaultdict(int)
-    for arbol in arboles:
-        especie = arbol.get('especie')
-        if especie:
-            especies_count[especie.strip()] += 1
+@app.route("/api/analitica", methods=['GET'])
+@handle_errors
+@limitar('estadisticas', RATE_LIMITS['estadisticas'])
+@cache_response
+def analitica_arboles():
+    """Serie temporal (?granularidad=dia|semana|mes), densidad por cantón y por celda (?celda=grados),
+    totales por usuario y diversidad de especies, filtrado por ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD"""
+    if analitica is None:
+        return jsonify({"error": "Analítica no disponible: NumPy no está instalado"}), 503
+
+    desde = analytics.parse_fecha(request.args.get('desde'), 'desde')
+    hasta = analytics.parse_fecha(request.args.get('hasta'), 'hasta')
+    if desde and hasta and desde > hasta:
+        raise ValueError("'desde' no puede ser posterior a 'hasta'")
+    try:
+        celda = float(request.args.get('celda', 0.05))
+        top = int(request.args.get('top', 10))
+    except ValueError:
+        raise ValueError("'celda' y 'top' deben ser números válidos")
+    if not 0.001 <= celda <= 1 or not 1 <= top <= 100:
+        raise ValueError("'celda' debe estar entre 0.001 y 1 grados y 'top' entre 1 y 100")
 
-    top_especies_sorted = sorted(especies_count.items(), key=lambda item: item[1], reverse=True)
-    top_especies = dict(top_especies_sorted[:10])
+    asegurar_arboles_en_memoria()
+    return jsonify(analitica.resumen(desde, hasta, request.args.get('granularidad', 'mes'), celda, top)), 200
 
-    arboles_por_mes_sorted = dict(sorted(arboles_por_mes.items()))
+@app.route("/api/estadisticas/recalcular", methods=['POST'])
+@handle_errors
+@requiere_auth()
+@limitar('recalcular', RATE_LIMITS['recalcular'])
+def recalcular_estadisticas():
+    logger.info("Recalculando datos en memoria a pedido...")
+    asegurar_arboles_en_memoria(forzar=True, incluir_estadisticas=True)
+    return jsonify({"arboles_totales": estadisticas.total}), 200
+
+@app.route("/metrics", methods=['GET'])
+def exponer_metricas():
+    return Response(metricas.exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route("/api/metricas/supabase", methods=['GET'])
+@handle_errors
+def metricas_supabase():
+    return jsonify(latencias.resumen()), 200
 
+# --- TRABAJOS EN SEGUNDO PLANO ---
+@app.route("/api/jobs/estado", methods=['GET'])
+@handle_errors
+@requiere_auth(obligatorio=True)
+def estado_jobs():
+    # El payload lleva rutas y nombres de archivo internos: basta el tipo y el error para decidir un reintento
+    dead_letters = [{k: v for k, v in job.items() if k != "payload"} for job in job_queue.dead_letters()]
     return jsonify({
-        "arboles_por_mes": arboles_por_mes_sorted,
-        "top_especies": top_especies
+        "conteo_por_estado": job_queue.stats(),
+        "dead_letters": dead_letters
     }), 200
 
+@app.route("/api/jobs/<int:job_id>/reintentar", methods=['POST'])
+@handle_errors
+@requiere_auth(obligatorio=True)
+def reintentar_job(job_id):
+    if not job_queue.reintentar(job_id):
+        raise ValueError(f"El trabajo {job_id} no existe o no está en dead-letter")
+    return jsonify({"message": f"Trabajo {job_id} reencolado", "id": job_id}), 200
+
+@app.route("/api/jobs/reconciliar_fotos", methods=['POST'])
+@handle_errors
+@requiere_auth(obligatorio=True)
+@limitar('mantenimiento', RATE_LIMITS['mantenimiento'])
+def reconciliar_fotos():
+    # Recorre todos los árboles y lista el bucket entero: nunca más de una pendiente
+    job_id = job_queue.enqueue_unico('reconciliar_fotos', {})
+    if job_id is None:
+        return jsonify({"error": "Ya hay una reconciliación de fotos pendiente o en curso"}), 409
+    return jsonify({"message": "Reconciliación de fotos encolada", "id": job_id}), 202
+
+@app.route("/api/jobs/deduplicar", methods=['POST'])
+@handle_errors
+@requiere_auth(admin=True)
+def deduplicar_arboles():
+    """Encola la búsqueda de duplicados (`radio_m`, `ventana`), que solo escribe el reporte.
+
+    Con `eliminar: true` borra los `ids` elegidos de ese reporte, identificado por su
+    `generado_en` en `reporte` para no actuar sobre uno más nuevo que nadie revisó.
+    """
+    datos = request.get_json(silent=True) or {}
+    if datos.get("eliminar") is True:
+        ids = datos.get("ids")
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError("Para eliminar se requiere 'ids': los ids revisados del reporte de duplicados")
+        reporte = leer_reporte_duplicados()
+        if reporte is None or datos.get("reporte") != reporte["generado_en"]:
+            raise ValueError("'reporte' debe ser el generado_en del último reporte de duplicados")
+        if reporte["ventana"] <= 0:
+            raise ValueError("Solo se eliminan duplicados de una búsqueda con ventana mayor que 0")
+        fuera = set(ids) - {d["id"] for d in reporte["duplicados"]}
+        if fuera:
+            raise ValueError(f"Ids que no figuran como duplicados en el reporte: {sorted(fuera)[:20]}")
+        payload = {"eliminar": True, "ids": sorted(set(ids)), "reporte": reporte["generado_en"]}
+    else:
+        payload = {}
+        try:
+            if "radio_m" in datos:
+                payload["radio_m"] = float(datos["radio_m"])
+            if "ventana" in datos:
+                payload["ventana"] = int(datos["ventana"])
+        except (TypeError, ValueError):
+            raise ValueError("radio_m y ventana deben ser números")
+        if not 0 < payload.get("radio_m", DUPLICADOS_RADIO_M) <= DUPLICADOS_RADIO_MAX_M or payload.get("ventana", 0) < 0:
+            raise ValueError(f"radio_m debe estar entre 0 y {DUPLICADOS_RADIO_MAX_M:g} m y ventana no puede ser negativa")
+
+    job_id = job_queue.enqueue('deduplicar_arboles', payload)
+    return jsonify({"message": "Búsqueda de duplicados encolada", "id": job_id}), 202
+
+@app.route("/api/duplicados", methods=['GET'])
+@handle_errors
+def reporte_duplicados():
+    """Último reporte del trabajo de deduplicación"""
+    if not os.path.exists(DUPLICADOS_REPORTE):
+        return jsonify({"error": "Todavía no se ejecutó la búsqueda de duplicados"}), 404
+    with open(DUPLICADOS_REPORTE, encoding='utf-8') as fh:
+        return Response(fh.read(), mimetype='application/json')
+
 # --- AUTENTICACIÓN CON VALIDACIÓN MEJORADA ---
 @app.route("/api/register", methods=['POST'])
 @handle_errors
+@limitar('auth', RATE_LIMITS['auth'])
 def register_user():
     datos = request.json
     if not datos:
@@ -365,43 +1485,23 @@ def register_user():
 
     logger.info(f"Intentando registrar usuario: {email}")
     try:
-        user_response = supabase.auth.sign_up({
-            "email": email,
-            "password": password,
-            "options": {
-                "data": {
-                    "name": name,
-                    "birthdate": birthdate
-                }
-            }
-        })
-        
-        if user_response and user_response.user:
-             logger.info(f"Usuario {email} registrado pendiente de confirmación. ID: {user_response.user.id}")
-             return jsonify({
-                 "message": "Registro exitoso. Revisa tu email para confirmar la cuenta.",
-                 "user_id": user_response.user.id
-                 }), 201
-        elif hasattr(user_response, 'error') and user_response.error:
-             msg = user_response.error.message
-             logger.warning(f"Error de Supabase al registrar {email}: {msg}")
-             if "already registered" in msg.lower():
-                  raise ValueError("Este email ya está registrado.")
-             else:
-                  raise Exception(f"Error del servicio de autenticación: {msg}")
-        else:
-             logger.error(f"Respuesta inesperada de Supabase Auth al registrar {email}: {user_response}")
-             raise Exception("Respuesta inesperada del servicio de autenticación.")
+        user = repos.auth.sign_up(email, password, {"name": name, "birthdate": birthdate})
+        logger.info(f"Usuario {email} registrado pendiente de confirmación. ID: {user['id']}")
+        return jsonify({
+            "message": "Registro exitoso. Revisa tu email para confirmar la cuenta.",
+            "user_id": user["id"]
+            }), 201
 
     except Exception as e:
-         logger.error(f"Excepción durante el registro de {email}: {e}", exc_info=True)
-         if isinstance(e, ValueError):
-              raise e
-         else:
-              raise Exception(f"No se pudo completar el registro: {e}")
+         msg = str(e)
+         logger.error(f"Excepción durante el registro de {email}: {msg}", exc_info=True)
+         if "already registered" in msg.lower():
+              raise ValueError("Este email ya está registrado.")
+         raise Exception(f"No se pudo completar el registro: {msg}")
 
 @app.route("/api/login", methods=['POST'])
 @handle_errors
+@limitar('auth', RATE_LIMITS['auth'])
 def login_user():
     datos = request.json
     if not datos:
@@ -415,27 +1515,20 @@ def login_user():
 
     logger.info(f"Intento de login para: {email}")
     try:
-        response = supabase.auth.sign_in_with_password({"email": email, "password": password})
+        user_data, session_data = repos.auth.sign_in(email, password)
+        logger.info(f"Login exitoso para {email}. User ID: {user_data['id']}")
 
-        if response.user and response.session:
-            logger.info(f"Login exitoso para {email}. User ID: {response.user.id}")
-            user_data = response.user.dict()
-            session_data = response.session.dict()
+        user_name = (user_data.get("user_metadata") or {}).get("name")
 
-            user_name = user_data.get("user_metadata", {}).get("name")
+        if not user_name:
+             user_name = email.split('@')[0]
 
-            if not user_name:
-                 user_name = email.split('@')[0]
+        user_data['name'] = user_name
 
-            user_data['name'] = user_name
-
-            return jsonify({
-                 "user": user_data,
-                 "session": session_data
-            }), 200
-        else:
-             logger.warning(f"Respuesta inesperada de sign_in_with_password para {email}")
-             raise ValueError("Credenciales inválidas o error inesperado.")
+        return jsonify({
+             "user": user_data,
+             "session": session_data
+        }), 200
 
     except Exception as e:
         error_msg = str(e)
@@ -447,14 +1540,34 @@ def login_user():
         else:
             raise Exception(f"Error de autenticación: {error_msg}")
 
+@app.route("/api/refresh_token", methods=['POST'])
+@handle_errors
+@limitar('auth', RATE_LIMITS['auth'])
+def refresh_token():
+    """Sesión nueva a partir del refresh token, para renovar el access token sin volver a iniciar sesión"""
+    datos = request.get_json(silent=True) or {}
+    refresh = datos.get("refresh_token")
+    if not refresh or not isinstance(refresh, str):
+        raise ValueError("refresh_token requerido")
+
+    try:
+        user_data, session_data = repos.auth.refresh_session(refresh)
+    except Exception as e:
+        logger.info(f"Refresh token rechazado: {e}")
+        raise NoAutorizado("Sesión expirada. Inicia sesión de nuevo.")
+
+    user_data['name'] = (user_data.get("user_metadata") or {}).get("name") or (user_data.get("email") or "").split('@')[0]
+    return jsonify({"user": user_data, "session": session_data}), 200
+
 @app.route("/api/forgot_password", methods=['POST'])
 @handle_errors
+@limitar('recuperacion', RATE_LIMITS['recuperacion'])
 def send_recovery_email():
     email = validate_email(request.json.get("email", ""))
 
     logger.info(f"Solicitud de recuperación de contraseña para: {email}")
     try:
-        supabase.auth.reset_password_for_email(email)
+        repos.auth.reset_password(email)
         logger.info(f"Correo de recuperación enviado (o simulado) a {email}.")
         return jsonify({"message": "Si el email está registrado, recibirás un correo para restablecer tu contraseña."}), 200
     except Exception as e:
@@ -463,37 +1576,21 @@ def send_recovery_email():
 
 @app.route("/api/update_password", methods=['POST'])
 @handle_errors
+@requiere_auth(obligatorio=True)
+@limitar('auth', RATE_LIMITS['auth'])
 def update_password():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-         raise ValueError("Token de autorización faltante o inválido.")
-    jwt_token = auth_header.split(' ')[1]
-
     new_password = validate_password(request.json.get("new_password", ""))
+    user_id = g.usuario["sub"]
+    logger.info(f"Usuario {user_id} intentando actualizar contraseña.")
 
     try:
-        user_response = supabase.auth.get_user(jwt_token)
-        if not user_response or not user_response.user:
-             raise ValueError("Token inválido o expirado.")
-
-        user_id = user_response.user.id
-        logger.info(f"Usuario {user_id} intentando actualizar contraseña.")
-
-        update_response = supabase.auth.update_user(attributes={'password': new_password})
-
-        if update_response and update_response.user:
-             logger.info(f"Contraseña actualizada exitosamente para usuario {user_id}.")
-             return jsonify({"message": "Contraseña actualizada correctamente."}), 200
-        else:
-             logger.error(f"Respuesta inesperada al actualizar contraseña para {user_id}: {update_response}")
-             raise Exception("No se pudo actualizar la contraseña debido a un error inesperado.")
-
+        repos.auth.update_password(token_de_header(request.headers.get('Authorization')), new_password)
     except Exception as e:
         logger.error(f"Error al actualizar contraseña: {e}", exc_info=True)
-        error_msg = str(e)
-        if "invalid token" in error_msg.lower():
-             raise ValueError("Token inválido o expirado.")
-        raise Exception(f"Error al actualizar la contraseña: {error_msg}")
+        raise Exception(f"Error al actualizar la contraseña: {e}")
+
+    logger.info(f"Contraseña actualizada exitosamente para usuario {user_id}.")
+    return jsonify({"message": "Contraseña actualizada correctamente."}), 200
 
 # --- MANEJO DE ERRORES GENÉRICOS DE FLASK ---
 @app.errorhandler(404)
@@ -517,10 +1614,13 @@ def internal_error(error):
     return jsonify({"error": "Ocurrió un error interno inesperado en el servidor."}), 500
 
 # --- INICIO DE LA APP ---
+# Servidor de desarrollo. En producción: gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == "__main__":
     host = os.environ.get('FLASK_RUN_HOST', '0.0.0.0')
     port = int(os.environ.get('FLASK_RUN_PORT', 5000))
-    debug_mode = os.environ.get('FLASK_DEBUG', 'True').lower() in ['true', '1', 't']
+    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() in ['true', '1', 't']
+
+    programar_tareas_periodicas()
 
     logger.info(f"Iniciando Reforesta Manabí en {host}:{port} (Debug: {debug_mode})...")
     app.run(debug=debug_mode, host=host, port=port)
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""Pipeline de assets estáticos: minifica, versiona por contenido y precomprime JS/CSS.
+
+    python assets.py            # compila static/ -> static/dist/ y escribe manifest.json
+    python assets.py --check    # sale con código 1 si el build está desactualizado
+
+Cada archivo compilado lleva el hash de su contenido en el nombre (main.3f2a9c1b7e4d.js), así
+que se puede servir con Cache-Control: immutable: un cambio produce otro nombre. Junto a cada
+uno se guardan las variantes .gz y .br para no comprimir en cada request.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se generan las variantes .gz
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # sin minificador el JS se copia tal cual (igual se versiona y comprime)
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ORIGEN = os.path.join(BASE_DIR, 'static')
+DESTINO = os.path.join(ORIGEN, 'dist')
+ASSETS = ('main.js', 'styles.css')
+MANIFEST = 'manifest.json'
+CODIFICACIONES = {'br': '.br', 'gzip': '.gz'}
+
+
+def minificar(nombre, contenido):
+    """Minifica JS/CSS si el minificador está instalado; si no, devuelve el contenido sin cambios"""
+    if nombre.endswith('.js') and rjsmin is not None:
+        return rjsmin.jsmin(contenido)
+    if nombre.endswith('.css') and rcssmin is not None:
+        return rcssmin.cssmin(contenido)
+    return contenido
+
+
+def nombre_versionado(nombre, cuerpo):
+    base, extension = os.path.splitext(nombre)
+    return f"{base}.{hashlib.sha256(cuerpo).hexdigest()[:12]}{extension}"
+
+
+def _huella_origen(path):
+    with open(path, 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def construir(origen=ORIGEN, destino=DESTINO, assets=ASSETS):
+    """Compila los assets y escribe el manifest; devuelve el manifest {nombre: entrada}"""
+    os.makedirs(destino, exist_ok=True)
+    anterior = leer_manifest(destino)
+    manifest = {}
+    for nombre in assets:
+        with open(os.path.join(origen, nombre), 'rb') as fh:
+            fuente = fh.read()
+        cuerpo = minificar(nombre, fuente.decode('utf-8')).encode('utf-8')
+        salida = nombre_versionado(nombre, cuerpo)
+
+        variantes = {salida: cuerpo, salida + '.gz': gzip.compress(cuerpo, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variantes[salida + '.br'] = brotli.compress(cuerpo, quality=11)
+        for archivo, datos in variantes.items():
+            temporal = os.path.join(destino, f"{archivo}.{os.getpid()}.tmp")
+            with open(temporal, 'wb') as fh:
+                fh.write(datos)
+            os.replace(temporal, os.path.join(destino, archivo))
+
+        manifest[nombre] = {"archivo": salida, "origen": hashlib.sha256(fuente).hexdigest(),
+                            "bytes": len(fuente), "bytes_minificado": len(cuerpo)}
+        logger.info(f"{nombre} -> {salida} ({len(fuente)} -> {len(cuerpo)} bytes)")
+
+    temporal = os.path.join(destino, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(temporal, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2)
+    os.replace(temporal, os.path.join(destino, MANIFEST))
+    _borrar_obsoletos(destino, manifest, anterior)
+    return manifest
+
+
+def _borrar_obsoletos(destino, manifest, anterior):
+    """Borra builds viejos; conserva el anterior para las páginas ya servidas durante un deploy"""
+    vigentes = {MANIFEST}
+    for entrada in list(manifest.values()) + list(anterior.values()):
+        vigentes.add(entrada["archivo"])
+        vigentes.update(entrada["archivo"] + sufijo for sufijo in CODIFICACIONES.values())
+    for archivo in os.listdir(destino):
+        if archivo not in vigentes and not archivo.endswith('.tmp'):  # .tmp: build en curso de otro proceso
+            try:
+                os.remove(os.path.join(destino, archivo))
+            except OSError:
+                pass
+
+
+def leer_manifest(destino=DESTINO):
+    try:
+        with open(os.path.join(destino, MANIFEST), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def desactualizados(origen=ORIGEN, destino=DESTINO, assets=ASSETS):
+    """Assets cuyo build falta o no corresponde al contenido actual de static/"""
+    manifest = leer_manifest(destino)
+    return [nombre for nombre in assets
+            if nombre not in manifest
+            or manifest[nombre]["origen"] != _huella_origen(os.path.join(origen, nombre))
+            or not os.path.exists(os.path.join(destino, manifest[nombre]["archivo"]))]
+
+
+class AssetManifest:
+    """Resuelve el nombre lógico de un asset ('main.js') al archivo versionado que se sirve.
+
+    Los assets sin build vigente (p. ej. editados en desarrollo sin recompilar) se sirven desde
+    static/ con revalidación normal, así que nunca se entrega una versión vieja.
+    """
+
+    def __init__(self, origen=ORIGEN, destino=DESTINO, assets=ASSETS):
+        self.origen = origen
+        self.destino = destino
+        self.assets = assets
+        self.archivos = {}
+
+    def cargar(self, compilar=False):
+        """Lee el manifest (compilando antes si `compilar` y hay assets desactualizados).
+
+        Si no se puede escribir en dist/ (p. ej. filesystem de solo lectura) se sigue sin
+        compilar: los assets pendientes se sirven desde static/.
+        """
+        pendientes = desactualizados(self.origen, self.destino, self.assets)
+        if pendientes and compilar:
+            try:
+                construir(self.origen, self.destino, self.assets)
+                pendientes = []
+            except OSError as e:
+                logger.warning(f"No se pudieron compilar los assets en {self.destino} (se sirven sin versionar): {e}")
+        elif pendientes:
+            logger.warning(f"Assets sin compilar o desactualizados (se sirven sin versionar): {pendientes}")
+        manifest = leer_manifest(self.destino)
+        self.archivos = {nombre: manifest[nombre]["archivo"] for nombre in self.assets
+                         if nombre in manifest and nombre not in pendientes}
+        return self
+
+    def resolver(self, nombre):
+        """Archivo versionado en dist/ o None si el asset debe servirse desde static/"""
+        return self.archivos.get(nombre)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compila los assets estáticos (minificados, versionados y precomprimidos)")
+    parser.add_argument('--check', action='store_true', help="solo verificar que el build está al día")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        pendientes = desactualizados()
+        if pendientes:
+            print(f"Assets desactualizados: {', '.join(pendientes)} (ejecuta: python assets.py)")
+            return 1
+        print("Assets al día.")
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if rjsmin is None or rcssmin is None:
+        logger.warning("rjsmin/rcssmin no instalados: los assets se versionan y comprimen sin minificar")
+    if brotli is None:
+        logger.warning("brotli no instalado: solo se generan variantes .gz")
+    manifest = construir()
+    print(f"{len(manifest)} assets compilados en {DESTINO}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
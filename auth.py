@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import time
+
+import jwt
+
+from cache import MemoryLRUCache
+
+logger = logging.getLogger(__name__)
+
+ALGORITMOS_ASIMETRICOS = {'RS256', 'RS384', 'RS512', 'ES256', 'ES384', 'ES512', 'EdDSA'}
+
+
+class NoAutorizado(Exception):
+    """Token ausente, inválido o expirado (se responde 401)"""
+
+
+class SinPermiso(Exception):
+    """Token válido de un usuario que no puede hacer la operación (se responde 403)"""
+
+
+def es_admin(claims, emails_admin=()):
+    """Administrador: rol 'admin' en app_metadata (solo lo asigna la service key) o email en la lista"""
+    if not claims:
+        return False
+    if (claims.get('app_metadata') or {}).get('role') == 'admin':
+        return True
+    email = (claims.get('email') or '').lower()
+    return bool(email) and email in emails_admin
+
+
+def token_de_header(valor):
+    """'Bearer <token>' -> token, o None si el header falta o no es Bearer"""
+    if not valor:
+        return None
+    partes = valor.split(' ', 1)
+    if len(partes) != 2 or partes[0].lower() != 'bearer' or not partes[1].strip():
+        return None
+    return partes[1].strip()
+
+
+class TokenVerifier:
+    """Valida access tokens de Supabase/locales sin ir a la red en cada request.
+
+    - HS256: firma verificada con `secret` (el JWT secret del proyecto o LOCAL_JWT_SECRET).
+    - RS256/ES256: firma verificada con las claves publicadas en `jwks_url` (se cachean).
+    - Si el token no se puede verificar localmente y hay `respaldo` (p. ej. auth.get_user), se
+      valida por red una vez y el resultado también se cachea.
+
+    Los claims validados se guardan en un LRU acotado hasta `cache_ttl` segundos y nunca más
+    allá del `exp` del token. Un token revocado antes de expirar sigue siendo aceptado hasta
+    entonces, igual que con cualquier verificación local de JWT.
+    """
+
+    def __init__(self, secret=None, jwks_url=None, audience='authenticated', leeway=30,
+                 cache_max_entries=10000, cache_ttl=300, respaldo=None):
+        self.secret = secret
+        self.audience = audience
+        self.leeway = leeway
+        self.respaldo = respaldo
+        self.cache = MemoryLRUCache(max_entries=cache_max_entries, ttl=cache_ttl)
+        self._jwks = jwt.PyJWKClient(jwks_url, cache_keys=True, lifespan=3600) if jwks_url else None
+
+    def verificar(self, token):
+        """Devuelve los claims del token o lanza NoAutorizado"""
+        if not token:
+            raise NoAutorizado("Token de autorización faltante.")
+        clave = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = self.cache.get(clave)
+        if claims is not None and claims.get('exp', float('inf')) > time.time():
+            return claims
+
+        claims = self._verificar_sin_cache(token)
+        self.cache.set(clave, claims)
+        return claims
+
+    def _verificar_sin_cache(self, token):
+        try:
+            algoritmo = jwt.get_unverified_header(token).get('alg')
+        except jwt.InvalidTokenError:
+            raise NoAutorizado("Token inválido o expirado.")
+
+        if algoritmo == 'HS256' and self.secret:
+            clave = self.secret
+        elif algoritmo in ALGORITMOS_ASIMETRICOS and self._jwks is not None:
+            try:
+                clave = self._jwks.get_signing_key_from_jwt(token).key
+            except jwt.PyJWKClientError as e:
+                logger.warning(f"No se pudo obtener la clave de firma del JWKS: {e}")
+                return self._verificar_por_red(token)
+        else:
+            return self._verificar_por_red(token)
+
+        try:
+            return jwt.decode(token, clave, algorithms=[algoritmo], audience=self.audience, leeway=self.leeway,
+                              options={"require": ["exp", "sub"]})
+        except jwt.InvalidTokenError:
+            raise NoAutorizado("Token inválido o expirado.")
+
+    def _verificar_por_red(self, token):
+        if self.respaldo is None:
+            raise NoAutorizado("Token inválido o expirado.")
+        try:
+            usuario = self.respaldo(token)
+        except Exception as e:
+            logger.warning(f"Validación remota del token falló: {e}")
+            usuario = None
+        if not usuario:
+            raise NoAutorizado("Token inválido o expirado.")
+        try:
+            exp = jwt.decode(token, options={"verify_signature": False}).get('exp')
+        except jwt.InvalidTokenError:
+            exp = None
+        claims = {"sub": usuario["id"], "email": usuario.get("email"), "user_metadata": usuario.get("user_metadata", {}),
+                  "app_metadata": usuario.get("app_metadata", {})}
+        if exp:
+            claims["exp"] = exp
+        return claims
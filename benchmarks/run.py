@@ -0,0 +1,414 @@
+"""Suite de rendimiento reproducible para las rutas de la API.
+
+Siembra 10k / 100k / 1M árboles sintéticos en el backend local (SQLite) y mide las rutas
+principales con concurrencia configurable, tanto con el cliente de pruebas de Flask (sin red)
+como contra un servidor WSGI real. Cada tamaño corre en un subproceso propio para que el
+pico de RSS y la configuración del app (que se lee al importar) no se mezclen entre corridas.
+
+    python -m benchmarks.run --sizes 10000,100000 --concurrency 1,8
+    python -m benchmarks.run --baseline benchmarks/results/baseline.json --fail-on-regression
+    python -m benchmarks.run --sizes 10000 --save-baseline
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+from benchmarks.seed import CABECERAS, ESPECIES, base_sembrada  # noqa: E402
+
+RESULTADOS_DIR = os.path.join(RAIZ, 'benchmarks', 'results')
+BASELINE_PATH = os.path.join(RESULTADOS_DIR, 'baseline.json')
+
+Peticion = namedtuple('Peticion', 'metodo ruta cuerpo content_type')
+
+
+# --- Escenarios: cada uno genera la petición i-ésima de forma determinista ---
+def _json(metodo, ruta, datos):
+    return Peticion(metodo, ruta, json.dumps(datos).encode('utf-8'), 'application/json')
+
+
+def escenario_lista(rng, cantidad):
+    offset = rng.randrange(0, max(1, min(cantidad, 10000)), 100)
+    return Peticion('GET', f"/api/obtener_arboles?limit=100&offset={offset}", None, None)
+
+
+def escenario_bbox(rng, cantidad):
+    lat, lng = rng.choice(CABECERAS)
+    lat, lng = lat + rng.uniform(-0.05, 0.05), lng + rng.uniform(-0.05, 0.05)
+    zoom = rng.randint(13, 17)
+    return Peticion('GET', f"/api/obtener_arboles?bbox={lng - 0.03:.4f},{lat - 0.02:.4f},{lng + 0.03:.4f},"
+                           f"{lat + 0.02:.4f}&zoom={zoom}&limit=1000", None, None)
+
+
+def escenario_cursor(rng, cantidad):
+    return Peticion('GET', "/api/obtener_arboles?cursor=&limit=100", None, None)
+
+
+def escenario_estadisticas(rng, cantidad):
+    return Peticion('GET', "/api/estadisticas_graficos", None, None)
+
+
+def escenario_horas(rng, cantidad):
+    return Peticion('GET', "/api/predecir_horas", None, None)
+
+
+def escenario_analitica(rng, cantidad):
+    mes = rng.randint(1, 12)
+    granularidad = rng.choice(['dia', 'semana', 'mes'])
+    return Peticion('GET', f"/api/analitica?granularidad={granularidad}&desde=2024-{mes:02d}-01&hasta=2025-{mes:02d}-01",
+                    None, None)
+
+
+def escenario_plantar(rng, cantidad):
+    lat, lng = rng.choice(CABECERAS)
+    return _json('POST', "/api/plantar_arbol", {
+        "especie": rng.choice(ESPECIES),
+        "latitud": round(lat + rng.uniform(-0.05, 0.05), 6),
+        "longitud": round(lng + rng.uniform(-0.05, 0.05), 6),
+        "user_email": "benchmark@ejemplo.com"
+    })
+
+
+_foto_jpeg = None
+
+
+def foto_de_prueba():
+    """JPEG de 2400x1800 como los de un celular, generado una sola vez (requiere Pillow)"""
+    global _foto_jpeg
+    if _foto_jpeg is None:
+        from PIL import Image
+        imagen = Image.effect_noise((2400, 1800), 64).convert('RGB')
+        salida = io.BytesIO()
+        imagen.save(salida, format='JPEG', quality=90)
+        _foto_jpeg = salida.getvalue()
+    return _foto_jpeg
+
+
+def escenario_foto(rng, cantidad):
+    frontera = uuid.UUID(int=rng.getrandbits(128)).hex
+    cuerpo = (f"--{frontera}\r\nContent-Disposition: form-data; name=\"foto\"; filename=\"foto.jpg\"\r\n"
+              f"Content-Type: image/jpeg\r\n\r\n").encode('utf-8') + foto_de_prueba() + f"\r\n--{frontera}--\r\n".encode('utf-8')
+    return Peticion('POST', "/api/upload_foto", cuerpo, f"multipart/form-data; boundary={frontera}")
+
+
+# Las lecturas van primero: las escrituras invalidan el cache de respuestas
+ESCENARIOS = {
+    'obtener_arboles': escenario_lista,
+    'obtener_arboles_bbox': escenario_bbox,
+    'obtener_arboles_cursor': escenario_cursor,
+    'estadisticas_graficos': escenario_estadisticas,
+    'predecir_horas': escenario_horas,
+    'analitica': escenario_analitica,
+    'plantar_arbol': escenario_plantar,
+    'upload_foto': escenario_foto,
+}
+ESCENARIOS_PESADOS = {'upload_foto'}  # se corren con menos peticiones
+# Cada corrida de estos escenarios usa su propia semilla: repetir las coordenadas ya plantadas
+# por la corrida anterior las haría rechazar como duplicadas (409)
+ESCENARIOS_ESCRITURA = {'plantar_arbol'}
+
+
+# --- Drivers: ejecutan una petición y devuelven el status ---
+class ClientePruebas:
+    """Cliente de pruebas de Flask: mide el app sin red ni servidor"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def __call__(self, peticion):
+        cliente = getattr(self._local, 'cliente', None)
+        if cliente is None:
+            cliente = self._local.cliente = self.app.test_client()
+        response = cliente.open(peticion.ruta, method=peticion.metodo, data=peticion.cuerpo,
+                                content_type=peticion.content_type)
+        response.get_data()
+        return response.status_code
+
+
+class ClienteHTTP:
+    """Cliente HTTP/1.1 con una conexión keep-alive por hilo contra un servidor WSGI real"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._local = threading.local()
+
+    def __call__(self, peticion):
+        for intento in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            headers = {'Content-Type': peticion.content_type} if peticion.content_type else {}
+            try:
+                conn.request(peticion.metodo, peticion.ruta, body=peticion.cuerpo, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if intento:
+                    raise
+
+
+def servidor_wsgi(app):
+    """Levanta el app en el servidor WSGI multihilo de Werkzeug en un puerto libre"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    WSGIRequestHandler.log_request = lambda *args, **kwargs: None
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, name='bench-wsgi', daemon=True).start()
+    return servidor
+
+
+# --- Medición ---
+def percentil(muestras, p):
+    return muestras[min(len(muestras) - 1, int(p * len(muestras)))]
+
+
+def medir(driver, escenario, cantidad, peticiones, concurrencia, semilla):
+    rng = random.Random(semilla)
+    lote = [escenario(rng, cantidad) for _ in range(peticiones)]
+    errores = 0
+    latencias = []
+    lock = threading.Lock()
+
+    def ejecutar(peticion):
+        nonlocal errores
+        inicio = time.perf_counter()
+        try:
+            status = driver(peticion)
+        except Exception:
+            status = 599
+        duracion = time.perf_counter() - inicio
+        with lock:
+            latencias.append(duracion)
+            if status >= 400:
+                errores += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(ejecutar, lote))
+    total = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "peticiones": peticiones,
+        "concurrencia": concurrencia,
+        "errores": errores,
+        "p50_ms": round(percentil(latencias, 0.50) * 1000, 3),
+        "p95_ms": round(percentil(latencias, 0.95) * 1000, 3),
+        "p99_ms": round(percentil(latencias, 0.99) * 1000, 3),
+        "max_ms": round(latencias[-1] * 1000, 3),
+        "throughput_rps": round(peticiones / total, 2),
+    }
+
+
+def rss_actual_mb():
+    try:
+        with open('/proc/self/status') as fh:
+            for linea in fh:
+                if linea.startswith('VmRSS:'):
+                    return round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def rss_pico_mb():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB y macOS bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def correr_tamano(args):
+    """Cuerpo del subproceso: mide todas las rutas para un tamaño de datos"""
+    trabajo = tempfile.mkdtemp(prefix='reforesta-bench-')
+    try:
+        inicio = time.perf_counter()
+        base = base_sembrada(args.seed_cache, args.size, args.seed)
+        sembrado_s = time.perf_counter() - inicio
+        shutil.copyfile(base, os.path.join(trabajo, 'reforesta.sqlite3'))
+
+        os.environ.update({
+            'DATA_BACKEND': 'local',
+            'DATA_DIR': trabajo,
+            'LOCAL_JWT_SECRET': 'benchmark-' + 'x' * 32,
+            'CACHE_BACKEND': 'memory',
+            'JOBS_WORKERS': '1',
+            'RECONCILIAR_FOTOS_INTERVALO': '0',
+            'RATE_LIMIT_ENABLED': 'false',  # todas las peticiones salen de la misma IP
+        })
+        os.chdir(trabajo)  # logs/ del app queda dentro del directorio temporal
+        import logging
+        import app as modulo_app
+        logging.getLogger().setLevel(logging.WARNING)
+
+        inicio = time.perf_counter()
+        modulo_app.asegurar_arboles_en_memoria(forzar=True)
+        carga_s = time.perf_counter() - inicio
+
+        resultado = {
+            "arboles": args.size,
+            "sembrado_s": round(sembrado_s, 3),
+            "carga_en_memoria_s": round(carga_s, 3),
+            "rss_tras_carga_mb": rss_actual_mb(),
+            "rutas": {},
+        }
+
+        escenarios = [nombre for nombre in args.routes if nombre in ESCENARIOS]
+        if 'upload_foto' in escenarios and not modulo_app.image_pipeline.disponible():
+            print("Pillow no está instalado: se omite upload_foto", file=sys.stderr)
+            escenarios.remove('upload_foto')
+
+        for modo in args.modes:
+            if modo == 'testclient':
+                driver, servidor = ClientePruebas(modulo_app.app), None
+            else:
+                servidor = servidor_wsgi(modulo_app.app)
+                driver = ClienteHTTP('127.0.0.1', servidor.server_port)
+            try:
+                for nombre in escenarios:
+                    peticiones = max(1, args.requests // 4) if nombre in ESCENARIOS_PESADOS else args.requests
+                    for concurrencia in args.concurrency:
+                        clave = f"{modo}:{nombre}:c{concurrencia}"
+                        semilla = f"{args.seed}:{clave}" if nombre in ESCENARIOS_ESCRITURA else args.seed
+                        resultado["rutas"][clave] = medir(driver, ESCENARIOS[nombre], args.size, peticiones,
+                                                          concurrencia, semilla)
+                        print(f"  {args.size:>8} {clave:<40} p95={resultado['rutas'][clave]['p95_ms']}ms "
+                              f"{resultado['rutas'][clave]['throughput_rps']} req/s", file=sys.stderr)
+            finally:
+                if servidor is not None:
+                    servidor.shutdown()
+
+        modulo_app.job_queue.stop()
+        resultado["rss_pico_mb"] = rss_pico_mb()
+        return resultado
+    finally:
+        shutil.rmtree(trabajo, ignore_errors=True)
+
+
+# --- Orquestación y comparación con el baseline ---
+def version_codigo():
+    """Commit medido; con sufijo -dirty si el árbol tenía cambios sin commitear"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty', '--abbrev=7'], cwd=RAIZ, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def correr_suite(args):
+    resultados = {
+        "metadata": {
+            "fecha": datetime.now(timezone.utc).isoformat(),
+            "commit": version_codigo(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "semilla": args.seed,
+            "peticiones": args.requests,
+        },
+        "tamanos": {},
+    }
+    for size in args.sizes:
+        comando = [sys.executable, '-m', 'benchmarks.run', '--worker', '--size', str(size),
+                   '--seed', str(args.seed), '--requests', str(args.requests),
+                   '--concurrency', ','.join(map(str, args.concurrency)), '--modes', ','.join(args.modes),
+                   '--routes', ','.join(args.routes), '--seed-cache', args.seed_cache]
+        salida = subprocess.run(comando, cwd=RAIZ, stdout=subprocess.PIPE, check=True).stdout
+        resultados["tamanos"][str(size)] = json.loads(salida.decode('utf-8').strip().splitlines()[-1])
+    return resultados
+
+
+def comparar(actual, baseline, umbral):
+    """Lista de regresiones: p95 que sube o throughput que baja más que `umbral` (fracción)"""
+    regresiones = []
+    for size, datos in actual["tamanos"].items():
+        base = baseline.get("tamanos", {}).get(size)
+        if base is None:
+            continue
+        for clave, medida in datos["rutas"].items():
+            anterior = base["rutas"].get(clave)
+            if anterior is None:
+                continue
+            p95 = (medida["p95_ms"] - anterior["p95_ms"]) / anterior["p95_ms"] if anterior["p95_ms"] else 0
+            rps = (anterior["throughput_rps"] - medida["throughput_rps"]) / anterior["throughput_rps"] if anterior["throughput_rps"] else 0
+            marca = "REGRESIÓN" if p95 > umbral or rps > umbral else ""
+            print(f"{size:>8} {clave:<40} p95 {anterior['p95_ms']:>9.2f} -> {medida['p95_ms']:>9.2f}ms ({p95:+.0%})  "
+                  f"rps {anterior['throughput_rps']:>9.1f} -> {medida['throughput_rps']:>9.1f} ({-rps:+.0%}) {marca}")
+            if marca:
+                regresiones.append((size, clave))
+        if base.get("rss_pico_mb") and datos["rss_pico_mb"] > base["rss_pico_mb"] * (1 + umbral):
+            print(f"{size:>8} RSS pico {base['rss_pico_mb']} -> {datos['rss_pico_mb']} MB REGRESIÓN")
+            regresiones.append((size, "rss_pico_mb"))
+    return regresiones
+
+
+def lista(tipo):
+    return lambda valor: [tipo(v) for v in valor.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de la API de reforestación")
+    parser.add_argument('--sizes', type=lista(int), default=[10000, 100000, 1000000])
+    parser.add_argument('--concurrency', type=lista(int), default=[1, 8])
+    parser.add_argument('--requests', type=int, default=200, help="peticiones por ruta y nivel de concurrencia")
+    parser.add_argument('--modes', type=lista(str), default=['testclient', 'wsgi'])
+    parser.add_argument('--routes', type=lista(str), default=list(ESCENARIOS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--seed-cache', default=os.path.join(RAIZ, 'data', 'bench'),
+                        help="directorio donde se reutilizan las bases sembradas")
+    parser.add_argument('--output', default=os.path.join(RESULTADOS_DIR, 'latest.json'))
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="guarda el resultado como nuevo baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="variación tolerada antes de marcar regresión")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(correr_tamano(args)))
+        return 0
+
+    resultados = correr_suite(args)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as fh:
+        json.dump(resultados, fh, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.output}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline actualizado en {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as fh:
+            regresiones = comparar(resultados, json.load(fh), args.threshold)
+        if regresiones and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
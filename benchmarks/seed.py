@@ -0,0 +1,82 @@
+import os
+import random
+import shutil
+from datetime import datetime, timedelta, timezone
+
+from repositories import SQLiteDatabase
+
+# Cabeceras cantonales de Manabí (lat, lng): la mayoría de los árboles se siembran cerca de zonas pobladas
+CABECERAS = [
+    (-1.0546, -80.4545),  # Portoviejo
+    (-0.9677, -80.7089),  # Manta
+    (-0.6982, -80.0936),  # Chone
+    (-1.3486, -80.5786),  # Jipijapa
+    (-0.2707, -79.4649),  # El Carmen
+    (-0.6009, -80.4239),  # Bahía de Caráquez
+    (0.0708, -80.0537),   # Pedernales
+    (-1.1658, -80.3914),  # Santa Ana
+    (-0.8466, -80.1622),  # Calceta
+    (-0.9488, -80.2851),  # Rocafuerte
+]
+# Límites aproximados de la provincia: (min_lat, max_lat, min_lng, max_lng)
+LIMITES_MANABI = (-1.95, 0.45, -80.95, -79.40)
+ESPECIES = [
+    "Guayacán", "Ceibo", "Laurel", "Teca", "Samán", "Fernán Sánchez", "Cedro", "Balsa",
+    "Algarrobo", "Tamarindo", "Pechiche", "Moral fino", "Caoba", "Guachapelí", "Mangle rojo",
+]
+USUARIOS = 500
+LOTE_INSERCION = 50000
+
+
+def generar_arboles(cantidad, semilla=42, inicio=None):
+    """Genera `cantidad` árboles sintéticos reproducibles (misma semilla, mismos datos)"""
+    rng = random.Random(semilla)
+    inicio = inicio or datetime(2023, 1, 1, tzinfo=timezone.utc)
+    segundos = 3 * 365 * 24 * 3600
+    min_lat, max_lat, min_lng, max_lng = LIMITES_MANABI
+    for _ in range(cantidad):
+        if rng.random() < 0.7:
+            lat, lng = rng.choice(CABECERAS)
+            lat = min(max_lat, max(min_lat, rng.gauss(lat, 0.05)))
+            lng = min(max_lng, max(min_lng, rng.gauss(lng, 0.05)))
+        else:
+            lat, lng = rng.uniform(min_lat, max_lat), rng.uniform(min_lng, max_lng)
+        fecha = inicio + timedelta(seconds=rng.randrange(segundos), microseconds=rng.randrange(1000000))
+        yield (
+            rng.choice(ESPECIES),
+            round(lat, 6),
+            round(lng, 6),
+            fecha.strftime("%Y-%m-%dT%H:%M:%S.%f+00:00"),
+            None,
+            f"voluntario{rng.randrange(USUARIOS)}@ejemplo.com",
+        )
+
+
+def sembrar_base(path, cantidad, semilla=42):
+    """Crea una base SQLite del backend local con `cantidad` árboles sintéticos"""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = SQLiteDatabase(path).conexion()
+    filas = generar_arboles(cantidad, semilla)
+    while True:
+        lote = [fila for _, fila in zip(range(LOTE_INSERCION), filas)]
+        if not lote:
+            break
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO arboles_sembrados (especie, latitud, longitud, fecha_siembra, foto_url, user_email) "
+            "VALUES (?, ?, ?, ?, ?, ?)", lote)
+        conn.execute("COMMIT")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def base_sembrada(directorio, cantidad, semilla=42):
+    """Devuelve la ruta a una base sembrada, reutilizando la generada en corridas anteriores"""
+    os.makedirs(directorio, exist_ok=True)
+    path = os.path.join(directorio, f"arboles-{cantidad}-s{semilla}.sqlite3")
+    if not os.path.exists(path):
+        tmp = path + ".tmp"
+        sembrar_base(tmp, cantidad, semilla)
+        shutil.move(tmp, path)
+    return path
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryLRUCache:
+    """Cache en memoria del proceso con expiración por TTL y desalojo LRU al llegar a max_entries"""
+
+    def __init__(self, max_entries=256, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DiskCache:
+    """Cache en disco local (un archivo por clave), compartido entre procesos del mismo host.
+
+    La expiración se guarda junto al valor; el desalojo elimina los archivos menos
+    usados recientemente según su mtime, que se actualiza en cada lectura. Los valores son
+    pickles, así que el directorio tiene que ser del usuario del proceso y no escribible por
+    otros: si no, quien pudiera escribir ahí ejecutaría código al leerse una entrada.
+    """
+
+    def __init__(self, directory, max_entries=1024, ttl=60):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _verificar_directorio_privado(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                expires_at, value = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        if expires_at < time.time():
+            self._unlink(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump((time.time() + self.ttl, value), fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def delete(self, key):
+        self._unlink(self._path(key))
+
+    def clear(self):
+        for path in self._entries():
+            self._unlink(path)
+
+    def _entries(self):
+        try:
+            return [os.path.join(self.directory, name)
+                    for name in os.listdir(self.directory) if name.endswith('.cache')]
+        except OSError:
+            return []
+
+    def _evict(self):
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        def mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0
+        entries.sort(key=mtime)
+        for path in entries[:len(entries) - self.max_entries]:
+            self._unlink(path)
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _verificar_directorio_privado(directory):
+    """PermissionError si `directory` no es del usuario del proceso o lo pueden escribir otros"""
+    info = os.stat(directory)
+    if hasattr(os, 'geteuid') and info.st_uid != os.geteuid():
+        raise PermissionError(f"El directorio de cache {directory} pertenece a otro usuario")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"El directorio de cache {directory} es escribible por otros usuarios")
+
+
+def create_cache(backend='memory', max_entries=256, ttl=60, directory=None, namespace='default'):
+    """Crea el backend de cache configurado ('memory' o 'disk').
+
+    En disco cada namespace usa su propio subdirectorio de `directory` (obligatorio), para que
+    `clear` de un cache no borre otro.
+    """
+    if backend == 'memory':
+        return MemoryLRUCache(max_entries=max_entries, ttl=ttl)
+    if backend == 'disk':
+        if not directory:
+            raise ValueError("El cache en disco requiere un directorio")
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _verificar_directorio_privado(directory)
+        return DiskCache(os.path.join(directory, namespace), max_entries=max_entries, ttl=ttl)
+    raise ValueError(f"Backend de cache desconocido: {backend}")
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave: solo la primera ejecuta la función y las
+    demás esperan y reciben su resultado (o su excepción).
+
+    Quien espera más de `timeout` segundos deja de esperar y ejecuta la función por su cuenta.
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.compartidas = 0
+        self._vuelos = {}
+        self._lock = threading.Lock()
+
+    def hacer(self, clave, funcion):
+        """Devuelve (resultado, compartido); compartido es True si el resultado lo calculó otra llamada"""
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = {"evento": threading.Event(), "resultado": None, "error": None}
+
+        if not lider:
+            if not vuelo["evento"].wait(self.timeout):
+                return funcion(), False
+            with self._lock:
+                self.compartidas += 1
+            if vuelo["error"] is not None:
+                raise vuelo["error"]
+            return vuelo["resultado"], True
+
+        try:
+            vuelo["resultado"] = funcion()
+            return vuelo["resultado"], False
+        except BaseException as e:
+            vuelo["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._vuelos[clave]
+            vuelo["evento"].set()
@@ -0,0 +1,112 @@
+import math
+import threading
+from collections import Counter
+
+MAX_CLUSTER_ZOOM = 18
+
+# Cada tile del mapa se subdivide 2**SUBDIVISION veces por lado: a zoom z se agregan tiles de zoom z+3 (~32 px)
+SUBDIVISION = 3
+
+_MAX_LAT = 85.05112878
+
+
+def tile_de(lat, lng, zoom):
+    """Coordenadas (x, y) del tile Web Mercator que contiene el punto a ese zoom"""
+    lat = max(-_MAX_LAT, min(_MAX_LAT, lat))
+    n = 2 ** zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class _Agregado:
+    __slots__ = ("count", "suma_lat", "suma_lng", "especies")
+
+    def __init__(self):
+        self.count = 0
+        self.suma_lat = 0.0
+        self.suma_lng = 0.0
+        self.especies = Counter()
+
+
+class TileClusterIndex:
+    """Agregados por tile (conteo, centroide, especie dominante) para cada nivel de zoom.
+
+    Se mantienen de forma incremental: cada alta o baja de un árbol actualiza un tile por nivel.
+    """
+
+    def __init__(self, max_zoom=MAX_CLUSTER_ZOOM):
+        self.max_zoom = max_zoom
+        self._niveles = [dict() for _ in range(max_zoom + 1)]
+        self._lock = threading.Lock()
+
+    def cargar(self, arboles):
+        with self._lock:
+            self._niveles = [dict() for _ in range(self.max_zoom + 1)]
+            for arbol in arboles:
+                self._aplicar(arbol, 1)
+
+    def add(self, arbol):
+        with self._lock:
+            self._aplicar(arbol, 1)
+
+    def remove(self, arbol):
+        with self._lock:
+            self._aplicar(arbol, -1)
+
+    def _aplicar(self, arbol, signo):
+        lat, lng = arbol.get("latitud"), arbol.get("longitud")
+        if lat is None or lng is None:
+            return
+        lat, lng = float(lat), float(lng)
+        especie = (arbol.get("especie") or "").strip()
+
+        for zoom, tiles in enumerate(self._niveles):
+            clave = tile_de(lat, lng, zoom)
+            agregado = tiles.get(clave)
+            if agregado is None:
+                if signo < 0:
+                    continue
+                agregado = tiles[clave] = _Agregado()
+            agregado.count += signo
+            agregado.suma_lat += signo * lat
+            agregado.suma_lng += signo * lng
+            if especie:
+                agregado.especies[especie] += signo
+                if agregado.especies[especie] <= 0:
+                    del agregado.especies[especie]
+            if agregado.count <= 0:
+                del tiles[clave]
+
+    def nivel_para(self, zoom):
+        """Nivel de agregación usado para un zoom de mapa"""
+        return min(zoom + SUBDIVISION, self.max_zoom)
+
+    def query(self, min_lng, min_lat, max_lng, max_lat, zoom):
+        """Clusters de los tiles que intersectan el bbox al nivel correspondiente al zoom"""
+        nivel = self.nivel_para(zoom)
+        x0, y0 = tile_de(max_lat, min_lng, nivel)
+        x1, y1 = tile_de(min_lat, max_lng, nivel)
+
+        with self._lock:
+            tiles = self._niveles[nivel]
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > len(tiles):
+                candidatos = [(c, a) for c, a in tiles.items() if x0 <= c[0] <= x1 and y0 <= c[1] <= y1]
+            else:
+                candidatos = [((x, y), tiles[(x, y)])
+                              for x in range(x0, x1 + 1)
+                              for y in range(y0, y1 + 1)
+                              if (x, y) in tiles]
+
+            clusters = []
+            for (x, y), agregado in candidatos:
+                dominante = agregado.especies.most_common(1)
+                clusters.append({
+                    "tile": [nivel, x, y],
+                    "count": agregado.count,
+                    "latitud": round(agregado.suma_lat / agregado.count, 6),
+                    "longitud": round(agregado.suma_lng / agregado.count, 6),
+                    "especie_dominante": dominante[0][0] if dominante else None
+                })
+        return clusters
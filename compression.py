@@ -0,0 +1,39 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se negocia gzip
+    brotli = None
+
+# Por debajo de este tamaño comprimir no compensa los encabezados extra
+MIN_COMPRESS_SIZE = 1024
+
+
+def compress_variants(body):
+    """Devuelve {encoding: cuerpo_comprimido} con las codificaciones disponibles para el cuerpo"""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return {}
+    variants = {"gzip": gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=7)
+    return variants
+
+
+def negotiate_encoding(accept_encoding, available):
+    """Elige la mejor codificación aceptada por el cliente entre las disponibles (br > gzip)"""
+    aceptadas = {}
+    for parte in (accept_encoding or "").split(","):
+        nombre, _, params = parte.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if nombre:
+            aceptadas[nombre.lower()] = q
+
+    for encoding in ("br", "gzip"):
+        if encoding in available and aceptadas.get(encoding, aceptadas.get("*", 0)) > 0:
+            return encoding
+    return None
@@ -0,0 +1,30 @@
+"""Soporte para correr la app en workers gevent (miles de streams SSE por proceso).
+
+gunicorn.conf.py parchea el proceso con gevent antes de importar la app: los hilos de
+`threading` pasan a ser greenlets que comparten un único hilo del sistema, así que el
+trabajo de CPU (Pillow, NumPy, reconstruir el índice) detendría a todos los clientes del
+worker. Estas funciones lo mandan a hilos nativos cuando el proceso está parcheado y no
+cambian nada cuando no lo está.
+"""
+try:
+    from gevent import monkey
+except ImportError:  # sin gevent siempre se usan hilos normales
+    monkey = None
+
+
+def parcheado():
+    """True si gevent reemplazó `threading` en este proceso"""
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def en_hilo_nativo(funcion, *args):
+    """Ejecuta `funcion(*args)` en un hilo del sistema y espera su resultado.
+
+    Con gevent solo espera el greenlet que llama; sin gevent es una llamada directa.
+    `funcion` no debe tomar locks compartidos con los greenlets.
+    """
+    if not parcheado():
+        return funcion(*args)
+    import gevent
+    return gevent.get_hub().threadpool.apply(funcion, args)
+
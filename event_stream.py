@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+Evento = namedtuple('Evento', 'id tipo texto')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS eventos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    origen TEXT NOT NULL DEFAULT '',
+    creado_en REAL NOT NULL
+);
+"""
+
+
+class LimiteConexiones(Exception):
+    """El proceso ya atiende el máximo de suscriptores permitido (se responde 503)"""
+
+
+def formato_sse(evento_id, tipo, datos):
+    """Serializa un evento en el formato de Server-Sent Events"""
+    return f"id: {evento_id}\nevent: {tipo}\ndata: {datos}\n\n"
+
+
+class EventJournal:
+    """Journal de eventos en SQLite compartido por todos los procesos del host.
+
+    El id autoincremental es el id del evento en el stream: es el mismo en todos los workers,
+    así que un cliente puede reanudar con Last-Event-ID aunque reconecte a otro proceso.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        conn = self._conexion()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(eventos)")}
+        if 'origen' not in columnas:
+            conn.execute("ALTER TABLE eventos ADD COLUMN origen TEXT NOT NULL DEFAULT ''")
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def agregar(self, tipo, datos, origen=''):
+        """Guarda un evento (datos ya serializados como JSON) y devuelve su id"""
+        cursor = self._conexion().execute(
+            "INSERT INTO eventos (tipo, datos, origen, creado_en) VALUES (?, ?, ?, ?)",
+            (tipo, datos, origen, time.time()))
+        return cursor.lastrowid
+
+    def desde(self, ultimo_id, limite=1000, con_origen=False):
+        """Eventos (id, tipo, datos) con id mayor que `ultimo_id`, en orden; `con_origen` agrega el proceso"""
+        columnas = "id, tipo, datos, origen" if con_origen else "id, tipo, datos"
+        return self._conexion().execute(
+            f"SELECT {columnas} FROM eventos WHERE id > ? ORDER BY id LIMIT ?", (ultimo_id, limite)).fetchall()
+
+    def limites(self):
+        """(primer id, último id) guardados; (None, 0) si el journal está vacío"""
+        primero, ultimo = self._conexion().execute("SELECT MIN(id), MAX(id) FROM eventos").fetchone()
+        return primero, ultimo or 0
+
+    def purgar(self, retener):
+        """Conserva solo los últimos `retener` eventos"""
+        self._conexion().execute(
+            "DELETE FROM eventos WHERE id <= (SELECT MAX(id) FROM eventos) - ?", (retener,))
+
+
+class EventBroker:
+    """Fan-out de eventos a clientes SSE conectados a este proceso.
+
+    Un único hilo por proceso lee el journal y agrega los eventos nuevos a un buffer circular;
+    cada evento se serializa una sola vez y todos los suscriptores esperan en la misma
+    Condition, así que publicar cuesta lo mismo con diez clientes que con diez mil. Los
+    eventos publicados en este proceso se leen de inmediato; los de otros workers llegan
+    en a lo sumo `poll_interval` segundos.
+
+    Un cliente que reconecta con Last-Event-ID recibe lo que se perdió desde el buffer o,
+    si es más antiguo, desde el journal. Si ni el journal lo conserva se le envía un evento
+    'reset' para que recargue el estado completo.
+
+    Los oyentes registrados con `escuchar` reciben los eventos publicados por otros procesos,
+    lo que permite a cada worker mantener al día su estado en memoria.
+    """
+
+    def __init__(self, journal, buffer=1000, retencion=10000, poll_interval=1.0, heartbeat=15,
+                 max_conexiones=1000, duracion_max=1800, reintento_ms=3000):
+        self.journal = journal
+        self.retencion = retencion
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.max_conexiones = max_conexiones
+        self.duracion_max = duracion_max
+        self.reintento_ms = reintento_ms
+        self.publicados = 0
+        self.conexiones = 0
+        self.origen = None
+        self._oyentes = []
+        self._buffer = deque(maxlen=buffer)
+        self._ultimo_id = journal.limites()[1]
+        self._condicion = threading.Condition()
+        self._despertar = threading.Event()
+        self._stop = threading.Event()
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def ultimo_id(self):
+        return self._ultimo_id
+
+    def start(self):
+        """Arranca el hilo lector del journal de este proceso (y lo rearranca tras un fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.origen = uuid.uuid4().hex[:16]  # identifica los eventos de este proceso en el journal
+            self._stop.clear()
+            threading.Thread(target=self._leer_journal, name="eventos", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._despertar.set()
+        with self._condicion:
+            self._condicion.notify_all()
+        self._pid = None
+
+    def escuchar(self, oyente):
+        """Registra oyente(tipo, datos) para los eventos publicados por otros procesos"""
+        self._oyentes.append(oyente)
+
+    def publicar(self, tipo, datos):
+        """Agrega un evento al journal y despierta al lector; devuelve el id asignado"""
+        self.start()
+        evento_id = self.journal.agregar(tipo, json.dumps(datos, ensure_ascii=False, separators=(',', ':')),
+                                         self.origen)
+        self.publicados += 1
+        self._despertar.set()
+        return evento_id
+
+    def _leer_journal(self):
+        lecturas = 0
+        while not self._stop.is_set():
+            self._despertar.wait(self.poll_interval)
+            self._despertar.clear()
+            try:
+                filas = self.journal.desde(self._ultimo_id, con_origen=True)
+                while filas:
+                    with self._condicion:
+                        for evento_id, tipo, datos, _ in filas:
+                            self._buffer.append(Evento(evento_id, tipo, formato_sse(evento_id, tipo, datos)))
+                        self._ultimo_id = filas[-1][0]
+                        self._condicion.notify_all()
+                    self._avisar_oyentes(filas)
+                    filas = self.journal.desde(self._ultimo_id, con_origen=True)
+                lecturas += 1
+                if lecturas % 600 == 0:
+                    self.journal.purgar(self.retencion)
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo leer el journal de eventos: {e}")
+
+    def _avisar_oyentes(self, filas):
+        if not self._oyentes:
+            return
+        for _, tipo, datos, origen in filas:
+            if origen == self.origen:
+                continue
+            for oyente in self._oyentes:
+                try:
+                    oyente(tipo, json.loads(datos))
+                except Exception as e:
+                    logger.error(f"Error al aplicar un evento '{tipo}' de otro proceso: {e}", exc_info=True)
+
+    def _pendientes(self, ultimo_id):
+        """Eventos del buffer posteriores a `ultimo_id`, o None si el buffer ya no los cubre"""
+        if ultimo_id >= self._ultimo_id:
+            return []
+        if not self._buffer or ultimo_id < self._buffer[0].id - 1:
+            return None
+        pendientes = []
+        for evento in reversed(self._buffer):
+            if evento.id <= ultimo_id:
+                break
+            pendientes.append(evento)
+        pendientes.reverse()
+        return pendientes
+
+    def _recuperar(self, ultimo_id):
+        """Texto SSE de lo que un cliente se perdió desde `ultimo_id` (puede leer del journal)"""
+        with self._condicion:
+            pendientes = self._pendientes(ultimo_id)
+        if pendientes is not None:
+            return ''.join(e.texto for e in pendientes), (pendientes[-1].id if pendientes else ultimo_id)
+
+        primero, _ = self.journal.limites()
+        if primero is None or primero > ultimo_id + 1:
+            return formato_sse(self._ultimo_id, 'reset', '{}'), self._ultimo_id
+        filas = self.journal.desde(ultimo_id, limite=self.retencion)
+        if not filas:
+            return '', ultimo_id
+        return ''.join(formato_sse(*fila) for fila in filas), filas[-1][0]
+
+    def suscribir(self, ultimo_id=None):
+        """Registra un suscriptor y devuelve el generador de su stream SSE.
+
+        Lanza LimiteConexiones si el proceso ya tiene `max_conexiones` suscriptores. Sin
+        `ultimo_id` el cliente recibe solo los eventos a partir de ahora.
+        """
+        self.start()
+        if self.conexiones >= self.max_conexiones:
+            raise LimiteConexiones("Demasiadas conexiones de eventos en este proceso")
+        if ultimo_id is None or ultimo_id > self._ultimo_id:
+            ultimo_id = self._ultimo_id
+        return self._stream(ultimo_id)
+
+    def _stream(self, ultimo_id):
+        # Se cuenta al empezar a iterar: un generador que nunca arrancó no ejecuta su finally
+        with self._condicion:
+            self.conexiones += 1
+        try:
+            inicial, ultimo_id = self._recuperar(ultimo_id)
+            yield f"retry: {self.reintento_ms}\n: conectado\n\n" + inicial
+            # Al cumplir duracion_max se cierra: el cliente reconecta con Last-Event-ID
+            fin = time.monotonic() + self.duracion_max
+            while not self._stop.is_set() and time.monotonic() < fin:
+                with self._condicion:
+                    if self._ultimo_id <= ultimo_id:
+                        self._condicion.wait(self.heartbeat)
+                    pendientes = self._pendientes(ultimo_id)
+                if pendientes is None:  # cliente demasiado lento: se pone al día desde el journal
+                    texto, ultimo_id = self._recuperar(ultimo_id)
+                    yield texto or ": ping\n\n"
+                elif pendientes:
+                    ultimo_id = pendientes[-1].id
+                    yield ''.join(e.texto for e in pendientes)
+                else:
+                    yield ": ping\n\n"  # mantiene viva la conexión y detecta clientes caídos
+        finally:
+            with self._condicion:
+                self.conexiones -= 1
@@ -0,0 +1,65 @@
+"""Configuración de gunicorn para producción: gunicorn -c gunicorn.conf.py wsgi:app
+
+Recarga ordenada: `kill -HUP <maestro>` reemplaza los workers uno a uno sin cortar requests.
+Con preload el código se carga en el maestro, así que para desplegar código nuevo sin
+cortes se usa `kill -USR2 <maestro>` (arranca un maestro nuevo) y luego `kill -TERM` al viejo.
+"""
+import multiprocessing
+import os
+import signal
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# gevent: cada conexión es un greenlet, así que un stream SSE abierto no ocupa un hilo del worker
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 5000))  # por worker (gevent)
+threads = int(os.environ.get('GUNICORN_THREADS', 16))  # por worker (gthread)
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() in ['true', '1', 't']
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))  # reciclar workers; 0 = nunca
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+errorlog = '-'
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'  # el heartbeat de los workers no depende del disco
+
+# En producción el app corre detrás del proxy de la plataforma: el rate limit usa la IP del cliente
+# de X-Forwarded-For y no la del proxy. PROXY_FIX_X_FOR=0 si gunicorn queda expuesto directamente.
+os.environ.setdefault('PROXY_FIX_X_FOR', '1')
+
+if worker_class == 'gevent':
+    # Antes de que preload importe la app, para que sus locks, colas y sockets sean cooperativos
+    from gevent import monkey
+    monkey.patch_all()
+    # Se reservan conexiones para los requests normales
+    os.environ.setdefault('EVENTOS_MAX_CONEXIONES', str(max(1, worker_connections - 500)))
+elif worker_class in ('sync', 'gthread'):
+    # Cada stream SSE ocupa un hilo mientras dura: la mitad queda reservada para requests normales
+    os.environ.setdefault('EVENTOS_MAX_CONEXIONES', str(max(1, threads // 2)))
+
+
+def post_fork(server, worker):
+    # El hilo de logging del maestro no existe en el worker: sin esto se perderían sus primeros registros
+    import app
+    app.logging_pipeline.start()
+
+
+def post_worker_init(worker):
+    import app
+    app.job_queue.start()
+    app.eventos.start()
+    app.programar_tareas_periodicas()
+
+    # SIGTERM: /ready pasa a 503 y se cierran los streams SSE, luego gunicorn drena lo demás
+    salir = worker.handle_exit
+
+    def handle_exit(sig, frame):
+        if worker_class == 'gevent':
+            import gevent  # fuera del manejador de señal, igual que gunicorn con SIGQUIT
+            gevent.spawn(app.preparar_apagado)
+        else:
+            app.preparar_apagado()
+        salir(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_exit)
@@ -0,0 +1,95 @@
+import io
+import os
+import threading
+
+import cooperativo
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow es opcional: sin él las fotos se suben tal cual llegan
+    Image = None
+
+MAX_DIMENSION = int(os.environ.get('FOTO_MAX_DIMENSION', 1600))
+CALIDAD = int(os.environ.get('FOTO_CALIDAD', 80))
+THUMB_DIMENSION = int(os.environ.get('FOTO_THUMB_DIMENSION', 320))
+THUMB_CALIDAD = int(os.environ.get('FOTO_THUMB_CALIDAD', 70))
+FORMATO = os.environ.get('FOTO_FORMATO', 'webp').lower()
+# Píxeles decodificados por foto: draft() solo reduce los JPEG, un PNG se decodifica entero en cada cupo
+MAX_PIXELES = int(os.environ.get('FOTO_MAX_PIXELES', 30_000_000))
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELES  # Pillow rechaza al abrir las que superan el doble
+
+_FORMATOS = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+}
+
+# Decodificar y recomprimir es trabajo de CPU: a lo sumo FOTO_WORKERS fotos a la vez por proceso
+_cupos = threading.BoundedSemaphore(int(os.environ.get('FOTO_WORKERS', min(4, os.cpu_count() or 1))))
+
+THUMB_SUFFIX = '_thumb'
+
+
+def disponible():
+    return Image is not None
+
+
+def nombre_miniatura(filename):
+    """'abc.webp' -> 'abc_thumb.webp'; la miniatura siempre se guarda junto a la foto original"""
+    base = filename.rsplit('.', 1)[0]
+    return f"{base}{THUMB_SUFFIX}.{_FORMATOS[FORMATO][1]}"
+
+
+def _codificar(imagen, calidad):
+    formato_pil = _FORMATOS[FORMATO][0]
+    if formato_pil == 'JPEG' and imagen.mode not in ('RGB', 'L'):
+        imagen = imagen.convert('RGB')
+    salida = io.BytesIO()
+    # Sin pasar exif= ni icc_profile=, Pillow no copia los metadatos del original
+    imagen.save(salida, format=formato_pil, quality=calidad, optimize=True)
+    return salida.getvalue()
+
+
+def procesar_foto(contenido, timeout=None):
+    """Normaliza una foto subida: orientación por EXIF, sin metadatos, tamaño acotado y recomprimida.
+
+    Devuelve (foto, miniatura, extension, content_type). La petición espera el resultado porque
+    responde con la URL de la foto ya procesada; el trabajo corre en un hilo nativo, así que con
+    gevent el resto de los clientes del worker sigue atendido. TimeoutError si no hay cupo en
+    `timeout` segundos.
+    """
+    if not _cupos.acquire(timeout=timeout):
+        raise TimeoutError("Demasiadas fotos en proceso")
+    try:
+        return cooperativo.en_hilo_nativo(_procesar, contenido)
+    finally:
+        _cupos.release()
+
+
+def _procesar(contenido):
+    try:
+        imagen = Image.open(io.BytesIO(contenido))
+        # Para JPEG, decodifica directamente a una escala reducida (mucho más rápido en fotos de celular)
+        imagen.draft('RGB', (MAX_DIMENSION, MAX_DIMENSION))
+        if imagen.width * imagen.height > MAX_PIXELES:
+            raise Image.DecompressionBombError(f"{imagen.width}x{imagen.height}")
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.load()
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"La foto es demasiado grande (máximo {MAX_PIXELES // 1_000_000} megapíxeles)") from e
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError("La foto no es una imagen válida") from e
+
+    if imagen.mode not in ('RGB', 'RGBA', 'L'):
+        imagen = imagen.convert('RGBA' if 'A' in imagen.getbands() else 'RGB')
+
+    imagen.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+    foto = _codificar(imagen, CALIDAD)
+
+    miniatura = imagen.copy()
+    miniatura.thumbnail((THUMB_DIMENSION, THUMB_DIMENSION), Image.LANCZOS)
+    miniatura = _codificar(miniatura, THUMB_CALIDAD)
+
+    _, extension, content_type = _FORMATOS[FORMATO]
+    return foto, miniatura, extension, content_type
+
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento REAL NOT NULL,
+    ultimo_error TEXT,
+    creado_en REAL NOT NULL,
+    actualizado_en REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_estado_proximo ON jobs (estado, proximo_intento);
+"""
+
+PENDIENTE = 'pendiente'
+EN_CURSO = 'en_curso'
+MUERTO = 'muerto'
+
+
+class JobQueue:
+    """Cola de trabajos en segundo plano con journal persistente en SQLite.
+
+    Los trabajos sobreviven a reinicios: un trabajo 'en_curso' cuyo lease venció (porque
+    el proceso murió) vuelve a tomarse. Los fallos se reintentan con backoff exponencial
+    y, agotados los intentos, quedan en estado 'muerto' para revisión manual.
+    """
+
+    def __init__(self, db_path, workers=2, max_intentos=5, backoff_base=2.0, backoff_max=3600,
+                 lease=300, poll_interval=5.0):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_intentos = max_intentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def register(self, tipo, handler):
+        """Asocia un tipo de trabajo con la función que lo ejecuta: handler(payload)"""
+        self._handlers[tipo] = handler
+
+    def enqueue(self, tipo, payload, retraso=0):
+        if tipo not in self._handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        ahora = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (tipo, payload, proximo_intento, creado_en, actualizado_en) VALUES (?, ?, ?, ?, ?)",
+                (tipo, json.dumps(payload), ahora + retraso, ahora, ahora))
+            job_id = cursor.lastrowid
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def enqueue_unico(self, tipo, payload, retraso=0):
+        """Encola solo si no hay ya un trabajo de ese tipo pendiente o en curso; devuelve el id o None"""
+        with self._connect() as conn:
+            existe = conn.execute("SELECT 1 FROM jobs WHERE tipo = ? AND estado IN (?, ?) LIMIT 1",
+                                  (tipo, PENDIENTE, EN_CURSO)).fetchone()
+        if existe:
+            return None
+        return self.enqueue(tipo, payload, retraso)
+
+    def start(self):
+        """Arranca los workers de este proceso (y los rearranca tras un fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"jobs-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def _claim(self):
+        ahora = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                fila = conn.execute(
+                    "SELECT id, tipo, payload, intentos FROM jobs "
+                    "WHERE estado IN (?, ?) AND proximo_intento <= ? ORDER BY proximo_intento LIMIT 1",
+                    (PENDIENTE, EN_CURSO, ahora)).fetchone()
+                if fila is not None:
+                    # Mientras está en curso, proximo_intento funciona como vencimiento del lease
+                    conn.execute("UPDATE jobs SET estado = ?, proximo_intento = ?, actualizado_en = ? WHERE id = ?",
+                                 (EN_CURSO, ahora + self.lease, ahora, fila[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return fila
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                fila = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error al leer la cola de trabajos: {e}")
+                fila = None
+            if fila is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._ejecutar(*fila)
+
+    def _ejecutar(self, job_id, tipo, payload, intentos):
+        handler = self._handlers.get(tipo)
+        try:
+            if handler is None:
+                raise RuntimeError(f"Sin handler registrado para '{tipo}'")
+            handler(json.loads(payload))
+        except Exception as e:
+            intentos += 1
+            ahora = time.time()
+            with self._connect() as conn:
+                if intentos >= self.max_intentos:
+                    logger.error(f"Trabajo {job_id} ({tipo}) movido a dead-letter tras {intentos} intentos: {e}")
+                    conn.execute("UPDATE jobs SET estado = ?, intentos = ?, ultimo_error = ?, actualizado_en = ? WHERE id = ?",
+                                 (MUERTO, intentos, str(e), ahora, job_id))
+                else:
+                    retraso = min(self.backoff_max, self.backoff_base ** intentos) * random.uniform(0.8, 1.2)
+                    logger.warning(f"Trabajo {job_id} ({tipo}) falló (intento {intentos}), reintento en {retraso:.0f}s: {e}")
+                    conn.execute("UPDATE jobs SET estado = ?, intentos = ?, ultimo_error = ?, proximo_intento = ?, actualizado_en = ? WHERE id = ?",
+                                 (PENDIENTE, intentos, str(e), ahora + retraso, ahora, job_id))
+            return
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        logger.info(f"Trabajo {job_id} ({tipo}) completado")
+
+    def stats(self):
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT estado, COUNT(*) FROM jobs GROUP BY estado").fetchall())
+
+    def dead_letters(self, limit=50):
+        with self._connect() as conn:
+            filas = conn.execute(
+                "SELECT id, tipo, payload, intentos, ultimo_error, actualizado_en FROM jobs "
+                "WHERE estado = ? ORDER BY actualizado_en DESC LIMIT ?", (MUERTO, limit)).fetchall()
+        return [
+            {"id": f[0], "tipo": f[1], "payload": json.loads(f[2]), "intentos": f[3],
+             "ultimo_error": f[4], "actualizado_en": f[5]}
+            for f in filas
+        ]
+
+    def reintentar(self, job_id):
+        """Devuelve un trabajo muerto a la cola con los intentos reiniciados"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET estado = ?, intentos = 0, proximo_intento = ?, actualizado_en = ? WHERE id = ? AND estado = ?",
+                (PENDIENTE, time.time(), time.time(), job_id, MUERTO))
+            actualizado = cursor.rowcount > 0
+        if actualizado:
+            self.start()
+            self._wakeup.set()
+        return actualizado
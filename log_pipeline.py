@@ -0,0 +1,294 @@
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+try:
+    from flask import g, has_request_context, request
+except ImportError:  # permite usar el pipeline fuera del app
+    has_request_context = lambda: False
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con el contexto del request cuando lo hay"""
+
+    CAMPOS_CONTEXTO = ('request_id', 'method', 'path', 'remote_addr')
+
+    def format(self, record):
+        entrada = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "pid": record.process,
+        }
+        for campo in self.CAMPOS_CONTEXTO:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                entrada[campo] = valor
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entrada["exc"] = record.exc_text
+        return json.dumps(entrada, ensure_ascii=False, default=str)
+
+
+class ContextoRequestFilter(logging.Filter):
+    """Copia al registro los datos del request en curso (el formateo ocurre en otro hilo)"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+            record.remote_addr = request.remote_addr
+        return True
+
+
+class MuestreoFilter(logging.Filter):
+    """Muestrea los mensajes INFO/DEBUG de los `loggers` de alto volumen (y sus hijos); el resto
+    de los loggers y todo WARNING o superior siempre pasan.
+
+    Por cada línea de código que loguea se dejan pasar los primeros `rafaga` registros de
+    cada ventana de `ventana` segundos y, a partir de ahí, una fracción `tasa` del resto.
+    """
+
+    def __init__(self, tasa=1.0, rafaga=20, ventana=60, loggers=()):
+        super().__init__()
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.ventana = ventana
+        self.loggers = tuple(loggers)
+        self.descartados = 0
+        self._conteos = {}
+        self._inicio_ventana = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.tasa >= 1.0:
+            return True
+        if not any(record.name == nombre or record.name.startswith(nombre + '.') for nombre in self.loggers):
+            return True
+        clave = (record.pathname, record.lineno)
+        with self._lock:
+            ahora = time.monotonic()
+            if ahora - self._inicio_ventana > self.ventana:
+                self._conteos.clear()
+                self._inicio_ventana = ahora
+            conteo = self._conteos.get(clave, 0) + 1
+            self._conteos[clave] = conteo
+            if conteo <= self.rafaga or random.random() < self.tasa:
+                return True
+            self.descartados += 1
+            return False
+
+
+class ColaHandler(QueueHandler):
+    """QueueHandler que conserva el traceback aparte del mensaje para el JsonFormatter"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class SizeTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """Rota al cumplirse el intervalo de tiempo o al superar `max_bytes`, lo que ocurra primero.
+
+    Varios procesos (workers de gunicorn) pueden escribir el mismo archivo: la rotación se hace
+    bajo un flock y, si otro proceso ya rotó, este solo reabre el archivo nuevo.
+    """
+
+    def __init__(self, filename, max_bytes=0, when='midnight', backup_count=14, encoding='utf-8'):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding=encoding, utc=True)
+        self.max_bytes = max_bytes
+        self._lock_path = self.baseFilename + '.lock'
+
+    def _rotado_por_otro(self):
+        """True si el archivo abierto ya no es el que está en baseFilename"""
+        if self.stream is None:
+            return False
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except OSError:
+            return True
+
+    def _reabrir(self):
+        if self.stream:
+            self.stream.close()
+        self.stream = self._open()
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+    def shouldRollover(self, record):
+        if self._rotado_por_otro():
+            self._reabrir()
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream.tell() >= self.max_bytes:
+                return True
+        return False
+
+    def doRollover(self):
+        if fcntl is None:
+            return self._rotar()
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self._rotado_por_otro():
+                    self._reabrir()
+                else:
+                    self._rotar()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _rotar(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        destino = self.rotation_filename(
+            f"{self.baseFilename}.{datetime.now(timezone.utc):%Y%m%d-%H%M%S}")
+        base, n = destino, 1
+        while os.path.exists(destino):  # varias rotaciones por tamaño en el mismo segundo
+            destino = f"{base}.{n}"
+            n += 1
+        if os.path.exists(self.baseFilename):
+            self.rotate(self.baseFilename, destino)
+        self._borrar_antiguos()
+        self.stream = self._open()
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+    def _borrar_antiguos(self):
+        if self.backupCount <= 0:
+            return
+        directorio, nombre = os.path.split(self.baseFilename)
+        rotados = [os.path.join(directorio, n) for n in os.listdir(directorio)
+                   if n.startswith(nombre + '.') and n != os.path.basename(self._lock_path)]
+        rotados.sort(key=os.path.getmtime)
+        for path in rotados[:max(0, len(rotados) - self.backupCount)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class LoggingPipeline:
+    """Logging sin I/O en el hilo del request: los registros van a una cola y un hilo los escribe.
+
+    El archivo se escribe en JSON lines con rotación por tamaño y tiempo; la consola mantiene
+    el formato de texto. El nivel se puede cambiar en caliente escribiendo el nombre del nivel
+    (DEBUG, INFO, WARNING...) en `archivo_nivel`, que se revisa cada `intervalo_nivel` segundos.
+    Solo los INFO de `loggers_muestreados` se muestrean con `tasa_info` (ver MuestreoFilter).
+    """
+
+    def __init__(self, archivo, nivel='INFO', max_bytes=10 * 1024 * 1024, rotacion='midnight', respaldos=14,
+                 consola=True, tasa_info=1.0, rafaga_info=20, loggers_muestreados=(), archivo_nivel=None,
+                 intervalo_nivel=5.0):
+        self.archivo = archivo
+        self.nivel = logging.getLevelName(nivel.upper()) if isinstance(nivel, str) else nivel
+        self.archivo_nivel = archivo_nivel
+        self.intervalo_nivel = intervalo_nivel
+        self.muestreo = MuestreoFilter(tasa=tasa_info, rafaga=rafaga_info, loggers=loggers_muestreados)
+
+        directorio = os.path.dirname(archivo)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._handlers = [SizeTimedRotatingFileHandler(archivo, max_bytes=max_bytes, when=rotacion,
+                                                       backup_count=respaldos)]
+        self._handlers[0].setFormatter(JsonFormatter())
+        if consola:
+            stream = logging.StreamHandler()
+            stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+            self._handlers.append(stream)
+
+        self.handler = ColaHandler(queue.SimpleQueue())
+        self.handler.addFilter(ContextoRequestFilter())
+        self.handler.addFilter(self.muestreo)
+
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._nivel_mtime = None
+        self._stop = threading.Event()
+
+    def instalar(self):
+        """Reemplaza los handlers del logger raíz por el handler de cola y arranca el listener"""
+        raiz = logging.getLogger()
+        for handler in list(raiz.handlers):
+            raiz.removeHandler(handler)
+        raiz.addHandler(self.handler)
+        raiz.setLevel(self.nivel)
+        self.start()
+
+    def start(self):
+        """Arranca el hilo escritor de este proceso (y lo rearranca con una cola nueva tras un fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Tras un fork el hilo del padre no existe aquí y la cola puede haber quedado tomada
+                self.handler.queue = queue.SimpleQueue()
+            self._pid = os.getpid()
+            # Evento nuevo por proceso: con gevent el vigilante del padre sobrevive al fork (es un
+            # greenlet) y, si terminara aquí, threading fallaría al darlo de baja
+            self._stop = threading.Event()
+            self._listener = QueueListener(self.handler.queue, *self._handlers, respect_handler_level=True)
+            self._listener.start()
+            if self.archivo_nivel:
+                threading.Thread(target=self._vigilar_nivel, args=(self._stop,), name="log-level", daemon=True).start()
+
+    def stop(self):
+        """Vacía la cola y detiene el escritor (llamar al apagar el proceso)"""
+        self._stop.set()
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+    def set_level(self, nivel):
+        nivel_num = logging.getLevelName(str(nivel).strip().upper())
+        if not isinstance(nivel_num, int):
+            raise ValueError(f"Nivel de log desconocido: {nivel}")
+        if nivel_num != logging.getLogger().level:
+            logging.getLogger().setLevel(nivel_num)
+            logging.getLogger(__name__).warning(f"Nivel de log cambiado a {logging.getLevelName(nivel_num)}")
+        self.nivel = nivel_num
+
+    def _vigilar_nivel(self, stop):
+        while not stop.wait(self.intervalo_nivel):
+            try:
+                mtime = os.path.getmtime(self.archivo_nivel)
+            except OSError:
+                continue
+            if mtime == self._nivel_mtime:
+                continue
+            self._nivel_mtime = mtime
+            try:
+                with open(self.archivo_nivel, encoding='utf-8') as fh:
+                    self.set_level(fh.read())
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).error(f"No se pudo aplicar {self.archivo_nivel}: {e}")
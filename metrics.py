@@ -0,0 +1,227 @@
+import bisect
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+from datetime import datetime
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores)) + ([extra] if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in pares) + '}'
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Counter:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores, cantidad=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def exponer(self):
+        with self._lock:
+            valores = dict(self._valores)
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for clave, valor in sorted(valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+class Histogram:
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # valores de etiquetas -> [conteos por bucket..., suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, valor, *valores):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exponer(self):
+        with self._lock:
+            series = {clave: list(serie) for clave, serie in self._series.items()}
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for clave, serie in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), serie):
+                acumulado += conteo
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, ('le', _numero(limite)))} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(serie[-2])}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {serie[-1]}")
+        return lineas
+
+
+class Gauge:
+    """Valor calculado al momento de exponer: `funcion()` devuelve {(valores de etiquetas): valor}"""
+
+    def __init__(self, nombre, ayuda, funcion, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.etiquetas = tuple(etiquetas)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge"]
+        for clave, valor in sorted(self.funcion().items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+class MetricsRegistry:
+    """Métricas del proceso en formato de exposición de texto de Prometheus.
+
+    Cada proceso (worker) lleva sus propias métricas; Prometheus las agrega por instancia.
+    """
+
+    def __init__(self):
+        self._metricas = []
+
+    def _registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def counter(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Counter(nombre, ayuda, etiquetas))
+
+    def histogram(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self._registrar(Histogram(nombre, ayuda, etiquetas, buckets))
+
+    def gauge(self, nombre, ayuda, funcion, etiquetas=()):
+        return self._registrar(Gauge(nombre, ayuda, funcion, etiquetas))
+
+    def exponer(self):
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return '\n'.join(lineas) + '\n'
+
+
+# --- Tiempo en el backend de datos dentro de cada request ---
+_solicitud = threading.local()
+
+
+def iniciar_medicion():
+    """Empieza a acumular el tiempo de backend del request que atiende este hilo"""
+    _solicitud.backend = 0.0
+    _solicitud.activa = True
+
+
+def terminar_medicion():
+    """Devuelve los segundos acumulados en el backend de datos y deja de acumular"""
+    _solicitud.activa = False
+    return getattr(_solicitud, 'backend', 0.0)
+
+
+class RepositorioMedido:
+    """Envuelve un repositorio y mide cada llamada a sus métodos públicos.
+
+    El tiempo se suma al request en curso del hilo (para separar backend de Python) y se
+    observa en `histograma` por operación. Las llamadas de los workers de la cola no tienen
+    request activo y solo cuentan en el histograma.
+    """
+
+    def __init__(self, repositorio, nombre, histograma, backend):
+        self._repositorio = repositorio
+        self._nombre = nombre
+        self._histograma = histograma
+        self._backend = backend
+
+    def __getattr__(self, atributo):
+        valor = getattr(self._repositorio, atributo)
+        if atributo.startswith('_') or not callable(valor):
+            return valor
+        operacion = f"{self._nombre}.{atributo}"
+
+        def medido(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return valor(*args, **kwargs)
+            finally:
+                duracion = time.perf_counter() - inicio
+                self._histograma.observe(duracion, self._backend, operacion)
+                if getattr(_solicitud, 'activa', False):
+                    _solicitud.backend += duracion
+        return medido
+
+
+class SamplingProfiler:
+    """Perfila con cProfile una fracción `tasa` de los requests y guarda los .prof en `directorio`.
+
+    Solo se perfila un request a la vez: los que coinciden con otro en curso no se muestrean.
+    Se conservan como máximo `max_archivos` perfiles (se borran los más antiguos).
+    """
+
+    def __init__(self, tasa=0.0, directorio='profiles', max_archivos=200):
+        self.tasa = tasa
+        self.directorio = directorio
+        self.max_archivos = max_archivos
+        self._ocupado = threading.Lock()
+        self._local = threading.local()
+
+    def iniciar(self):
+        if self.tasa <= 0 or random.random() >= self.tasa or not self._ocupado.acquire(blocking=False):
+            return False
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:  # otra herramienta de profiling ya está activa
+            self._ocupado.release()
+            return False
+        self._local.perfil = perfil
+        return True
+
+    def terminar(self, nombre):
+        """Detiene el perfil del request actual (si hay) y devuelve la ruta del archivo guardado"""
+        perfil = getattr(self._local, 'perfil', None)
+        if perfil is None:
+            return None
+        self._local.perfil = None
+        try:
+            perfil.disable()
+            os.makedirs(self.directorio, exist_ok=True)
+            seguro = ''.join(c if c.isalnum() else '_' for c in nombre).strip('_') or 'raiz'
+            path = os.path.join(self.directorio, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{seguro}.prof")
+            pstats.Stats(perfil).dump_stats(path)
+            self._limpiar()
+            return path
+        finally:
+            self._ocupado.release()
+
+    def _limpiar(self):
+        archivos = sorted(n for n in os.listdir(self.directorio) if n.endswith('.prof'))
+        for nombre in archivos[:max(0, len(archivos) - self.max_archivos)]:
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+            except OSError:
+                pass
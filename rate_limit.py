@@ -0,0 +1,150 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+Decision = namedtuple('Decision', 'permitido restantes retry_after')
+
+
+def parse_limite(valor):
+    """'10/60' -> (10, 60.0): ráfaga de 10 peticiones que se repone por completo en 60 segundos"""
+    try:
+        capacidad, periodo = valor.split('/', 1)
+        capacidad, periodo = int(capacidad), float(periodo)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Límite inválido: {valor!r} (formato esperado: 'peticiones/segundos')")
+    if capacidad <= 0 or periodo <= 0:
+        raise ValueError(f"Límite inválido: {valor!r}")
+    return capacidad, periodo
+
+
+def _rellenar(tokens, actualizado, ahora, capacidad, periodo, costo):
+    """Aplica el token bucket: devuelve (tokens restantes, Decision)"""
+    tasa = capacidad / periodo
+    tokens = min(capacidad, tokens + max(0.0, ahora - actualizado) * tasa)
+    if tokens >= costo:
+        tokens -= costo
+        return tokens, Decision(True, int(tokens), 0.0)
+    return tokens, Decision(False, 0, (costo - tokens) / tasa)
+
+
+class MemoryRateLimitStore:
+    """Token buckets en memoria del proceso; guarda como máximo `max_claves` buckets (LRU)"""
+
+    def __init__(self, max_claves=100000):
+        self.max_claves = max_claves
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consumir(self, clave, capacidad, periodo, costo=1):
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, actualizado = self._buckets.get(clave, (capacidad, ahora))
+            tokens, decision = _rellenar(tokens, actualizado, ahora, capacidad, periodo, costo)
+            self._buckets[clave] = (tokens, ahora)
+            self._buckets.move_to_end(clave)
+            while len(self._buckets) > self.max_claves:
+                self._buckets.popitem(last=False)
+        return decision
+
+
+class SQLiteRateLimitStore:
+    """Token buckets en un archivo SQLite local, compartidos por todos los procesos del host.
+
+    Cada consumo es una transacción BEGIN IMMEDIATE, así que dos workers nunca gastan el mismo token.
+    Los buckets que ya se habrían rellenado por completo se purgan de vez en cuando.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS buckets (
+        clave TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        actualizado REAL NOT NULL,
+        lleno_en REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_buckets_lleno_en ON buckets (lleno_en);
+    """
+
+    def __init__(self, db_path, purgar_cada=1000):
+        self.db_path = db_path
+        self.purgar_cada = purgar_cada
+        self._local = threading.local()
+        self._consumos = 0
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        conn = self._conexion()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def consumir(self, clave, capacidad, periodo, costo=1):
+        ahora = time.time()
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conn.execute("SELECT tokens, actualizado FROM buckets WHERE clave = ?", (clave,)).fetchone()
+            tokens, actualizado = fila if fila else (capacidad, ahora)
+            tokens, decision = _rellenar(tokens, actualizado, ahora, capacidad, periodo, costo)
+            lleno_en = ahora + (capacidad - tokens) * periodo / capacidad
+            conn.execute(
+                "INSERT INTO buckets (clave, tokens, actualizado, lleno_en) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(clave) DO UPDATE SET tokens = excluded.tokens, actualizado = excluded.actualizado, "
+                "lleno_en = excluded.lleno_en", (clave, tokens, ahora, lleno_en))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._consumos += 1
+        if self._consumos % self.purgar_cada == 0:
+            # Un bucket lleno equivale a uno que no existe
+            conn.execute("DELETE FROM buckets WHERE lleno_en < ?", (ahora,))
+        return decision
+
+
+class RateLimiter:
+    """Limita por clave (p. ej. ruta + IP) con token buckets sobre el store configurado.
+
+    Si el store falla (archivo bloqueado, disco lleno) la petición se deja pasar: el limitador
+    protege al backend, no debe convertirse en una causa de caída.
+    """
+
+    def __init__(self, store, habilitado=True):
+        self.store = store
+        self.habilitado = habilitado
+        self.rechazadas = 0
+
+    def consumir(self, clave, capacidad, periodo, costo=1):
+        if not self.habilitado:
+            return Decision(True, capacidad, 0.0)
+        try:
+            decision = self.store.consumir(clave, capacidad, periodo, costo)
+        except sqlite3.Error:
+            return Decision(True, capacidad, 0.0)
+        if not decision.permitido:
+            self.rechazadas += 1
+        return decision
+
+    @staticmethod
+    def segundos_de_espera(decision):
+        return max(1, math.ceil(decision.retry_after))
+
+
+def create_rate_limiter(backend='memory', db_path=None, habilitado=True):
+    """Crea el limitador con el store configurado ('memory' o 'file')"""
+    if backend == 'memory':
+        return RateLimiter(MemoryRateLimitStore(), habilitado)
+    if backend == 'file':
+        return RateLimiter(SQLiteRateLimitStore(db_path), habilitado)
+    raise ValueError(f"Backend de rate limiting desconocido: {backend}")
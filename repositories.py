@@ -0,0 +1,545 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import jwt
+
+import cooperativo
+
+COLUMNAS_ARBOL = "id, especie, latitud, longitud, fecha_siembra, foto_url, user_email"
+BUCKET_FOTOS = "arboles-fotos"
+
+
+# --- Interfaces ---
+class TreeRepository:
+    """Acceso a la tabla de árboles sembrados"""
+
+    def listar(self, limit, offset=0):
+        """Árboles ordenados por fecha_siembra descendente"""
+        raise NotImplementedError
+
+    def pagina(self, limit, despues_de=None):
+        """Página por keyset sobre (fecha_siembra, id) descendente; despues_de = (fecha, id) o None"""
+        raise NotImplementedError
+
+    def todos(self, page_size=1000):
+        raise NotImplementedError
+
+    def insertar(self, arboles):
+        """Inserta una lista de filas y devuelve las filas creadas (con id), en el mismo orden"""
+        raise NotImplementedError
+
+    def actualizar(self, arbol_id, cambios):
+        """Devuelve la fila actualizada, o None si no existe"""
+        raise NotImplementedError
+
+    def eliminar(self, arbol_id):
+        """Devuelve la fila eliminada, o None si no existía"""
+        raise NotImplementedError
+
+
+class PhotoStorage:
+    """Almacenamiento de las fotos de los árboles"""
+
+    def subir(self, path, contenido, content_type, cache_control="31536000", upsert=False):
+        raise NotImplementedError
+
+    def url_publica(self, path):
+        raise NotImplementedError
+
+    def eliminar(self, paths):
+        raise NotImplementedError
+
+    def listar(self):
+        """Lista de {"name": ..., "created_at": ISO o None} de todos los archivos"""
+        raise NotImplementedError
+
+
+class AuthRepository:
+    """Registro, login y gestión de contraseñas.
+
+    Los errores se lanzan como Exception con el mensaje del proveedor
+    ("User already registered", "Invalid login credentials", "Email not confirmed"...).
+    """
+
+    def sign_up(self, email, password, metadata):
+        """Devuelve el usuario creado como dict (con 'id')"""
+        raise NotImplementedError
+
+    def sign_in(self, email, password):
+        """Devuelve (usuario, sesión) como dicts"""
+        raise NotImplementedError
+
+    def reset_password(self, email):
+        raise NotImplementedError
+
+    def refresh_session(self, refresh_token):
+        """Sesión nueva a partir del refresh token de una anterior: (usuario, sesión) como dicts"""
+        raise NotImplementedError
+
+    def get_user(self, token):
+        """Usuario dueño del token como dict, o None si el token no es válido"""
+        raise NotImplementedError
+
+    def update_password(self, token, new_password):
+        """Cambia la contraseña del dueño del access token `token` (ya verificado), actuando como él.
+
+        Devuelve el usuario actualizado como dict.
+        """
+        raise NotImplementedError
+
+
+# --- Backend Supabase ---
+class SupabaseTreeRepository(TreeRepository):
+
+    def __init__(self, client, async_client=None):
+        self.client = client
+        self.async_client = async_client
+
+    def _tabla(self):
+        return self.client.table("arboles_sembrados")
+
+    def listar(self, limit, offset=0):
+        response = self._tabla().select(COLUMNAS_ARBOL) \
+            .limit(limit).offset(offset).order('fecha_siembra', desc=True).execute()
+        return response.data or []
+
+    def pagina(self, limit, despues_de=None):
+        query = self._tabla().select(COLUMNAS_ARBOL)
+        if despues_de:
+            fecha, arbol_id = despues_de
+            query = query.or_(f'fecha_siembra.lt."{fecha}",and(fecha_siembra.eq."{fecha}",id.lt.{int(arbol_id)})')
+        response = query.order('fecha_siembra', desc=True).order('id', desc=True).limit(limit).execute()
+        return response.data or []
+
+    def todos(self, page_size=1000):
+        """Tras la primera página (que trae el conteo exacto), el resto se pide en paralelo"""
+        primera = self._tabla().select(COLUMNAS_ARBOL, count='exact') \
+            .order('id').range(0, page_size - 1).execute()
+        arboles = list(primera.data or [])
+        total = primera.count if primera.count is not None else len(arboles)
+        if total <= len(arboles):
+            return arboles
+
+        if self.async_client is None:
+            for inicio in range(page_size, total, page_size):
+                arboles.extend(self._tabla().select(COLUMNAS_ARBOL)
+                               .order('id').range(inicio, inicio + page_size - 1).execute().data or [])
+            return arboles
+
+        def pagina(inicio):
+            return lambda cliente: cliente.table("arboles_sembrados") \
+                .select(COLUMNAS_ARBOL) \
+                .order('id').range(inicio, inicio + page_size - 1).execute()
+
+        respuestas = self.async_client.gather(*(pagina(inicio) for inicio in range(page_size, total, page_size)))
+        for response in respuestas:
+            arboles.extend(response.data or [])
+        return arboles
+
+    def insertar(self, arboles):
+        response = self._tabla().insert(arboles).execute()
+        if hasattr(response, 'error') and response.error:
+            raise Exception(f"Error de base de datos: {response.error.message}")
+        if not response.data or len(response.data) != len(arboles):
+            raise Exception("No se pudo insertar, respuesta vacía o incompleta.")
+        return response.data
+
+    def actualizar(self, arbol_id, cambios):
+        response = self._tabla().update(cambios).eq("id", arbol_id).execute()
+        if hasattr(response, 'error') and response.error:
+            raise Exception(f"Error de base de datos: {response.error.message}")
+        return response.data[0] if response.data else None
+
+    def eliminar(self, arbol_id):
+        # El delete devuelve la fila eliminada, incluida su foto_url
+        response = self._tabla().delete().eq("id", arbol_id).execute()
+        if hasattr(response, 'error') and response.error:
+            raise Exception(f"Error de base de datos al eliminar: {response.error.message}")
+        return response.data[0] if response.data else None
+
+
+class SupabasePhotoStorage(PhotoStorage):
+
+    def __init__(self, client, bucket=BUCKET_FOTOS):
+        self.client = client
+        self.bucket = bucket
+
+    def _bucket(self):
+        return self.client.storage.from_(self.bucket)
+
+    def subir(self, path, contenido, content_type, cache_control="31536000", upsert=False):
+        self._bucket().upload(
+            path=path,
+            file=contenido,
+            file_options={
+                "content-type": content_type,
+                "cache-control": cache_control,
+                "upsert": "true" if upsert else "false"
+            }
+        )
+
+    def url_publica(self, path):
+        return self._bucket().get_public_url(path)
+
+    def eliminar(self, paths):
+        self._bucket().remove(list(paths))
+
+    def listar(self, page_size=1000):
+        archivos = []
+        offset = 0
+        while True:
+            pagina = self._bucket().list(
+                "", {"limit": page_size, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+            archivos.extend({"name": a.get("name"), "created_at": a.get("created_at")} for a in pagina)
+            if len(pagina) < page_size:
+                return archivos
+            offset += page_size
+
+
+class SupabaseAuthRepository(AuthRepository):
+    """Auth de Supabase con el cliente compartido.
+
+    La contraseña se cambia con PUT /auth/v1/user y el token del usuario del request, por el
+    mismo pool HTTP: la sesión del cliente compartido es la del último login atendido por el
+    proceso, y la API de admin rechaza la anon key.
+    """
+
+    def __init__(self, client, url, key):
+        self.client = client
+        self.key = key
+        self._url_usuario = f"{url.rstrip('/')}/auth/v1/user"
+
+    def sign_up(self, email, password, metadata):
+        response = self.client.auth.sign_up({
+            "email": email,
+            "password": password,
+            "options": {"data": metadata}
+        })
+        if not response or not response.user:
+            raise Exception("Respuesta inesperada del servicio de autenticación.")
+        return response.user.model_dump()
+
+    def sign_in(self, email, password):
+        response = self.client.auth.sign_in_with_password({"email": email, "password": password})
+        if not response.user or not response.session:
+            raise Exception("Invalid login credentials")
+        return response.user.model_dump(), response.session.model_dump()
+
+    def reset_password(self, email):
+        self.client.auth.reset_password_for_email(email)
+
+    def refresh_session(self, refresh_token):
+        response = self.client.auth.refresh_session(refresh_token)
+        if not response.user or not response.session:
+            raise Exception("Invalid Refresh Token")
+        return response.user.model_dump(), response.session.model_dump()
+
+    def get_user(self, token):
+        response = self.client.auth.get_user(token)
+        if not response or not response.user:
+            return None
+        return response.user.model_dump()
+
+    def update_password(self, token, new_password):
+        response = self.client.options.httpx_client.put(
+            self._url_usuario, json={"password": new_password},
+            headers={"apikey": self.key, "Authorization": f"Bearer {token}"})
+        if response.status_code >= 400:
+            try:
+                mensaje = response.json().get("msg") or response.json().get("message")
+            except ValueError:
+                mensaje = None
+            raise Exception(mensaje or f"No se pudo actualizar la contraseña (HTTP {response.status_code}).")
+        return response.json()
+
+
+# --- Backend local (SQLite + sistema de archivos) ---
+LOCAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS arboles_sembrados (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    especie TEXT NOT NULL,
+    latitud REAL NOT NULL,
+    longitud REAL NOT NULL,
+    fecha_siembra TEXT NOT NULL,
+    foto_url TEXT,
+    user_email TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_arboles_fecha_id ON arboles_sembrados (fecha_siembra DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_arboles_especie ON arboles_sembrados (especie);
+CREATE INDEX IF NOT EXISTS idx_arboles_coordenadas ON arboles_sembrados (latitud, longitud);
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    user_metadata TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+_CAMPOS_ARBOL = [c.strip() for c in COLUMNAS_ARBOL.split(",")]
+
+
+class SQLiteDatabase:
+    """Conexión SQLite por hilo sobre un único archivo en modo WAL"""
+
+    def __init__(self, path):
+        self.path = path
+        directorio = os.path.dirname(path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._local = threading.local()
+        self.conexion().executescript(LOCAL_SCHEMA)
+
+    def conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class LocalTreeRepository(TreeRepository):
+
+    def __init__(self, db):
+        self.db = db
+
+    def _filas(self, sql, params=()):
+        return [dict(fila) for fila in self.db.conexion().execute(sql, params).fetchall()]
+
+    def listar(self, limit, offset=0):
+        return self._filas(
+            f"SELECT {COLUMNAS_ARBOL} FROM arboles_sembrados ORDER BY fecha_siembra DESC LIMIT ? OFFSET ?",
+            (limit, offset))
+
+    def pagina(self, limit, despues_de=None):
+        if despues_de:
+            fecha, arbol_id = despues_de
+            return self._filas(
+                f"SELECT {COLUMNAS_ARBOL} FROM arboles_sembrados WHERE (fecha_siembra, id) < (?, ?) "
+                "ORDER BY fecha_siembra DESC, id DESC LIMIT ?", (fecha, int(arbol_id), limit))
+        return self._filas(
+            f"SELECT {COLUMNAS_ARBOL} FROM arboles_sembrados ORDER BY fecha_siembra DESC, id DESC LIMIT ?",
+            (limit,))
+
+    def todos(self, page_size=1000):
+        return self._filas(f"SELECT {COLUMNAS_ARBOL} FROM arboles_sembrados ORDER BY id")
+
+    def insertar(self, arboles):
+        conn = self.db.conexion()
+        conn.execute("BEGIN")
+        try:
+            ids = []
+            for arbol in arboles:
+                cursor = conn.execute(
+                    "INSERT INTO arboles_sembrados (especie, latitud, longitud, fecha_siembra, foto_url, user_email) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (arbol["especie"], arbol["latitud"], arbol["longitud"], arbol["fecha_siembra"],
+                     arbol.get("foto_url"), arbol.get("user_email")))
+                ids.append(cursor.lastrowid)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [dict(arbol, id=arbol_id) for arbol, arbol_id in zip(arboles, ids)]
+
+    def actualizar(self, arbol_id, cambios):
+        columnas = [c for c in cambios if c in _CAMPOS_ARBOL and c != "id"]
+        if columnas:
+            self.db.conexion().execute(
+                f"UPDATE arboles_sembrados SET {', '.join(f'{c} = ?' for c in columnas)} WHERE id = ?",
+                [cambios[c] for c in columnas] + [arbol_id])
+        filas = self._filas(f"SELECT {COLUMNAS_ARBOL} FROM arboles_sembrados WHERE id = ?", (arbol_id,))
+        return filas[0] if filas else None
+
+    def eliminar(self, arbol_id):
+        filas = self._filas(f"DELETE FROM arboles_sembrados WHERE id = ? RETURNING {COLUMNAS_ARBOL}", (arbol_id,))
+        return filas[0] if filas else None
+
+
+class LocalPhotoStorage(PhotoStorage):
+    """Fotos en un directorio local, servidas por la app bajo `url_base`"""
+
+    def __init__(self, directorio, url_base="/media", bucket=BUCKET_FOTOS):
+        self.directorio = os.path.abspath(os.path.join(directorio, bucket))
+        self.url_base = f"{url_base.rstrip('/')}/{bucket}"
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, path):
+        ruta = os.path.realpath(os.path.join(self.directorio, path))
+        if not ruta.startswith(os.path.realpath(self.directorio) + os.sep):
+            raise ValueError(f"Ruta de archivo inválida: {path}")
+        return ruta
+
+    def subir(self, path, contenido, content_type, cache_control="31536000", upsert=False):
+        ruta = self._ruta(path)
+        if os.path.exists(ruta) and not upsert:
+            raise Exception(f"The resource already exists: {path}")
+        tmp = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'wb') as fh:
+            fh.write(contenido)
+        os.replace(tmp, ruta)
+
+    def url_publica(self, path):
+        return f"{self.url_base}/{path}"
+
+    def eliminar(self, paths):
+        for path in paths:
+            try:
+                os.remove(self._ruta(path))
+            except FileNotFoundError:
+                pass
+
+    def listar(self):
+        archivos = []
+        for nombre in sorted(os.listdir(self.directorio)):
+            if nombre.endswith('.tmp'):
+                continue
+            creado = os.path.getmtime(os.path.join(self.directorio, nombre))
+            archivos.append({"name": nombre, "created_at": datetime.fromtimestamp(creado, timezone.utc).isoformat()})
+        return archivos
+
+
+class LocalAuthRepository(AuthRepository):
+    """Usuarios en SQLite con contraseñas PBKDF2 y sesiones JWT HS256 firmadas localmente"""
+
+    ITERACIONES = 200_000
+
+    def __init__(self, db, jwt_secret, expira_en=3600, refresh_expira_en=30 * 24 * 3600):
+        self.db = db
+        self.jwt_secret = jwt_secret
+        self.expira_en = expira_en
+        self.refresh_expira_en = refresh_expira_en
+
+    def _hash(self, password, salt=None):
+        salt = salt or secrets.token_hex(16)
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), self.ITERACIONES)
+        return f"{salt}${digest.hex()}"
+
+    def _usuario(self, fila):
+        return {
+            "id": fila["id"],
+            "email": fila["email"],
+            "user_metadata": json.loads(fila["user_metadata"]),
+            "created_at": fila["created_at"],
+            "aud": "authenticated",
+            "role": "authenticated"
+        }
+
+    def _buscar(self, campo, valor):
+        return self.db.conexion().execute(f"SELECT * FROM usuarios WHERE {campo} = ?", (valor,)).fetchone()
+
+    def sign_up(self, email, password, metadata):
+        fila = {
+            "id": str(uuid.uuid4()),
+            "email": email,
+            "password_hash": self._hash(password),
+            "user_metadata": json.dumps(metadata),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        try:
+            self.db.conexion().execute(
+                "INSERT INTO usuarios (id, email, password_hash, user_metadata, created_at) VALUES (?, ?, ?, ?, ?)",
+                tuple(fila.values()))
+        except sqlite3.IntegrityError:
+            raise Exception("User already registered")
+        return self._usuario(fila)
+
+    def sign_in(self, email, password):
+        fila = self._buscar("email", email)
+        if fila is None:
+            raise Exception("Invalid login credentials")
+        salt = fila["password_hash"].split("$", 1)[0]
+        if not hmac.compare_digest(self._hash(password, salt), fila["password_hash"]):
+            raise Exception("Invalid login credentials")
+
+        usuario = self._usuario(fila)
+        return usuario, self._sesion(usuario)
+
+    def _sesion(self, usuario):
+        ahora = int(time.time())
+        access_token = jwt.encode(
+            {"sub": usuario["id"], "email": usuario["email"], "aud": "authenticated", "role": "authenticated",
+             "user_metadata": usuario["user_metadata"], "iat": ahora, "exp": ahora + self.expira_en},
+            self.jwt_secret, algorithm="HS256")
+        # Audiencia propia: un refresh token no sirve como access token
+        refresh_token = jwt.encode(
+            {"sub": usuario["id"], "aud": "refresh", "jti": secrets.token_urlsafe(16),
+             "iat": ahora, "exp": ahora + self.refresh_expira_en},
+            self.jwt_secret, algorithm="HS256")
+        return {
+            "access_token": access_token,
+            "token_type": "bearer",
+            "expires_in": self.expira_en,
+            "expires_at": ahora + self.expira_en,
+            "refresh_token": refresh_token,
+            "user": usuario
+        }
+
+    def reset_password(self, email):
+        # Sin servidor de correo: el backend local solo confirma la solicitud
+        return None
+
+    def refresh_session(self, refresh_token):
+        try:
+            claims = jwt.decode(refresh_token, self.jwt_secret, algorithms=["HS256"], audience="refresh")
+        except jwt.InvalidTokenError:
+            raise Exception("Invalid Refresh Token")
+        fila = self._buscar("id", claims.get("sub"))
+        if fila is None:
+            raise Exception("Invalid Refresh Token")
+        usuario = self._usuario(fila)
+        return usuario, self._sesion(usuario)
+
+    def get_user(self, token):
+        try:
+            claims = jwt.decode(token, self.jwt_secret, algorithms=["HS256"], audience="authenticated")
+        except jwt.InvalidTokenError:
+            return None
+        fila = self._buscar("id", claims.get("sub"))
+        return self._usuario(fila) if fila is not None else None
+
+    def update_password(self, token, new_password):
+        usuario = self.get_user(token)
+        if usuario is None:
+            raise Exception("User not found")
+        self.db.conexion().execute("UPDATE usuarios SET password_hash = ? WHERE id = ?",
+                                   (self._hash(new_password), usuario["id"]))
+        return usuario
+
+
+# --- Fábrica ---
+def crear_repositorios(backend, **config):
+    """Devuelve un namespace con `arboles`, `fotos` y `auth` para el backend pedido ('supabase' o 'local')"""
+    if backend == 'supabase':
+        from supabase_io import AsyncSupabase, crear_cliente
+        client = crear_cliente(config["url"], config["key"])
+        return SimpleNamespace(
+            backend=backend,
+            # El loop asyncio en su propio hilo no convive con gevent: con greenlets las páginas se leen en serie
+            arboles=SupabaseTreeRepository(client, None if cooperativo.parcheado() else AsyncSupabase(config["url"], config["key"])),
+            fotos=SupabasePhotoStorage(client),
+            auth=SupabaseAuthRepository(client, config["url"], config["key"])
+        )
+    if backend == 'local':
+        db = SQLiteDatabase(config["db_path"])
+        return SimpleNamespace(
+            backend=backend,
+            arboles=LocalTreeRepository(db),
+            fotos=LocalPhotoStorage(config["storage_dir"]),
+            auth=LocalAuthRepository(db, config["jwt_secret"])
+        )
+    raise ValueError(f"Backend de datos desconocido: {backend}")
@@ -0,0 +1,214 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from heapq import nlargest
+
+# Tamaño de celda por defecto: 0.01° ~ 1.1 km en el ecuador
+DEFAULT_CELL_SIZE = 0.01
+
+# Separación mínima (en píxeles de pantalla) entre dos puntos devueltos para un zoom dado
+PIXELES_POR_PUNTO = 4
+
+METROS_POR_GRADO = 111320.0
+RADIO_TIERRA_M = 6371008.8
+
+# Si una búsqueda de vecinos recorrería más celdas finas que esto, se usa la grilla gruesa
+MAX_CELDAS_VECINDAD = 16
+
+
+def distancia_m(lat1, lng1, lat2, lng2):
+    """Distancia en metros entre dos puntos (haversine)"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = p2 - p1
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
+    return 2 * RADIO_TIERRA_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Índice espacial en memoria: grilla uniforme de celdas lat/lng con los árboles de cada celda.
+
+    Con `fine_cell_size` (grados) mantiene además una grilla fina solo con ids, para que `cercanos`
+    revise unas pocas celdas pequeñas aunque la celda gruesa tenga miles de árboles. Para ahorrar
+    memoria la clave es un entero y una celda con un solo árbol guarda el id sin lista.
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE, fine_cell_size=None):
+        if cell_size <= 0:
+            raise ValueError("El tamaño de celda debe ser positivo")
+        self.cell_size = cell_size
+        self.fine_cell_size = fine_cell_size or None
+        self.cargado_en = None
+        self._celdas = defaultdict(dict)
+        self._finas = {}
+        self._arboles = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._arboles)
+
+    def _celda(self, lat, lng):
+        return (math.floor(lng / self.cell_size), math.floor(lat / self.cell_size))
+
+    def _celda_fina(self, lat, lng):
+        return math.floor(lng / self.fine_cell_size), math.floor(lat / self.fine_cell_size)
+
+    def celda_y_vecinas(self, lat, lng):
+        """Celda gruesa de (lat, lng) y sus 8 vecinas: cubren todo punto a menos de una celda"""
+        x, y = self._celda(lat, lng)
+        return [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+    @staticmethod
+    def _clave_fina(x, y):
+        return (x << 32) + y
+
+    def cargar(self, arboles):
+        """Reemplaza todo el contenido del índice por la lista de árboles dada"""
+        with self._lock:
+            self._celdas = defaultdict(dict)
+            self._finas = {}
+            self._arboles = {}
+            for arbol in arboles:
+                self._insertar(arbol)
+            self.cargado_en = time.monotonic()
+
+    def obtener(self, arbol_id):
+        with self._lock:
+            return self._arboles.get(arbol_id)
+
+    def todos(self):
+        with self._lock:
+            return list(self._arboles.values())
+
+    def upsert(self, arbol):
+        """Inserta o reemplaza un árbol; devuelve la versión anterior (o None)"""
+        with self._lock:
+            anterior = self._quitar(arbol.get("id"))
+            self._insertar(arbol)
+            return anterior
+
+    def remove(self, arbol_id):
+        """Quita un árbol del índice; devuelve la versión eliminada (o None)"""
+        with self._lock:
+            return self._quitar(arbol_id)
+
+    def _insertar(self, arbol):
+        arbol_id = arbol.get("id")
+        lat, lng = arbol.get("latitud"), arbol.get("longitud")
+        if arbol_id is None or lat is None or lng is None:
+            return
+        self._arboles[arbol_id] = arbol
+        self._celdas[self._celda(float(lat), float(lng))][arbol_id] = arbol
+        if self.fine_cell_size is not None:
+            clave = self._clave_fina(*self._celda_fina(float(lat), float(lng)))
+            ids = self._finas.get(clave)
+            if ids is None:
+                self._finas[clave] = arbol_id
+            elif isinstance(ids, list):
+                ids.append(arbol_id)
+            else:
+                self._finas[clave] = [ids, arbol_id]
+
+    def _quitar(self, arbol_id):
+        arbol = self._arboles.pop(arbol_id, None)
+        if arbol is None:
+            return None
+        celda = self._celda(float(arbol["latitud"]), float(arbol["longitud"]))
+        contenido = self._celdas.get(celda)
+        if contenido is not None:
+            contenido.pop(arbol_id, None)
+            if not contenido:
+                del self._celdas[celda]
+        if self.fine_cell_size is not None:
+            clave = self._clave_fina(*self._celda_fina(float(arbol["latitud"]), float(arbol["longitud"])))
+            ids = self._finas.get(clave)
+            if isinstance(ids, list):
+                if arbol_id in ids:
+                    ids.remove(arbol_id)
+                if len(ids) == 1:
+                    self._finas[clave] = ids[0]
+            elif ids == arbol_id:
+                del self._finas[clave]
+        return arbol
+
+    def cercanos(self, lat, lng, radio_m, filtro=None):
+        """Árboles a `radio_m` metros o menos del punto, como (distancia, árbol) del más cercano al más lejano.
+
+        `filtro(arbol)` descarta candidatos antes de calcular la distancia.
+        """
+        grados_lat = radio_m / METROS_POR_GRADO
+        grados_lng = radio_m / (METROS_POR_GRADO * max(math.cos(math.radians(lat)), 1e-6))
+        with self._lock:
+            if self.fine_cell_size is not None:
+                x0, y0 = self._celda_fina(lat - grados_lat, lng - grados_lng)
+                x1, y1 = self._celda_fina(lat + grados_lat, lng + grados_lng)
+            if self.fine_cell_size is not None and (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_CELDAS_VECINDAD:
+                candidatos = []
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        ids = self._finas.get(self._clave_fina(x, y))
+                        if ids is None:
+                            continue
+                        if isinstance(ids, list):
+                            candidatos.extend(self._arboles[arbol_id] for arbol_id in ids)
+                        else:
+                            candidatos.append(self._arboles[ids])
+            else:
+                candidatos = self.query(lng - grados_lng, lat - grados_lat, lng + grados_lng, lat + grados_lat)
+
+        encontrados = []
+        for arbol in candidatos:
+            if filtro is not None and not filtro(arbol):
+                continue
+            distancia = distancia_m(lat, lng, float(arbol["latitud"]), float(arbol["longitud"]))
+            if distancia <= radio_m:
+                encontrados.append((distancia, arbol))
+        encontrados.sort(key=lambda par: (par[0], par[1]["id"]))
+        return encontrados
+
+    def query(self, min_lng, min_lat, max_lng, max_lat, limit=None):
+        """Devuelve los árboles dentro del bbox, del más reciente al más antiguo"""
+        cx0, cy0 = self._celda(min_lat, min_lng)
+        cx1, cy1 = self._celda(max_lat, max_lng)
+
+        with self._lock:
+            # Si el bbox cubre más celdas de las que están ocupadas, conviene recorrer las ocupadas
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._celdas):
+                celdas = [c for (cx, cy), c in self._celdas.items()
+                          if cx0 <= cx <= cx1 and cy0 <= cy <= cy1]
+            else:
+                celdas = [self._celdas[(cx, cy)]
+                          for cx in range(cx0, cx1 + 1)
+                          for cy in range(cy0, cy1 + 1)
+                          if (cx, cy) in self._celdas]
+
+            encontrados = [
+                arbol
+                for celda in celdas
+                for arbol in celda.values()
+                if min_lat <= arbol["latitud"] <= max_lat and min_lng <= arbol["longitud"] <= max_lng
+            ]
+
+        clave = lambda arbol: (arbol.get("fecha_siembra") or "", arbol["id"])
+        if limit is not None and limit < len(encontrados):
+            return nlargest(limit, encontrados, key=clave)
+        return sorted(encontrados, key=clave, reverse=True)
+
+
+def decimate_by_zoom(arboles, zoom, pixeles=PIXELES_POR_PUNTO):
+    """Conserva un solo árbol por cada bloque de `pixeles` px a ese nivel de zoom.
+
+    Los puntos que caerían uno encima de otro en pantalla no aportan nada al mapa;
+    se conserva el primero de cada bloque, así que la lista debe venir ordenada por prioridad.
+    """
+    grados_por_bloque = 360.0 / (256 * 2 ** zoom) * pixeles
+    vistos = set()
+    resultado = []
+    for arbol in arboles:
+        bloque = (math.floor(arbol["longitud"] / grados_por_bloque),
+                  math.floor(arbol["latitud"] / grados_por_bloque))
+        if bloque not in vistos:
+            vistos.add(bloque)
+            resultado.append(arbol)
+    return resultado
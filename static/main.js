@@ -64,7 +64,7 @@ document.addEventListener('DOMContentLoaded', () => {
         togglePasswordIcons: document.querySelectorAll('.toggle-password')
     };
 
-    let map = null, marcadorTemporal = null, currentAccessToken = null, currentUser = null;
+    let map = null, marcadorTemporal = null, currentAccessToken = null, currentRefreshToken = null, currentUser = null;
     let profileSelectedFile = null; // Para el avatar del perfil
 
     const puntosReforestacion = [
@@ -104,12 +104,65 @@ document.addEventListener('DOMContentLoaded', () => {
         // TODO: Añadir lógica para mostrar imagen de avatar si 'avatarUrl' se pasa
     };
 
+    // El servidor guarda una miniatura "<nombre>_thumb.webp" junto a cada foto subida.
+    // Las fotos antiguas no la tienen: las <img> usan onerror para volver a la original.
+    const urlMiniatura = (fotoUrl) => {
+        if (!fotoUrl || !fotoUrl.includes('/arboles-fotos/')) return fotoUrl;
+        const [ruta, query] = fotoUrl.split('?');
+        const miniatura = ruta.replace(/\.[a-z0-9]+$/i, '_thumb.webp');
+        return query ? `${miniatura}?${query}` : miniatura;
+    };
+
     const hideAllAuthForms = () => {
         [els.formLogin, els.formRegister, els.formForgotPassword, els.formUpdatePassword, els.registerLink, els.showLoginDiv]
             .filter(Boolean)
             .forEach(el => el.classList.add('hidden'));
     };
 
+    // Headers con el access token de la sesión para las rutas que escriben
+    const authHeaders = (headers = {}) =>
+        currentAccessToken ? { ...headers, 'Authorization': `Bearer ${currentAccessToken}` } : headers;
+
+    const guardarSesion = (session) => {
+        currentAccessToken = session?.access_token || null;
+        currentRefreshToken = session?.refresh_token || null;
+    };
+
+    // Renueva el access token con el refresh token; los requests que lo necesitan a la vez comparten la renovación
+    let renovacionEnCurso = null;
+    const renovarSesion = () => {
+        if (!currentRefreshToken) return Promise.resolve(false);
+        if (!renovacionEnCurso) {
+            renovacionEnCurso = fetch('/api/refresh_token', {
+                 method: 'POST', headers: { 'Content-Type': 'application/json' },
+                 body: JSON.stringify({ refresh_token: currentRefreshToken })
+            })
+                 .then(async (response) => {
+                      if (!response.ok) return false;
+                      guardarSesion((await response.json()).session);
+                      return Boolean(currentAccessToken);
+                 })
+                 .catch(() => false)
+                 .finally(() => { renovacionEnCurso = null; });
+        }
+        return renovacionEnCurso;
+    };
+
+    // fetch con el access token: ante un 401 renueva la sesión y reintenta una vez; si no se puede, pide iniciar sesión
+    const fetchAutenticado = async (url, opciones = {}) => {
+        const enviar = () => fetch(url, { ...opciones, headers: authHeaders(opciones.headers) });
+        let response = await enviar();
+        if (response.status !== 401 || !currentAccessToken) return response;
+        if (await renovarSesion()) {
+             response = await enviar();
+             if (response.status !== 401) return response;
+        }
+        guardarSesion(null);
+        alert('Tu sesión expiró. Inicia sesión de nuevo.');
+        showAuth();
+        return response;
+    };
+
     // --- 3. LÓGICA DE VISTAS ---
     const showApp = (user) => {
         currentUser = user; // --- NUEVO: Almacena el usuario globalmente ---
@@ -131,6 +184,7 @@ document.addEventListener('DOMContentLoaded', () => {
         els.userMenu?.classList.remove('active');
         els.langMenu?.classList.remove('active');
         if (map) { map.remove(); map = null; marcadorTemporal = null;}
+        desconectarEventos();
         showLoginForm();
     };
 
@@ -227,7 +281,14 @@ console.log('Initializing map...');
               map.panTo(e.latlng);
         });
          map.invalidateSize();
+        // Solo se piden los árboles visibles: recargar cuando el usuario mueve o hace zoom
+        let moveendTimer = null;
+        map.on('moveend', () => {
+             clearTimeout(moveendTimer);
+             moveendTimer = setTimeout(cargarArboles, 250);
+        });
         cargarArboles();
+        conectarEventos();
     };
 
     // --- 5. CARGA DE DATOS Y FILTRADO ---
@@ -251,39 +312,90 @@ console.log('Initializing map...');
         });
     };
 
+    // Por debajo de este zoom el mapa muestra clusters agregados en el servidor en vez de un marcador por árbol
+    const ZOOM_MIN_MARCADORES = 15;
+    let cargaArbolesSeq = 0;
+    let modoClusters = false;
+    const marcadoresArboles = new Map(); // id -> marcador, para aplicar los cambios en tiempo real
+
+    const blueIcon = L.icon({
+           iconUrl: 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-blue.png',
+           shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.7/images/marker-shadow.png',
+           iconSize: [25, 41], iconAnchor: [12, 41], popupAnchor: [1, -34], shadowSize: [41, 41]
+    });
+
+    const popupArbol = (arbol) => `
+          <div class="text-center">
+               <b>Especie:</b> ${arbol.especie || 'N/A'}<br>
+               <b>ID:</b> ${arbol.id}
+               ${arbol.foto_url ? `<br><img src="${urlMiniatura(arbol.foto_url)}" onerror="this.onerror=null;this.src='${arbol.foto_url}'" alt="${arbol.especie}" loading="lazy" style="width:100%; max-width:200px; margin-top:8px; border-radius:4px;">` : ''}
+          </div>
+    `;
+
+    const ponerMarcadorArbol = (arbol) => {
+        const existente = marcadoresArboles.get(arbol.id);
+        if (existente) {
+             existente.setLatLng([arbol.latitud, arbol.longitud]).setPopupContent(popupArbol(arbol));
+             return;
+        }
+        marcadoresArboles.set(arbol.id, L.marker([arbol.latitud, arbol.longitud], { icon: blueIcon })
+               .addTo(map)
+               .bindPopup(popupArbol(arbol)));
+    };
+
+    const quitarMarcadorArbol = (id) => {
+        const marcador = marcadoresArboles.get(id);
+        if (marcador) {
+             map.removeLayer(marcador);
+             marcadoresArboles.delete(id);
+        }
+    };
     const cargarArboles = async () => {
         if (!map) return;
         console.log("Cargando árboles plantados...");
+        const seq = ++cargaArbolesSeq;
         try {
-             const response = await fetch('/api/obtener_arboles');
+             const bounds = map.getBounds();
+             const clamp = (v, limite) => Math.max(-limite, Math.min(limite, v));
+             const bbox = [
+                  clamp(bounds.getWest(), 180), clamp(bounds.getSouth(), 90),
+                  clamp(bounds.getEast(), 180), clamp(bounds.getNorth(), 90)
+             ].map(v => v.toFixed(6)).join(',');
+             const zoom = map.getZoom();
+             const usarClusters = zoom < ZOOM_MIN_MARCADORES;
+             const endpoint = usarClusters ? '/api/clusters_arboles' : '/api/obtener_arboles';
+             const response = await fetch(`${endpoint}?bbox=${bbox}&zoom=${zoom}`);
              if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
              const arboles = await response.json();
+             // Si el mapa se movió mientras llegaba la respuesta, se descarta la carga vieja
+             if (seq !== cargaArbolesSeq || !map) return;
 
              map.eachLayer(layer => {
-                  if (layer instanceof L.Marker && layer !== marcadorTemporal && !layer.options.icon?.options?.iconUrl.includes('green')) {
+                  if (layer instanceof L.Marker && layer !== marcadorTemporal && !layer.options.icon?.options?.iconUrl?.includes('green')) {
                        map.removeLayer(layer);
                   }
              });
-
-             arboles.forEach(arbol => {
-                  const blueIcon = L.icon({
-                         iconUrl: 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-blue.png',
-                         shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.7/images/marker-shadow.png',
-                         iconSize: [25, 41], iconAnchor: [12, 41], popupAnchor: [1, -34], shadowSize: [41, 41]
+             marcadoresArboles.clear();
+             modoClusters = usarClusters;
+
+             if (usarClusters) {
+                  arboles.forEach(cluster => {
+                       const size = cluster.count < 10 ? 30 : cluster.count < 100 ? 38 : 46;
+                       const clusterIcon = L.divIcon({
+                              html: `<div style="width:${size}px;height:${size}px;line-height:${size}px;border-radius:50%;background:rgba(37,99,235,0.8);color:#fff;text-align:center;font-weight:600;">${cluster.count}</div>`,
+                              className: '',
+                              iconSize: [size, size]
+                       });
+                       L.marker([cluster.latitud, cluster.longitud], { icon: clusterIcon })
+                             .addTo(map)
+                             .bindTooltip(`${cluster.count} árboles${cluster.especie_dominante ? ` · mayoría ${cluster.especie_dominante}` : ''}`)
+                             .on('click', () => map.setView([cluster.latitud, cluster.longitud], Math.min(zoom + 2, ZOOM_MIN_MARCADORES)));
                   });
+                  console.log(`${arboles.length} clusters cargados en el mapa.`);
+                  return;
+             }
 
-                  const popupContent = `
-                        <div class="text-center">
-                             <b>Especie:</b> ${arbol.especie || 'N/A'}<br>
-                             <b>ID:</b> ${arbol.id}
-                             ${arbol.foto_url ? `<br><img src="${arbol.foto_url}" alt="${arbol.especie}" style="width:100%; max-width:200px; margin-top:8px; border-radius:4px;">` : ''}
-                        </div>
-                  `;
-
-                 L.marker([arbol.latitud, arbol.longitud], { icon: blueIcon })
-                        .addTo(map)
-                        .bindPopup(popupContent);
-             });
+             arboles.forEach(ponerMarcadorArbol);
               console.log(`${arboles.length} árboles cargados en el mapa.`);
         } catch (error) {
               console.error("Error al cargar árboles:", error);
@@ -291,6 +403,81 @@ console.log('Initializing map...');
           }
     };
 
+    // --- Cambios en tiempo real (SSE): el servidor envía diffs de los árboles plantados, editados o eliminados.
+    // EventSource reconecta solo y reenvía Last-Event-ID, así que no se pierden cambios durante un corte.
+    let fuenteEventos = null;
+    let recargaEventosTimer = null;
+    const recargarPorEventos = () => {
+        clearTimeout(recargaEventosTimer);
+        recargaEventosTimer = setTimeout(cargarArboles, 1000);
+    };
+
+    const aplicarCambioArboles = (cambio) => {
+        if (!map) return;
+        // Los clusters se agregan en el servidor: se recargan (agrupando ráfagas de eventos)
+        if (modoClusters) { recargarPorEventos(); return; }
+        if (cambio.accion === 'delete') {
+             cambio.ids.forEach(quitarMarcadorArbol);
+             return;
+        }
+        const bounds = map.getBounds();
+        cambio.arboles.forEach(arbol => {
+             if (bounds.contains([arbol.latitud, arbol.longitud])) {
+                  ponerMarcadorArbol(arbol);
+             } else {
+                  quitarMarcadorArbol(arbol.id);
+             }
+        });
+    };
+
+    // Si el servidor rechaza el stream (p. ej. 503 por límite de conexiones) EventSource no reintenta:
+    // mientras tanto la vista se recarga cada POLL_EVENTOS_MS y el stream se vuelve a intentar más tarde
+    const POLL_EVENTOS_MS = 30000;
+    const REINTENTO_EVENTOS_MS = 60000;
+    let pollEventosTimer = null, reintentoEventosTimer = null;
+
+    const detenerPollingEventos = () => {
+        clearInterval(pollEventosTimer);
+        clearTimeout(reintentoEventosTimer);
+        pollEventosTimer = reintentoEventosTimer = null;
+    };
+
+    const conectarEventos = () => {
+        if (fuenteEventos || !window.EventSource) {
+             if (!window.EventSource && !pollEventosTimer) pollEventosTimer = setInterval(cargarArboles, POLL_EVENTOS_MS);
+             return;
+        }
+        const fuente = fuenteEventos = new EventSource('/api/eventos/arboles');
+        fuente.addEventListener('open', () => {
+             if (!pollEventosTimer) return;
+             detenerPollingEventos();
+             recargarPorEventos();  // lo que cambió entre la última recarga y el stream nuevo
+        });
+        fuente.addEventListener('arboles', (e) => {
+             try {
+                  aplicarCambioArboles(JSON.parse(e.data));
+             } catch (error) {
+                  console.error("Error al aplicar cambio en tiempo real:", error);
+             }
+        });
+        // El servidor ya no tiene los eventos perdidos: se recarga la vista completa
+        fuente.addEventListener('reset', recargarPorEventos);
+        fuente.addEventListener('error', () => {
+             // CONNECTING: corte de red, EventSource reconecta solo. CLOSED: no lo va a hacer
+             if (fuente.readyState !== EventSource.CLOSED || fuenteEventos !== fuente) return;
+             fuenteEventos = null;
+             if (!pollEventosTimer) pollEventosTimer = setInterval(cargarArboles, POLL_EVENTOS_MS);
+             clearTimeout(reintentoEventosTimer);
+             reintentoEventosTimer = setTimeout(conectarEventos, REINTENTO_EVENTOS_MS * (1 + Math.random()));
+        });
+    };
+
+    const desconectarEventos = () => {
+        if (fuenteEventos) { fuenteEventos.close(); fuenteEventos = null; }
+        detenerPollingEventos();
+        clearTimeout(recargaEventosTimer);
+    };
+
     const cargarStats = async () => {
         try {
              const response = await fetch('/api/predecir_horas');
@@ -305,6 +492,9 @@ console.log('Initializing map...');
           }
     };
 
+    // Última lista cargada en la tabla; el modal de edición la reutiliza en vez de volver a pedirla
+    let arbolesTabla = [];
+
     const loadTableData = async () => {
         if (!els.tableBody) return;
         console.log("Cargando datos de la tabla...");
@@ -314,6 +504,7 @@ console.log('Initializing map...');
              const response = await fetch('/api/obtener_arboles');
              if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
              const arboles = await response.json();
+             arbolesTabla = arboles;
              els.tableBody.innerHTML = '';
 
              if (!arboles || arboles.length === 0) {
@@ -338,7 +529,7 @@ console.log('Initializing map...');
                   const usuario = arbol.user_email || 'Desconocido';
 
                   const fotoHtml = arbol.foto_url
-                       ? `<img src="${arbol.foto_url}" alt="${arbol.especie}" class="w-10 h-10 rounded-lg object-cover cursor-pointer hover:scale-110 transition-transform" onclick="window.open('${arbol.foto_url}', '_blank')" title="Click para ver en tamaño completo">`
+                       ? `<img src="${urlMiniatura(arbol.foto_url)}" onerror="this.onerror=null;this.src='${arbol.foto_url}'" alt="${arbol.especie}" loading="lazy" class="w-10 h-10 rounded-lg object-cover cursor-pointer hover:scale-110 transition-transform" onclick="window.open('${arbol.foto_url}', '_blank')" title="Click para ver en tamaño completo">`
                        : `<div class="w-10 h-10 rounded-lg bg-gray-200 flex items-center justify-center" title="Sin foto">
                              <ion-icon name="image-outline" class="text-gray-400 text-xl"></ion-icon>
                           </div>`;
@@ -544,6 +735,7 @@ console.log('Initializing map...');
              if (!response.ok) throw new Error(data.error || 'Credenciales inválidas');
              
              // Aquí se llama a showApp con los datos del usuario
+             guardarSesion(data.session);
              showApp(data.user); 
         } catch (error) {
               console.error("Error login:", error);
@@ -627,15 +819,15 @@ console.log('Initializing map...');
           }
 
          try {
-               const response = await fetch('/api/update_password', {
+               const response = await fetchAutenticado('/api/update_password', {
                     method: 'POST', headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ access_token: currentAccessToken, new_password })
+                    body: JSON.stringify({ new_password })
                });
                const data = await response.json();
                if (!response.ok) throw new Error(data.error || 'Error del servidor');
 
                alert(data.message || "Contraseña actualizada. Inicia sesión.");
-               currentAccessToken = null;
+               guardarSesion(null);
                showLoginForm();
          } catch (error) {
                console.error("Error update password:", error);
@@ -658,7 +850,7 @@ console.log('Initializing map...');
          showConfirmDialog(
               '¿Estás seguro de que deseas cerrar sesión?',
               () => {
-                   currentAccessToken = null;
+                   guardarSesion(null);
                    showAuth();
                    alert('Has cerrado sesión.');
               }
@@ -745,7 +937,7 @@ console.log('Initializing map...');
         uploadProgress?.classList.remove('hidden');
 
         try {
-             const response = await fetch('/api/upload_foto', {
+             const response = await fetchAutenticado('/api/upload_foto', {
                   method: 'POST',
                   body: formData
              });
@@ -787,11 +979,14 @@ console.log('Initializing map...');
 
     const openEditModal = async (arbolId) => {
         try {
-             const response = await fetch(`/api/obtener_arboles`);
-             if (!response.ok) throw new Error('Error al cargar datos');
-             
-             const arboles = await response.json();
-             const arbol = arboles.find(a => a.id === parseInt(arbolId));
+             let arbol = arbolesTabla.find(a => a.id === parseInt(arbolId));
+             if (!arbol) {
+                  const response = await fetch(`/api/obtener_arboles`);
+                  if (!response.ok) throw new Error('Error al cargar datos');
+
+                  const arboles = await response.json();
+                  arbol = arboles.find(a => a.id === parseInt(arbolId));
+             }
              
              if (!arbol) {
                   alert('Árbol no encontrado');
@@ -927,7 +1122,7 @@ console.log('Initializing map...');
                        const formData = new FormData();
                        formData.append('foto', editSelectedFile);
                        
-                       const uploadResponse = await fetch('/api/upload_foto', {
+                       const uploadResponse = await fetchAutenticado('/api/upload_foto', {
                             method: 'POST',
                             body: formData
                        });
@@ -953,7 +1148,7 @@ console.log('Initializing map...');
                   foto_url: fotoUrlToSend
              };
              
-             const response = await fetch(`/api/editar_arbol/${arbolId}`, {
+             const response = await fetchAutenticado(`/api/editar_arbol/${arbolId}`, {
                   method: 'PUT',
                   headers: { 'Content-Type': 'application/json' },
                   body: JSON.stringify(updateData)
@@ -1008,18 +1203,29 @@ console.log('Initializing map...');
                   }
              }
 
-             const response = await fetch('/api/plantar_arbol', {
+             const plantar = (forzar) => fetchAutenticado('/api/plantar_arbol', {
                   method: 'POST', 
                   headers: { 'Content-Type': 'application/json' },
                   body: JSON.stringify({
                        especie: especie.trim(),
                        latitud: parseFloat(latitud),
                        longitud: parseFloat(longitud),
-                       foto_url: uploadedFotoUrl || null
+                       foto_url: uploadedFotoUrl || null,
+                       forzar
                   })
              });
-             
-             const data = await response.json();
+             let response = await plantar(false);
+             let data = await response.json();
+
+             // 409: ya hay un árbol de la misma especie a pocos metros (doble toque o registro repetido)
+             if (response.status === 409 && data.duplicados?.length) {
+                  const cercano = data.duplicados[0];
+                  if (!confirm(`Ya hay un ${cercano.especie} (ID ${cercano.id}) registrado a ${cercano.distancia_m} m. ¿Es un árbol distinto y quieres plantarlo igualmente?`)) {
+                       return;
+                  }
+                  response = await plantar(true);
+                  data = await response.json();
+             }
              if (!response.ok) throw new Error(data.error || 'Error del servidor');
              
              alert(`¡Árbol "${especie}" plantado exitosamente!${selectedFile ? ' (con foto)' : ''}`);
@@ -1027,29 +1233,10 @@ console.log('Initializing map...');
              
              if (btnRemoveFoto) btnRemoveFoto.click();
              
-             if (map) {
-                  const blueIcon = L.icon({
-                         iconUrl: 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-blue.png',
-                         shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.7/images/marker-shadow.png',
-                         iconSize: [25, 41], 
-                         iconAnchor: [12, 41], 
-                         popupAnchor: [1, -34], 
-                         shadowSize: [41, 41]
-                  });
-                 
-                  const popupContent = `
-                        <div class="text-center">
-                             <b>Especie:</b> ${data.especie}<br>
-                             <b>ID:</b> ${data.id}
-                             ${data.foto_url ? `<br><img src="${data.foto_url}" alt="${data.especie}" style="width:100%; max-width:200px; margin-top:8px; border-radius:4px;">` : ''}
-                        </div>
-                  `;
-                 
-                  L.marker([data.latitud, data.longitud], { icon: blueIcon })
-                        .addTo(map)
-                        .bindPopup(popupContent);
-             }
-             
+             // En modo clusters el evento 'insert' recarga los clusters; si no, el mismo marcador
+             // queda registrado y el evento de este árbol no dibuja otro encima
+             if (map && !modoClusters) ponerMarcadorArbol(data);
+
              if (marcadorTemporal) { 
                   marcadorTemporal.remove(); 
                   marcadorTemporal = null; 
@@ -1081,7 +1268,7 @@ console.log('Initializing map...');
                   `¿Seguro que quieres eliminar "${especie}" (ID: ${arbolId})?`,
                   async () => { 
                        try {
-                            const response = await fetch(`/api/eliminar_arbol/${arbolId}`, { method: 'DELETE' });
+                            const response = await fetchAutenticado(`/api/eliminar_arbol/${arbolId}`, { method: 'DELETE' });
                             const result = await response.json();
                             if (!response.ok) throw new Error(result.error || 'Error del servidor');
                             
@@ -1112,7 +1299,7 @@ console.log('Initializing map...');
               window.history.replaceState(null, '', window.location.pathname + window.location.search);
 
              if (type === 'recovery' && accessToken) {
-                  currentAccessToken = accessToken;
+                  guardarSesion({ access_token: accessToken, refresh_token: params.get('refresh_token') });
                   showAuth();
                   showUpdatePasswordForm();
              } else {
@@ -0,0 +1,78 @@
+import threading
+from collections import Counter
+from datetime import datetime
+
+HORAS_POR_ARBOL = 1.5
+TOP_ESPECIES = 10
+
+
+def mes_de(fecha_str):
+    """Devuelve 'AAAA-MM' para una fecha ISO de Supabase, o None si no se puede interpretar"""
+    if not fecha_str or not isinstance(fecha_str, str):
+        return None
+    if fecha_str.endswith('Z'):
+        fecha_str = fecha_str[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(fecha_str).strftime('%Y-%m')
+    except ValueError:
+        return None
+
+
+class EstadisticasArboles:
+    """Agregados del dashboard (por mes, por especie, total) mantenidos en memoria.
+
+    `cargar` los reconstruye desde cero; `add` y `remove` los actualizan en O(1) por escritura.
+    """
+
+    def __init__(self):
+        self._por_mes = Counter()
+        self._especies = Counter()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def cargar(self, arboles):
+        with self._lock:
+            self._por_mes = Counter()
+            self._especies = Counter()
+            self._total = 0
+            for arbol in arboles:
+                self._aplicar(arbol, 1)
+
+    def add(self, arbol):
+        with self._lock:
+            self._aplicar(arbol, 1)
+
+    def remove(self, arbol):
+        with self._lock:
+            self._aplicar(arbol, -1)
+
+    def _aplicar(self, arbol, signo):
+        self._total += signo
+
+        mes = mes_de(arbol.get('fecha_siembra'))
+        if mes:
+            self._ajustar(self._por_mes, mes, signo)
+
+        especie = arbol.get('especie')
+        if especie and especie.strip():
+            self._ajustar(self._especies, especie.strip(), signo)
+
+    @staticmethod
+    def _ajustar(contador, clave, signo):
+        contador[clave] += signo
+        if contador[clave] <= 0:
+            del contador[clave]
+
+    @property
+    def total(self):
+        return self._total
+
+    def horas_estimadas(self):
+        return round(self._total * HORAS_POR_ARBOL, 1)
+
+    def resumen(self, top=TOP_ESPECIES):
+        with self._lock:
+            return {
+                "arboles_por_mes": dict(sorted(self._por_mes.items())),
+                "top_especies": dict(self._especies.most_common(top))
+            }
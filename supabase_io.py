@@ -0,0 +1,189 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+from supabase import acreate_client, create_client
+from supabase.lib.client_options import AsyncClientOptions, SyncClientOptions
+
+POOL_MAX_CONNECTIONS = int(os.environ.get('SUPABASE_POOL_SIZE', 20))
+POOL_MAX_KEEPALIVE = int(os.environ.get('SUPABASE_POOL_KEEPALIVE', 10))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get('SUPABASE_KEEPALIVE_EXPIRY', 30))
+HTTP2 = os.environ.get('SUPABASE_HTTP2', 'True').lower() in ['true', '1', 't']
+TIMEOUT_CONNECT = float(os.environ.get('SUPABASE_TIMEOUT_CONNECT', 5))
+TIMEOUT_READ = float(os.environ.get('SUPABASE_TIMEOUT_READ', 30))
+ASYNC_CONCURRENCIA = int(os.environ.get('SUPABASE_ASYNC_CONCURRENCY', 8))
+
+
+class LatencyRecorder:
+    """Latencias por operación: conteo, errores y percentiles sobre las últimas `ventana` muestras"""
+
+    def __init__(self, ventana=500):
+        self.ventana = ventana
+        self._muestras = {}
+        self._conteos = {}
+        self._errores = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, operacion, segundos, error=False):
+        with self._lock:
+            if operacion not in self._muestras:
+                self._muestras[operacion] = deque(maxlen=self.ventana)
+                self._conteos[operacion] = 0
+                self._errores[operacion] = 0
+            self._muestras[operacion].append(segundos)
+            self._conteos[operacion] += 1
+            if error:
+                self._errores[operacion] += 1
+
+    def resumen(self):
+        with self._lock:
+            copia = {op: (sorted(m), self._conteos[op], self._errores[op]) for op, m in self._muestras.items()}
+        resultado = {}
+        for operacion, (muestras, conteo, errores) in copia.items():
+            percentil = lambda p: round(muestras[min(len(muestras) - 1, int(p * len(muestras)))] * 1000, 2)
+            resultado[operacion] = {
+                "conteo": conteo,
+                "errores": errores,
+                "p50_ms": percentil(0.50),
+                "p95_ms": percentil(0.95),
+                "p99_ms": percentil(0.99),
+                "max_ms": round(muestras[-1] * 1000, 2)
+            }
+        return resultado
+
+
+latencias = LatencyRecorder()
+
+
+def nombre_operacion(request):
+    """'GET rest/arboles_sembrados', 'POST storage/object', 'POST auth/token'..."""
+    partes = [p for p in request.url.path.split('/') if p]
+    if len(partes) >= 3 and partes[1] == 'v1':
+        return f"{request.method} {partes[0]}/{partes[2]}"
+    return f"{request.method} {'/'.join(partes[:2])}"
+
+
+def _on_request(request):
+    request.extensions['inicio'] = time.perf_counter()
+
+
+def _on_response(response):
+    inicio = response.request.extensions.get('inicio')
+    if inicio is not None:
+        latencias.registrar(nombre_operacion(response.request), time.perf_counter() - inicio,
+                            error=response.status_code >= 500)
+
+
+async def _on_request_async(request):
+    _on_request(request)
+
+
+async def _on_response_async(response):
+    _on_response(response)
+
+
+def _limits():
+    return httpx.Limits(max_connections=POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                        keepalive_expiry=POOL_KEEPALIVE_EXPIRY)
+
+
+def _timeout():
+    return httpx.Timeout(TIMEOUT_READ, connect=TIMEOUT_CONNECT)
+
+
+class TransportePorProceso(httpx.BaseTransport):
+    """Transporte HTTP con un pool de conexiones propio en cada proceso.
+
+    Si el app se carga antes de hacer fork (gunicorn --preload), los workers heredarían los
+    sockets abiertos por el proceso maestro y mezclarían sus streams HTTP/2. Tras un fork se
+    crea un pool nuevo; el heredado se abandona sin cerrarlo para no cortar el del padre.
+    """
+
+    def __init__(self, **opciones):
+        self._opciones = opciones
+        self._transporte = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _actual(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._transporte = httpx.HTTPTransport(**self._opciones)
+                    self._pid = os.getpid()
+        return self._transporte
+
+    def handle_request(self, request):
+        return self._actual().handle_request(request)
+
+    def close(self):
+        if self._transporte is not None and self._pid == os.getpid():
+            self._transporte.close()
+
+
+def crear_cliente(url, key):
+    """Cliente síncrono de Supabase cuyo REST, storage y auth comparten un único pool HTTP/2"""
+    http_client = httpx.Client(
+        transport=TransportePorProceso(http2=HTTP2, limits=_limits()), timeout=_timeout(), follow_redirects=True,
+        event_hooks={'request': [_on_request], 'response': [_on_response]})
+    return create_client(url, key, options=SyncClientOptions(httpx_client=http_client))
+
+
+class AsyncSupabase:
+    """Capa de acceso asíncrona: un event loop propio en un hilo de fondo con un AsyncClient de Supabase.
+
+    Permite que código síncrono (las rutas de Flask) lance varias consultas independientes a la vez
+    con `gather`. El loop se crea por proceso, así que es seguro usarlo después de un fork.
+    """
+
+    def __init__(self, url, key, concurrencia=ASYNC_CONCURRENCIA):
+        self.url = url
+        self.key = key
+        self.concurrencia = concurrencia
+        self._loop = None
+        self._cliente = None
+        self._semaforo = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _asegurar_loop(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="supabase-async", daemon=True).start()
+
+            async def inicializar():
+                http_client = httpx.AsyncClient(
+                    http2=HTTP2, limits=_limits(), timeout=_timeout(), follow_redirects=True,
+                    event_hooks={'request': [_on_request_async], 'response': [_on_response_async]})
+                cliente = await acreate_client(self.url, self.key,
+                                               options=AsyncClientOptions(httpx_client=http_client))
+                return cliente, asyncio.Semaphore(self.concurrencia)
+
+            self._cliente, self._semaforo = asyncio.run_coroutine_threadsafe(inicializar(), loop).result()
+            self._loop = loop
+            self._pid = os.getpid()
+
+    def run(self, fabrica, timeout=None):
+        """Ejecuta `fabrica(cliente)` (que devuelve una corrutina) en el loop y espera el resultado"""
+        return self.gather(fabrica, timeout=timeout)[0]
+
+    def gather(self, *fabricas, timeout=None):
+        """Ejecuta varias consultas independientes de forma concurrente; devuelve sus resultados en orden"""
+        self._asegurar_loop()
+
+        async def limitada(fabrica):
+            async with self._semaforo:
+                return await fabrica(self._cliente)
+
+        async def todas():
+            return await asyncio.gather(*(limitada(f) for f in fabricas))
+
+        return asyncio.run_coroutine_threadsafe(todas(), self._loop).result(timeout)
@@ -0,0 +1,72 @@
+import math
+
+import pytest
+
+analytics = pytest.importorskip("analytics")
+if not analytics.disponible():
+    pytest.skip("NumPy no está instalado", allow_module_level=True)
+
+from analytics import AnaliticaArboles  # noqa: E402
+
+
+def arbol(arbol_id, fecha, especie="Ceibo", email="ana@ejemplo.com"):
+    return {"id": arbol_id, "latitud": -1.05, "longitud": -80.45, "fecha_siembra": fecha,
+            "especie": especie, "user_email": email}
+
+
+def serie(arboles, granularidad, **filtros):
+    columnas = AnaliticaArboles()
+    columnas.cargar(arboles)
+    return columnas.resumen(granularidad=granularidad, **filtros)["serie"]
+
+
+def test_semanas_empiezan_el_lunes_iso():
+    # 2024-01-01 fue lunes; 2023-12-31 domingo de la semana anterior
+    arboles = [arbol(1, "2023-12-31"), arbol(2, "2024-01-01"), arbol(3, "2024-01-07T23:59:00+00:00"),
+               arbol(4, "2024-01-08")]
+    assert serie(arboles, "semana") == {"2023-12-25": 1, "2024-01-01": 2, "2024-01-08": 1}
+
+
+def test_semana_que_cruza_el_epoch():
+    # 1970-01-01 fue jueves: su semana empieza el lunes 1969-12-29
+    assert serie([arbol(1, "1970-01-01"), arbol(2, "1970-01-04"), arbol(3, "1970-01-05")], "semana") == {
+        "1969-12-29": 2, "1970-01-05": 1}
+
+
+def test_meses_incluyen_los_vacios_intermedios():
+    arboles = [arbol(1, "2024-01-31"), arbol(2, "2024-01-01"), arbol(3, "2024-03-01")]
+    assert serie(arboles, "mes") == {"2024-01": 2, "2024-02": 0, "2024-03": 1}
+
+
+def test_dias_y_filtro_de_fechas_inclusivo():
+    from datetime import date
+    arboles = [arbol(1, "2024-05-01"), arbol(2, "2024-05-02"), arbol(3, "2024-05-03"), arbol(4, None)]
+    assert serie(arboles, "dia", desde=date(2024, 5, 2), hasta=date(2024, 5, 3)) == {
+        "2024-05-02": 1, "2024-05-03": 1}
+
+
+def test_remove_y_compactacion_conservan_el_resultado():
+    columnas = AnaliticaArboles()
+    arboles = [arbol(i, f"2024-{i % 12 + 1:02d}-15", especie=f"E{i % 3}") for i in range(3000)]
+    columnas.cargar(arboles)
+    for a in arboles[:2000]:
+        columnas.remove(a)
+    columnas.remove(arboles[0])  # repetido: no cambia nada
+
+    esperado = AnaliticaArboles()
+    esperado.cargar(arboles[2000:])
+    assert columnas.resumen() == esperado.resumen()
+    assert columnas._inactivas < 2000  # se compactó
+
+
+def test_diversidad_de_una_sola_especie_es_cero_positivo():
+    columnas = AnaliticaArboles()
+    columnas.cargar([arbol(1, "2024-01-01"), arbol(2, "2024-01-02")])
+    diversidad = columnas.resumen()["diversidad"]
+    assert diversidad["shannon"] == 0.0 and math.copysign(1, diversidad["shannon"]) == 1
+    assert diversidad["riqueza"] == 1
+
+
+def test_granularidad_invalida():
+    with pytest.raises(ValueError):
+        AnaliticaArboles().resumen(granularidad="anio")
@@ -0,0 +1,83 @@
+"""Piezas puras de app.py: cursores de paginación y aplicación idempotente de escrituras"""
+import base64
+import json
+import os
+import tempfile
+
+import pytest
+
+_DATOS = tempfile.mkdtemp(prefix="reforesta-tests-")
+for variable, valor in {"DATA_BACKEND": "local", "DATA_DIR": _DATOS, "LOG_DIR": os.path.join(_DATOS, "logs"),
+                        "LOG_CONSOLE": "false", "ASSETS_BUILD_ON_START": "false", "AUTH_MODE": "off"}.items():
+    os.environ.setdefault(variable, valor)
+
+app = pytest.importorskip("app")
+
+from clusters import TileClusterIndex  # noqa: E402
+from spatial_index import GridIndex  # noqa: E402
+from stats import EstadisticasArboles  # noqa: E402
+
+
+def cursor_de(valor):
+    return base64.urlsafe_b64encode(json.dumps(valor).encode("utf-8")).decode("ascii")
+
+
+@pytest.mark.parametrize("fecha, esperada", [
+    ("2024-05-01T10:00:00+00:00", "2024-05-01T10:00:00+00:00"),
+    ("2024-05-01T10:00:00Z", "2024-05-01T10:00:00+00:00"),
+    ("2024-05-01", "2024-05-01T00:00:00"),
+])
+def test_cursor_ida_y_vuelta(fecha, esperada):
+    assert app.decode_cursor(app.encode_cursor({"id": 7, "fecha_siembra": fecha})) == (esperada, 7)
+
+
+@pytest.mark.parametrize("cursor", [
+    "no-es-base64!",
+    cursor_de({"fecha": "2024-05-01"}),
+    cursor_de(["2024-05-01"]),
+    cursor_de([None, 1]),
+    cursor_de(["2024-05-01,id.gt.0", 1]),
+    cursor_de(["2024-05-01", "uno"]),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode("ascii"),
+])
+def test_cursor_invalido(cursor):
+    with pytest.raises(ValueError, match="Cursor inválido"):
+        app.decode_cursor(cursor)
+
+
+def estructuras():
+    indice = GridIndex(cell_size=0.01, fine_cell_size=0.0005)
+    return indice, TileClusterIndex(max_zoom=10), EstadisticasArboles(), None
+
+
+def foto(indice, clusters, stats):
+    tiles = [{c: (a.count, dict(a.especies)) for c, a in nivel.items()} for nivel in clusters._niveles]
+    return sorted(indice._arboles), tiles, stats.total, stats.resumen()
+
+
+ARBOL = {"id": 1, "latitud": -1.05, "longitud": -80.45, "especie": "Ceibo", "fecha_siembra": "2024-05-01"}
+
+
+def test_repetir_un_insert_o_update_no_duplica():
+    indice, clusters, stats, columnas = estructuras()
+    app.aplicar_cambio('insert', ARBOL, indice, clusters, stats, columnas)
+    una_vez = foto(indice, clusters, stats)
+    app.aplicar_cambio('insert', ARBOL, indice, clusters, stats, columnas)
+    assert foto(indice, clusters, stats) == una_vez
+    assert stats.total == 1
+
+    movido = dict(ARBOL, latitud=-0.5, especie="Guayacán")
+    app.aplicar_cambio('update', movido, indice, clusters, stats, columnas)
+    app.aplicar_cambio('update', movido, indice, clusters, stats, columnas)
+    assert stats.total == 1
+    assert stats.resumen()["top_especies"] == {"Guayacán": 1}
+    assert clusters.query(-81, -2, -79, 0, zoom=0)[0]["count"] == 1
+
+
+def test_repetir_un_delete_no_descuenta_dos_veces():
+    indice, clusters, stats, columnas = estructuras()
+    vacio = foto(indice, clusters, stats)
+    app.aplicar_cambio('insert', ARBOL, indice, clusters, stats, columnas)
+    app.aplicar_cambio('delete', {"id": 1}, indice, clusters, stats, columnas)
+    app.aplicar_cambio('delete', {"id": 1}, indice, clusters, stats, columnas)
+    assert foto(indice, clusters, stats) == vacio
@@ -0,0 +1,44 @@
+from clusters import TileClusterIndex, tile_de
+
+
+def arbol(arbol_id, lat, lng, especie):
+    return {"id": arbol_id, "latitud": lat, "longitud": lng, "especie": especie}
+
+
+def niveles(indice):
+    return [{clave: (a.count, round(a.suma_lat, 9), round(a.suma_lng, 9), dict(a.especies))
+             for clave, a in tiles.items()} for tiles in indice._niveles]
+
+
+def test_add_y_remove_son_simetricos():
+    indice = TileClusterIndex(max_zoom=12)
+    indice.cargar([arbol(1, -1.05, -80.45, "Ceibo"), arbol(2, -1.06, -80.46, "Guayacán")])
+    antes = niveles(indice)
+
+    nuevo = arbol(3, -0.5, -80.1, "Ceibo")
+    indice.add(nuevo)
+    indice.remove(nuevo)
+    assert niveles(indice) == antes
+
+
+def test_remove_de_un_arbol_desconocido_no_crea_tiles():
+    indice = TileClusterIndex(max_zoom=8)
+    indice.remove(arbol(1, 10.0, 10.0, "Ceibo"))
+    assert all(not tiles for tiles in indice._niveles)
+
+
+def test_query_agrega_conteo_centroide_y_especie_dominante():
+    indice = TileClusterIndex(max_zoom=10)
+    indice.cargar([arbol(1, -1.0, -80.0, "Ceibo"), arbol(2, -1.002, -80.002, "Ceibo"),
+                   arbol(3, -1.001, -80.001, "Guayacán")])
+
+    clusters = indice.query(-81, -2, -79, 0, zoom=0)
+    assert len(clusters) == 1
+    assert clusters[0]["count"] == 3
+    assert clusters[0]["latitud"] == -1.001
+    assert clusters[0]["especie_dominante"] == "Ceibo"
+
+
+def test_tile_de_recorta_latitudes_y_longitudes_extremas():
+    assert tile_de(90, 180, 3) == (7, 0)
+    assert tile_de(-90, -180, 3) == (0, 7)
@@ -0,0 +1,56 @@
+import pytest
+
+import rate_limit
+from rate_limit import MemoryRateLimitStore, RateLimiter, _rellenar, parse_limite
+
+
+def test_parse_limite():
+    assert parse_limite("10/60") == (10, 60.0)
+    for invalido in ("10", "0/60", "10/0", "a/b", None):
+        with pytest.raises(ValueError):
+            parse_limite(invalido)
+
+
+def test_rellenar_repone_a_la_tasa_y_no_supera_la_capacidad():
+    # 10 tokens cada 60 s: uno cada 6 s
+    tokens, decision = _rellenar(0.0, 0.0, 3.0, 10, 60, 1)
+    assert not decision.permitido
+    assert tokens == pytest.approx(0.5)
+    assert decision.retry_after == pytest.approx(3.0)
+
+    tokens, decision = _rellenar(0.0, 0.0, 6.0, 10, 60, 1)
+    assert decision.permitido and tokens == pytest.approx(0.0)
+
+    tokens, decision = _rellenar(5.0, 0.0, 10_000.0, 10, 60, 1)
+    assert decision.permitido and decision.restantes == 9
+
+
+def test_rellenar_ignora_relojes_que_retroceden():
+    tokens, _ = _rellenar(2.0, 100.0, 50.0, 10, 60, 0)
+    assert tokens == pytest.approx(2.0)
+
+
+def test_store_en_memoria_agota_la_rafaga_y_se_repone(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: ahora[0])
+    store = MemoryRateLimitStore()
+
+    decisiones = [store.consumir("ruta:ip", 3, 30) for _ in range(4)]
+    assert [d.permitido for d in decisiones] == [True, True, True, False]
+    assert RateLimiter.segundos_de_espera(decisiones[-1]) == 10
+
+    ahora[0] += 10
+    assert store.consumir("ruta:ip", 3, 30).permitido
+    assert store.consumir("otra:ip", 3, 30).restantes == 2
+
+
+def test_store_en_memoria_desaloja_las_claves_menos_usadas():
+    store = MemoryRateLimitStore(max_claves=2)
+    for clave in ("a", "b", "c"):
+        store.consumir(clave, 1, 60)
+    assert list(store._buckets) == ["b", "c"]
+
+
+def test_limitador_deshabilitado_siempre_permite():
+    limitador = RateLimiter(MemoryRateLimitStore(), habilitado=False)
+    assert all(limitador.consumir("x", 1, 60).permitido for _ in range(5))
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from cache import SingleFlight
+
+
+class EventoContado(threading.Event):
+    """Event que cuenta cuántos hilos están esperando"""
+
+    def __init__(self):
+        super().__init__()
+        self.esperando = 0
+
+    def wait(self, timeout=None):
+        self.esperando += 1
+        return super().wait(timeout)
+
+
+def test_llamadas_concurrentes_comparten_un_solo_resultado():
+    vuelos = SingleFlight(timeout=5)
+    empezo, liberar = threading.Event(), threading.Event()
+    llamadas = []
+
+    def lenta():
+        llamadas.append(1)
+        empezo.set()
+        liberar.wait(5)
+        return "resultado"
+
+    resultados = []
+    lider = threading.Thread(target=lambda: resultados.append(vuelos.hacer("k", lenta)))
+    lider.start()
+    empezo.wait(5)
+    evento = vuelos._vuelos["k"]["evento"] = EventoContado()
+    seguidores = [threading.Thread(target=lambda: resultados.append(vuelos.hacer("k", lenta))) for _ in range(3)]
+    for hilo in seguidores:
+        hilo.start()
+    while evento.esperando < 3:
+        time.sleep(0.001)
+    liberar.set()
+    for hilo in [lider] + seguidores:
+        hilo.join(5)
+
+    assert len(llamadas) == 1
+    assert sorted(resultados) == [("resultado", False)] + [("resultado", True)] * 3
+    assert vuelos.compartidas == 3
+    assert vuelos._vuelos == {}
+
+
+def test_el_error_del_lider_llega_a_quien_espera_y_no_queda_guardado():
+    vuelos = SingleFlight(timeout=5)
+    with pytest.raises(RuntimeError):
+        vuelos.hacer("k", lambda: (_ for _ in ()).throw(RuntimeError("falló")))
+    assert vuelos._vuelos == {}
+    assert vuelos.hacer("k", lambda: 42) == (42, False)
+
+
+def test_quien_espera_mas_del_timeout_ejecuta_por_su_cuenta():
+    vuelos = SingleFlight(timeout=0.05)
+    liberar = threading.Event()
+    lider = threading.Thread(target=lambda: vuelos.hacer("k", lambda: liberar.wait(5)))
+    lider.start()
+    while "k" not in vuelos._vuelos:
+        time.sleep(0.001)
+    assert vuelos.hacer("k", lambda: "propio") == ("propio", False)
+    liberar.set()
+    lider.join(5)
@@ -0,0 +1,67 @@
+from spatial_index import GridIndex, distancia_m
+
+
+def arbol(arbol_id, lat, lng, fecha="2024-01-01"):
+    return {"id": arbol_id, "latitud": lat, "longitud": lng, "fecha_siembra": fecha, "especie": "Ceibo"}
+
+
+def estado(indice):
+    celdas = {c: dict(contenido) for c, contenido in indice._celdas.items()}
+    finas = {k: sorted(v) if isinstance(v, list) else v for k, v in indice._finas.items()}
+    return dict(indice._arboles), celdas, finas
+
+
+def test_upsert_y_remove_dejan_el_indice_como_estaba():
+    indice = GridIndex(cell_size=0.01, fine_cell_size=0.0005)
+    indice.cargar([arbol(1, -1.05, -80.45), arbol(2, -1.0501, -80.4501)])
+    antes = estado(indice)
+
+    indice.upsert(arbol(3, -1.05001, -80.45001))
+    assert indice.remove(3)["id"] == 3
+    assert estado(indice) == antes
+    assert indice.remove(3) is None
+
+
+def test_upsert_mueve_el_arbol_de_celda():
+    indice = GridIndex(cell_size=0.01, fine_cell_size=0.0005)
+    indice.upsert(arbol(1, -1.05, -80.45))
+    anterior = indice.upsert(arbol(1, -0.95, -80.30))
+
+    assert anterior["latitud"] == -1.05
+    assert len(indice) == 1
+    assert indice.query(-80.46, -1.06, -80.44, -1.04) == []
+    assert [a["id"] for a in indice.query(-80.31, -0.96, -80.29, -0.94)] == [1]
+    assert indice.cercanos(-1.05, -80.45, 100) == []
+
+
+def test_query_ordena_del_mas_reciente_y_respeta_limit():
+    indice = GridIndex(cell_size=0.01)
+    indice.cargar([arbol(1, 0.001, 0.001, "2024-01-01"), arbol(2, 0.002, 0.002, "2024-03-01"),
+                   arbol(3, 0.015, 0.015, "2024-02-01"), arbol(4, 0.5, 0.5, "2024-04-01")])
+
+    assert [a["id"] for a in indice.query(0, 0, 0.02, 0.02)] == [2, 3, 1]
+    assert [a["id"] for a in indice.query(0, 0, 0.02, 0.02, limit=2)] == [2, 3]
+
+
+def test_cercanos_con_y_sin_grilla_fina_coinciden():
+    arboles = [arbol(i, -1.05 + i * 0.00002, -80.45, f"2024-01-{i + 1:02d}") for i in range(20)]
+    con_fina = GridIndex(cell_size=0.01, fine_cell_size=0.0005)
+    sin_fina = GridIndex(cell_size=0.01)
+    con_fina.cargar(arboles)
+    sin_fina.cargar(arboles)
+
+    encontrados = con_fina.cercanos(-1.05, -80.45, 10)
+    assert encontrados == sin_fina.cercanos(-1.05, -80.45, 10)
+    assert all(d <= 10 for d, _ in encontrados)
+    assert [d for d, _ in encontrados] == sorted(d for d, _ in encontrados)
+    assert {a["id"] for _, a in encontrados} == {a["id"] for a in arboles
+                                                 if distancia_m(-1.05, -80.45, a["latitud"], a["longitud"]) <= 10}
+
+
+def test_celda_y_vecinas_cubre_puntos_a_ambos_lados_de_un_borde():
+    indice = GridIndex(cell_size=0.01)
+    a = set(indice.celda_y_vecinas(-1.0000001, -80.45))
+    b = set(indice.celda_y_vecinas(-0.9999999, -80.45))
+    assert len(a) == 9
+    assert indice._celda(-0.9999999, -80.45) in a
+    assert indice._celda(-1.0000001, -80.45) in b
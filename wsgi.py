@@ -0,0 +1,11 @@
+"""Punto de entrada WSGI para producción: gunicorn -c gunicorn.conf.py wsgi:app
+
+Al importarse compila los assets si hace falta, pre-renderiza la página principal y carga los
+árboles en memoria. Con preload (el default de gunicorn.conf.py) esto ocurre una sola vez en
+el proceso maestro, antes del fork.
+"""
+import os
+
+from app import app, precargar
+
+precargar(datos=os.environ.get('PRELOAD_DATOS', 'True').lower() in ['true', '1', 't'])